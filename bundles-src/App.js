@@ -13,6 +13,13 @@ import NoResults from "./components/NoResults";
 
 import './css/App.css';
 
+function makeIdempotencyKey(){
+  if (window.crypto && window.crypto.randomUUID){
+    return window.crypto.randomUUID();
+  }
+  return `${Date.now().toString(36)}-${Math.random().toString(36).slice(2)}`;
+}
+
 class App extends Component {
 
   constructor(props){
@@ -61,6 +68,13 @@ class App extends Component {
     };
 
     let csrfToken = document.querySelector("[name=csrfmiddlewaretoken]").value;
+    let body = JSON.stringify(data);
+
+    // повтор того же заказа после сетевой ошибки идёт с тем же ключом,
+    // и сервер вернёт уже созданный заказ вместо второго
+    if (!this.checkoutAttempt || this.checkoutAttempt.body !== body){
+      this.checkoutAttempt = {body, key: makeIdempotencyKey()};
+    }
 
     try {
       let response = await fetch(url, {
@@ -69,10 +83,15 @@ class App extends Component {
           'Accept': 'application/json',
           'Content-Type': 'application/json',
           'X-CSRFToken': csrfToken,
+          'Idempotency-Key': this.checkoutAttempt.key,
         },
-        body: JSON.stringify(data),
+        body,
       });
 
+      if (response.status !== 409){
+        // 409 — первый запрос ещё выполняется, ключ пригодится для повтора
+        this.checkoutAttempt = null;
+      }
       if (!response.ok){
         alert('Ошибка при оформлении заказа. Попробуйте ещё раз или свяжитесь с нами по телефону.');
         return;
@@ -7,6 +7,8 @@ from django.http import HttpResponseRedirect
 from django.utils.http import url_has_allowed_host_and_scheme
 
 
+from .availability import set_menu_availability
+from .images import get_thumbnail_url
 from .models import Product, Order, OrderItem
 from .models import ProductCategory
 from .models import Restaurant
@@ -18,6 +20,30 @@ class RestaurantMenuItemInline(admin.TabularInline):
     extra = 0
 
 
+@admin.action(description='Вернуть в продажу все товары')
+def enable_restaurants_menu(modeladmin, request, queryset):
+    changed_count = set_menu_availability(True, restaurant_ids=list(queryset.values_list('id', flat=True)))
+    modeladmin.message_user(request, f'Обновлено пунктов меню: {changed_count}')
+
+
+@admin.action(description='Снять с продажи все товары')
+def disable_restaurants_menu(modeladmin, request, queryset):
+    changed_count = set_menu_availability(False, restaurant_ids=list(queryset.values_list('id', flat=True)))
+    modeladmin.message_user(request, f'Обновлено пунктов меню: {changed_count}')
+
+
+@admin.action(description='Вернуть в продажу во всех ресторанах')
+def enable_products_everywhere(modeladmin, request, queryset):
+    changed_count = set_menu_availability(True, product_ids=list(queryset.values_list('id', flat=True)))
+    modeladmin.message_user(request, f'Обновлено пунктов меню: {changed_count}')
+
+
+@admin.action(description='Снять с продажи во всех ресторанах')
+def disable_products_everywhere(modeladmin, request, queryset):
+    changed_count = set_menu_availability(False, product_ids=list(queryset.values_list('id', flat=True)))
+    modeladmin.message_user(request, f'Обновлено пунктов меню: {changed_count}')
+
+
 class OrderItemInline(admin.TabularInline):
     model = OrderItem
     extra = 0
@@ -38,6 +64,10 @@ class RestaurantAdmin(admin.ModelAdmin):
     inlines = [
         RestaurantMenuItemInline
     ]
+    actions = [
+        enable_restaurants_menu,
+        disable_restaurants_menu,
+    ]
 
 
 @admin.register(Product)
@@ -62,6 +92,10 @@ class ProductAdmin(admin.ModelAdmin):
     inlines = [
         RestaurantMenuItemInline
     ]
+    actions = [
+        enable_products_everywhere,
+        disable_products_everywhere,
+    ]
     fieldsets = (
         ('Общее', {
             'fields': [
@@ -97,14 +131,21 @@ class ProductAdmin(admin.ModelAdmin):
     def get_image_preview(self, obj):
         if not obj.image:
             return 'выберите картинку'
-        return format_html('<img src="{url}" style="max-height: 200px;"/>', url=obj.image.url)
+        return format_html(
+            '<img src="{url}" style="max-height: 200px;"/>',
+            url=get_thumbnail_url(obj, min_width=300),
+        )
     get_image_preview.short_description = 'превью'
 
     def get_image_list_preview(self, obj):
         if not obj.image or not obj.id:
             return 'нет картинки'
         edit_url = reverse('admin:foodcartapp_product_change', args=(obj.id,))
-        return format_html('<a href="{edit_url}"><img src="{src}" style="max-height: 50px;"/></a>', edit_url=edit_url, src=obj.image.url)
+        return format_html(
+            '<a href="{edit_url}"><img src="{src}" style="max-height: 50px;" loading="lazy"/></a>',
+            edit_url=edit_url,
+            src=get_thumbnail_url(obj),
+        )
     get_image_list_preview.short_description = 'превью'
 
 
@@ -114,7 +155,7 @@ class ProductCategoryAdmin(admin.ModelAdmin):
 
 @admin.register(Order)
 class OrderAdmin(admin.ModelAdmin):
-    list_display = ['firstname', 'lastname', 'phonenumber', 'address', 'created_at', 'delivered_at', 'payment_method']
+    list_display = ['firstname', 'lastname', 'phonenumber', 'address', 'created_at', 'delivered_at', 'payment_method', 'total_cost', 'items_count']
     search_fields = ['firstname', 'lastname', 'phonenumber', 'address', 'delivered_at', 'payment_method']
     inlines = [OrderItemInline]
     fieldsets = (
@@ -130,7 +171,8 @@ class OrderAdmin(admin.ModelAdmin):
         }),
         ('Статус и оплата', {
             'fields': [
-                'status', 'payment_method', 'created_at', 'called_at', 'delivered_at'
+                'status', 'payment_method', 'created_at', 'called_at', 'delivered_at',
+                'total_cost', 'items_count'
             ]
         }),
         ('Комментарии', {
@@ -142,7 +184,7 @@ class OrderAdmin(admin.ModelAdmin):
         }),
     )
 
-    readonly_fields = ['created_at']
+    readonly_fields = ['created_at', 'total_cost', 'items_count']
 
     def response_change(self, request, obj):
         if '_continue' not in request.POST:
@@ -166,5 +208,7 @@ class OrderAdmin(admin.ModelAdmin):
                 from django.core.exceptions import ValidationError
                 raise ValidationError('Цена должна быть положительной')
             instance.save()
+        for obj in formset.deleted_objects:
+            obj.delete()
         formset.save_m2m()
 
@@ -4,3 +4,8 @@ from django.apps import AppConfig
 class FoodcartappConfig(AppConfig):
     default_auto_field = 'django.db.models.AutoField'
     name = 'foodcartapp'
+
+    def ready(self):
+        from star_burger import checks  # noqa: F401
+
+        from . import signals  # noqa: F401
@@ -0,0 +1,185 @@
+"""Автоматическое назначение ресторана новым заказам.
+
+Кандидаты — ближайшие рестораны, где есть все товары заказа. Из них
+выбирается тот, у кого меньше всего «расстояние + штраф за загрузку»,
+где загрузка — число открытых заказов ресторана. Заказы пачки разбираются
+вместе: сначала те, у кого меньше всего кандидатов, и каждое назначение
+сразу увеличивает загрузку ресторана для следующих заказов.
+
+Заказ с адресом, который ещё ждёт геокодера, пропускается и будет разобран
+позже. Если назначить некого — нет координат, кандидатов или все они
+перегружены, — заказ помечается разобранным и остаётся менеджеру.
+"""
+import logging
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count
+from django.utils import timezone
+
+from locations.cache import get_coordinates, is_pending
+from star_burger.metrics import registry
+
+from .availability import get_availability_masks, get_capable_restaurant_ids
+from .models import Order, OrderChange, OrderItem
+from .restaurant_index import find_nearest_capable_restaurants, get_restaurant_index
+
+
+logger = logging.getLogger(__name__)
+
+OPEN_ORDER_STATUSES = ['new', 'processing']
+# сколько ближайших ресторанов сравнивать с учётом загрузки
+ASSIGNMENT_CANDIDATES = 10
+ASSIGNMENT_BATCH_SIZE = 100
+# SQL-запросов на приём заказа с тестовым запасом; с автоназначением добавляются
+# блокировка заказов, загрузка ресторанов, наличие, координаты, сохранение
+# назначения и, после сброса, пересборка индекса ресторанов
+ORDER_REGISTRATION_QUERIES = 10
+ORDER_REGISTRATION_WITH_ASSIGNMENT_QUERIES = 23
+
+
+def get_order_registration_budget():
+    """Бюджет query_budget для представлений, принимающих заказы"""
+    if settings.ORDER_AUTO_ASSIGNMENT:
+        return ORDER_REGISTRATION_WITH_ASSIGNMENT_QUERIES
+    return ORDER_REGISTRATION_QUERIES
+
+
+def get_restaurant_loads():
+    """Число открытых заказов по ресторанам: {restaurant_id: заказов}"""
+    return Counter(dict(
+        Order.objects
+        .filter(status__in=OPEN_ORDER_STATUSES, cooking_restaurant__isnull=False)
+        .order_by()
+        .values_list('cooking_restaurant')
+        .annotate(count=Count('pk'))
+    ))
+
+
+def choose_restaurant(candidates, loads):
+    """Кандидат с наименьшей стоимостью среди неперегруженных или None"""
+    max_open_orders = settings.ASSIGNMENT_MAX_OPEN_ORDERS
+    best_restaurant_id, best_cost = None, None
+    for restaurant_id, distance in candidates:
+        if max_open_orders and loads[restaurant_id] >= max_open_orders:
+            continue
+        cost = distance + settings.ASSIGNMENT_LOAD_PENALTY_KM * loads[restaurant_id]
+        if best_cost is None or cost < best_cost:
+            best_restaurant_id, best_cost = restaurant_id, cost
+    return best_restaurant_id
+
+
+def assign_orders(orders, loads=None):
+    """Назначает рестораны пачке заказов без ресторана.
+
+    Возвращает {order_id: restaurant_id или None} для разобранных заказов;
+    заказы с адресом в очереди геокодирования или ещё без ссылки на
+    местоположение в ответ не попадают. Координаты читаются по ссылке
+    order.location, поэтому заказы лучше выбирать с select_related('location').
+    loads можно передать, чтобы учитывать загрузку между пачками.
+    """
+    started_at = time.perf_counter()
+    orders = [order for order in orders if order.cooking_restaurant_id is None]
+    if loads is None:
+        loads = get_restaurant_loads()
+
+    product_ids_by_order = {}
+    for order_id, product_id in OrderItem.objects.filter(order__in=orders).values_list('order_id', 'product_id'):
+        product_ids_by_order.setdefault(order_id, set()).add(product_id)
+    masks = get_availability_masks(
+        {product_id for product_ids in product_ids_by_order.values() for product_id in product_ids}
+    )
+    restaurant_index = get_restaurant_index()
+
+    candidates_by_order = {}
+    for order in orders:
+        location = order.location
+        if location is None or is_pending(location):
+            continue
+        product_ids = product_ids_by_order.get(order.id)
+        point = get_coordinates(location)
+        candidates_by_order[order] = find_nearest_capable_restaurants(
+            point,
+            get_capable_restaurant_ids(product_ids, masks) if product_ids else [],
+            k=ASSIGNMENT_CANDIDATES,
+            method=settings.ORDER_DISTANCE_METHOD,
+            index=restaurant_index,
+        ) if point else []
+
+    assignments = {}
+    checked_at = timezone.now()
+    # меньше кандидатов — раньше выбор, иначе их рестораны займут заказы попроще
+    for order in sorted(candidates_by_order, key=lambda order: (len(candidates_by_order[order]), order.id)):
+        restaurant_id = choose_restaurant(candidates_by_order[order], loads)
+        if restaurant_id is not None:
+            loads[restaurant_id] += 1
+        order.cooking_restaurant_id = restaurant_id
+        order.assignment_checked_at = checked_at
+        assignments[order.id] = restaurant_id
+
+    decided_orders = list(candidates_by_order)
+    if decided_orders:
+        with transaction.atomic():
+            Order.objects.bulk_update(decided_orders, ['cooking_restaurant', 'assignment_checked_at'])
+            OrderChange.objects.record(
+                order_id for order_id, restaurant_id in assignments.items() if restaurant_id is not None
+            )
+
+    duration = time.perf_counter() - started_at
+    assigned_count = sum(restaurant_id is not None for restaurant_id in assignments.values())
+    registry.observe_assignment(duration, checked=len(assignments), assigned=assigned_count)
+    logger.info(
+        'Назначено %s из %s заказов за %.3f с, ждут геокодера: %s',
+        assigned_count, len(assignments), duration, len(orders) - len(assignments),
+    )
+    return assignments
+
+
+def assign_new_orders(orders):
+    """Назначает рестораны только что принятым заказам.
+
+    Заказы блокируются так же, как в process_assignment_queue: те, что уже
+    разбирает воркер, пропускаются, и один заказ не назначается дважды.
+    """
+    with transaction.atomic():
+        orders = list(
+            Order.objects.awaiting_assignment()
+            .filter(pk__in=[order.pk for order in orders])
+            .select_related('location')
+            .select_for_update(skip_locked=True, of=('self',))
+        )
+        return assign_orders(orders)
+
+
+def process_assignment_queue(batch_size=ASSIGNMENT_BATCH_SIZE):
+    """Проходит по всем ждущим заказам пачками, возвращает число разобранных"""
+    loads = get_restaurant_loads()
+    decided = 0
+    last_order_id = 0
+    while True:
+        with transaction.atomic():
+            orders = list(
+                Order.objects.awaiting_assignment()
+                .filter(pk__gt=last_order_id)
+                .select_related('location')
+                .select_for_update(skip_locked=True, of=('self',))
+                .order_by('pk')[:batch_size]
+            )
+            if not orders:
+                return decided
+            last_order_id = orders[-1].pk
+            decided += len(assign_orders(orders, loads))
+
+
+def run_assignment_worker(batch_size=ASSIGNMENT_BATCH_SIZE, idle_sleep=5, once=False):
+    """Разбирает новые заказы; без once ждёт следующих"""
+    decided_total = 0
+    while True:
+        decided = process_assignment_queue(batch_size)
+        decided_total += decided
+        if once:
+            return decided_total
+        if not decided:
+            time.sleep(idle_sleep)
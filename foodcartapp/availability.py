@@ -0,0 +1,174 @@
+"""Индекс наличия товаров: product_id -> битовая маска ресторанов.
+
+Бит с номером restaurant.id выставлен, если товар есть в продаже в этом
+ресторане. Рестораны, которые могут приготовить заказ, находятся одним
+побитовым И по всем товарам заказа.
+
+Индекс обновляют сигналы RestaurantMenuItem. Массовые update() и
+bulk_create() сигналов не шлют: меню так меняет только set_menu_availability,
+которая сама отправляет menu_availability_changed, а после прочих массовых
+правок индекс пересобирает команда rebuild_availability_index.
+"""
+from functools import reduce
+
+from django.core.cache import cache
+from django.db import transaction
+from django.dispatch import Signal
+
+from .catalog import CATALOG_CACHE_TIMEOUT, get_catalog_version
+from .images import get_thumbnail_url
+from .models import Product, ProductAvailability, Restaurant, RestaurantMenuItem
+
+
+# одно событие на массовое изменение меню вместо сигнала на каждую строку;
+# аргументы: restaurant_ids и product_ids, None означает «все»
+menu_availability_changed = Signal()
+
+
+def ids_to_mask(restaurant_ids):
+    mask = 0
+    for restaurant_id in restaurant_ids:
+        mask |= 1 << restaurant_id
+    return mask
+
+
+def mask_to_ids(mask):
+    restaurant_ids = []
+    while mask:
+        lowest_bit = mask & -mask
+        restaurant_ids.append(lowest_bit.bit_length() - 1)
+        mask ^= lowest_bit
+    return restaurant_ids
+
+
+def mask_to_bytes(mask):
+    return mask.to_bytes((mask.bit_length() + 7) // 8, 'little')
+
+
+def refresh_products_availability(product_ids=None):
+    """Пересчитывает маски для указанных товаров (или для всех)"""
+    products = Product.objects.all()
+    menu_items = RestaurantMenuItem.objects.filter(availability=True)
+    if product_ids is not None:
+        products = products.filter(pk__in=product_ids)
+        menu_items = menu_items.filter(product_id__in=product_ids)
+
+    masks = {product_id: 0 for product_id in products.values_list('pk', flat=True)}
+    for product_id, restaurant_id in menu_items.values_list('product_id', 'restaurant_id'):
+        if product_id in masks:
+            masks[product_id] |= 1 << restaurant_id
+
+    with transaction.atomic():
+        # строки удалённых товаров: каскад их убирает, но пересчёт мог начаться
+        # раньше удаления, а полная пересборка чинит индекс после любых правок
+        stale_rows = ProductAvailability.objects.exclude(product_id__in=products.values('pk'))
+        if product_ids is not None:
+            stale_rows = stale_rows.filter(product_id__in=product_ids)
+        stale_rows.delete()
+
+        ProductAvailability.objects.bulk_create(
+            [
+                ProductAvailability(product_id=product_id, restaurants_mask=mask_to_bytes(mask))
+                for product_id, mask in masks.items()
+            ],
+            update_conflicts=True,
+            unique_fields=['product'],
+            update_fields=['restaurants_mask'],
+        )
+    return masks
+
+
+def get_availability_masks(product_ids):
+    """Возвращает {product_id: маска}; товары без записи в индексе получают 0"""
+    masks = dict.fromkeys(product_ids, 0)
+    index_rows = ProductAvailability.objects.filter(product_id__in=masks) \
+        .values_list('product_id', 'restaurants_mask')
+    for product_id, restaurants_mask in index_rows:
+        masks[product_id] = int.from_bytes(restaurants_mask, 'little')
+    return masks
+
+
+def get_capable_restaurant_ids(product_ids, masks):
+    """id ресторанов, где в продаже все товары из product_ids"""
+    if not product_ids:
+        return []
+    common_mask = reduce(
+        lambda left, right: left & right,
+        (masks.get(product_id, 0) for product_id in product_ids),
+    )
+    return mask_to_ids(common_mask)
+
+
+def build_availability_matrix():
+    products = Product.objects.select_related('category').order_by('name', 'id')
+    masks = dict(ProductAvailability.objects.values_list('product_id', 'restaurants_mask'))
+    return {
+        'restaurants': list(Restaurant.objects.order_by('name', 'id').values_list('id', 'name')),
+        'products': [
+            {
+                'id': product.id,
+                'name': product.name,
+                'category': product.category.name if product.category else None,
+                'price': product.price,
+                'image_url': get_thumbnail_url(product),
+                'mask': int.from_bytes(masks.get(product.id, b''), 'little'),
+            }
+            for product in products
+        ],
+    }
+
+
+def get_availability_matrix():
+    """Таблица «товары × рестораны» для менеджера: строки товаров с масками наличия.
+
+    Лежит в кэше под версией каталога, так что правки товаров, ресторанов
+    и меню сразу дают новую таблицу.
+    """
+    cache_key = f'catalog:availability_matrix:{get_catalog_version()}'
+    matrix = cache.get(cache_key)
+    if matrix is None:
+        matrix = build_availability_matrix()
+        cache.set(cache_key, matrix, CATALOG_CACHE_TIMEOUT)
+    return matrix
+
+
+def set_menu_availability(availability, restaurant_ids=None, product_ids=None):
+    """Включает или снимает товары с продажи в ресторанах одним запросом.
+
+    None вместо списка означает все рестораны или все товары. Включение
+    выбранных товаров добавляет недостающие пункты меню, в остальных случаях
+    обновляются только существующие. Возвращает число пунктов меню, у которых
+    наличие действительно изменилось.
+    """
+    with transaction.atomic():
+        menu_items = RestaurantMenuItem.objects.all()
+        if restaurant_ids is not None:
+            menu_items = menu_items.filter(restaurant_id__in=restaurant_ids)
+        if product_ids is not None:
+            menu_items = menu_items.filter(product_id__in=product_ids)
+
+        if availability and product_ids is not None:
+            if restaurant_ids is None:
+                restaurant_ids = list(Restaurant.objects.values_list('id', flat=True))
+            already_available = menu_items.filter(availability=True).count()
+            RestaurantMenuItem.objects.bulk_create(
+                [
+                    RestaurantMenuItem(restaurant_id=restaurant_id, product_id=product_id, availability=True)
+                    for restaurant_id in restaurant_ids
+                    for product_id in product_ids
+                ],
+                update_conflicts=True,
+                unique_fields=['restaurant', 'product'],
+                update_fields=['availability'],
+            )
+            changed_count = len(restaurant_ids) * len(product_ids) - already_available
+        else:
+            # весь ассортимент ресторана не раздуваем: включаем только то, что уже в меню
+            changed_count = menu_items.filter(availability=not availability).update(availability=availability)
+
+        menu_availability_changed.send(
+            sender=RestaurantMenuItem,
+            restaurant_ids=restaurant_ids,
+            product_ids=product_ids,
+        )
+    return changed_count
@@ -0,0 +1,232 @@
+"""Нагрузочные замеры горячих путей: каталог, оформление заказа, страницы менеджера.
+
+Данные генерируются в отдельной тестовой базе, кэш подменяется собственным
+кэшем в памяти, а геокодер — заглушкой, поэтому замеры воспроизводимы,
+не ходят в сеть и не трогают рабочие базу и кэш.
+"""
+import random
+import statistics
+import time
+import tracemalloc
+from decimal import Decimal
+from unittest.mock import patch
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+
+from locations.models import Location
+from locations.normalization import make_address_key
+from locations.utils import link_locations
+
+from .availability import refresh_products_availability
+from .responses import COMPRESSORS
+from .models import Order, OrderItem, Product, ProductCategory, Restaurant, RestaurantMenuItem
+from .utils import percentile
+
+
+STREETS = [
+    'Тверская', 'Арбат', 'Новый Арбат', 'Мясницкая', 'Покровка', 'Маросейка',
+    'Большая Дмитровка', 'Пятницкая', 'Садовая-Кудринская', 'Ленинский проспект',
+    'Профсоюзная', 'Первомайская', 'Вавилова', 'Бауманская', 'Земляной Вал',
+]
+STREET_KINDS = ['ул.', 'улица', '']
+CATEGORIES = ['Бургеры', 'Напитки', 'Десерты', 'Закуски', 'Салаты']
+MOSCOW_CENTER = (55.75, 37.62)
+# сценарий с пустым кэшем чистит его целиком — это должен быть свой кэш
+BENCHMARK_CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'benchmark',
+    },
+}
+
+
+def make_address(rng):
+    kind = rng.choice(STREET_KINDS)
+    return f'Москва, {kind} {rng.choice(STREETS)}, д. {rng.randint(1, 120)}'.replace('  ', ' ')
+
+
+def make_coordinates(rng):
+    return (
+        MOSCOW_CENTER[0] + rng.uniform(-0.25, 0.25),
+        MOSCOW_CENTER[1] + rng.uniform(-0.4, 0.4),
+    )
+
+
+def generate_fixtures(restaurants=20, products=100, orders=1000, geocoded_share=0.9, seed=1):
+    """Создаёт рестораны, меню, товары и заказы с правдоподобными адресами"""
+    rng = random.Random(seed)
+
+    categories = ProductCategory.objects.bulk_create(
+        ProductCategory(name=name) for name in CATEGORIES
+    )
+    products = Product.objects.bulk_create(
+        Product(
+            name=f'Товар {number}',
+            category=rng.choice(categories),
+            price=Decimal(rng.randint(90, 900)),
+            image=f'product_{number}.jpg',
+            special_status=rng.random() < 0.1,
+        )
+        for number in range(products)
+    )
+    restaurants = Restaurant.objects.bulk_create(
+        Restaurant(name=f'Star Burger {number}', address=make_address(rng))
+        for number in range(restaurants)
+    )
+    RestaurantMenuItem.objects.bulk_create(
+        RestaurantMenuItem(restaurant=restaurant, product=product, availability=rng.random() < 0.8)
+        for restaurant in restaurants
+        for product in products
+    )
+
+    orders_to_create = []
+    carts = []
+    for _ in range(orders):
+        cart = [(product, rng.randint(1, 3)) for product in rng.sample(products, rng.randint(1, min(6, len(products))))]
+        carts.append(cart)
+        orders_to_create.append(Order(
+            firstname='Иван',
+            lastname='Петров',
+            phonenumber=f'+7929{rng.randint(1000000, 9999999)}',
+            address=make_address(rng),
+            payment_method=rng.choice(['cash', 'electronic']),
+            status=rng.choice(['new', 'new', 'processing', 'completed']),
+            total_cost=sum(product.price * quantity for product, quantity in cart),
+            items_count=len(cart),
+        ))
+    orders = Order.objects.bulk_create(orders_to_create)
+    OrderItem.objects.bulk_create(
+        OrderItem(order=order, product=product, quantity=quantity, price=product.price)
+        for order, cart in zip(orders, carts)
+        for product, quantity in cart
+    )
+
+    addresses = {restaurant.address for restaurant in restaurants} | {order.address for order in orders}
+    locations = {}
+    for address in addresses:
+        address_key = make_address_key(address)
+        if address_key in locations:
+            continue
+        latitude, longitude = make_coordinates(rng) if rng.random() < geocoded_share else (None, None)
+        locations[address_key] = Location(
+            address=address,
+            address_key=address_key,
+            latitude=latitude,
+            longitude=longitude,
+        )
+    Location.objects.bulk_create(locations.values())
+    # как в проде: заказы и рестораны ссылаются на свои местоположения
+    link_locations(Restaurant.objects.all())
+    link_locations(Order.objects.all())
+
+    refresh_products_availability()
+    return {
+        'restaurants': restaurants,
+        'products': products,
+        'orders': orders,
+    }
+
+
+def stub_request_coordinates(apikey, address, session=None):
+    rng = random.Random(address)
+    return tuple(reversed(make_coordinates(rng)))
+
+
+def measure(name, make_request, iterations):
+    """Запускает make_request iterations раз и собирает задержки, CPU, байты ответа,
+    число запросов и память"""
+    latencies = []
+    cpu_times = []
+    response_sizes = []
+    query_counts = []
+    for _ in range(iterations):
+        with CaptureQueriesContext(connection) as queries:
+            started_at = time.perf_counter()
+            cpu_started_at = time.process_time()
+            response = make_request()
+            cpu_times.append((time.process_time() - cpu_started_at) * 1000)
+            latencies.append((time.perf_counter() - started_at) * 1000)
+        if response.status_code >= 400:
+            raise RuntimeError(f'{name}: ответ {response.status_code}')
+        query_counts.append(len(queries))
+        response_sizes.append(len(response.content))
+
+    # память меряем отдельным прогоном: tracemalloc заметно замедляет код
+    tracemalloc.start()
+    make_request()
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        'name': name,
+        'iterations': iterations,
+        'p50_ms': percentile(latencies, 0.5),
+        'p90_ms': percentile(latencies, 0.9),
+        'p99_ms': percentile(latencies, 0.99),
+        'max_ms': max(latencies),
+        'cpu_ms': statistics.median(cpu_times),
+        'response_bytes': statistics.median(response_sizes),
+        'queries': statistics.median(query_counts),
+        'peak_memory_kb': peak_memory / 1024,
+    }
+
+
+def run_benchmarks(fixtures, iterations=50, seed=1):
+    rng = random.Random(seed)
+    client = Client()
+    manager = User.objects.create_user('benchmark-manager', is_staff=True)
+    manager_client = Client()
+    manager_client.force_login(manager)
+
+    def fetch_catalog_cold():
+        cache.clear()
+        return client.get('/api/products/')
+
+    def register_order():
+        cart = rng.sample(fixtures['products'], rng.randint(1, min(10, len(fixtures['products']))))
+        return client.post('/api/order/', {
+            'firstname': 'Иван',
+            'lastname': 'Петров',
+            'phonenumber': '+79291000000',
+            'address': make_address(rng),
+            'products': [{'product': product.id, 'quantity': 1} for product in cart],
+        }, content_type='application/json')
+
+    scenarios = [
+        ('GET /api/products/ (кэш пуст)', fetch_catalog_cold),
+        ('GET /api/products/', lambda: client.get('/api/products/')),
+        *(
+            (f'GET /api/products/ ({encoding})', lambda encoding=encoding: client.get(
+                '/api/products/', HTTP_ACCEPT_ENCODING=encoding,
+            ))
+            for encoding in COMPRESSORS
+        ),
+        ('GET /api/banners/', lambda: client.get('/api/banners/', HTTP_ACCEPT_ENCODING='gzip')),
+        ('POST /api/order/', register_order),
+        ('GET /manager/orders/', lambda: manager_client.get('/manager/orders/')),
+        ('GET /manager/products/', lambda: manager_client.get('/manager/products/')),
+    ]
+
+    with override_settings(CACHES=BENCHMARK_CACHES), \
+            patch('locations.utils.request_coordinates', stub_request_coordinates):
+        return [measure(name, make_request, iterations) for name, make_request in scenarios]
+
+
+def format_results(results):
+    """Таблица результатов для вывода в консоль"""
+    lines = [
+        f"{'сценарий':<34}{'p50, мс':>10}{'p90, мс':>10}{'p99, мс':>10}"
+        f"{'max, мс':>10}{'CPU, мс':>10}{'байт':>10}{'SQL':>6}{'память, КиБ':>14}"
+    ]
+    for result in results:
+        lines.append(
+            f"{result['name']:<34}{result['p50_ms']:>10.1f}{result['p90_ms']:>10.1f}"
+            f"{result['p99_ms']:>10.1f}{result['max_ms']:>10.1f}{result['cpu_ms']:>10.1f}"
+            f"{result['response_bytes']:>10.0f}{result['queries']:>6.0f}"
+            f"{result['peak_memory_kb']:>14.0f}"
+        )
+    return '\n'.join(lines)
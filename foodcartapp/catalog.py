@@ -0,0 +1,68 @@
+"""Кэш каталога товаров для /api/products/.
+
+В кэше лежат уже сериализованные и сжатые варианты ответа и их ETag. Ключ содержит
+номер версии каталога, который сигналы увеличивают при изменении товаров,
+категорий, ресторанов и их меню, поэтому старые записи просто перестают
+читаться. По той же версии кэшируется таблица наличия для менеджера.
+"""
+import hashlib
+
+from django.core.cache import cache
+
+from star_burger.cache_versions import bump_cache_version, get_cache_version
+
+from .images import get_image_srcset
+from .models import Product
+from .responses import compress_variants, dump_json
+
+
+CATALOG_VERSION_KEY = 'catalog:version'
+CATALOG_CACHE_TIMEOUT = 60 * 60 * 24
+
+
+def get_catalog_version():
+    return get_cache_version(CATALOG_VERSION_KEY)
+
+
+def bump_catalog_version():
+    bump_cache_version(CATALOG_VERSION_KEY)
+
+
+def serialize_products():
+    products = Product.objects.select_related('category').available()
+
+    dumped_products = []
+    for product in products:
+        dumped_product = {
+            'id': product.id,
+            'name': product.name,
+            'price': product.price,
+            'special_status': product.special_status,
+            'description': product.description,
+            'category': {
+                'id': product.category.id,
+                'name': product.category.name,
+            } if product.category else None,
+            'image': product.image.url,
+            'image_srcset': get_image_srcset(product),
+            'restaurant': {
+                'id': product.id,
+                'name': product.name,
+            }
+        }
+        dumped_products.append(dumped_product)
+    return dumped_products
+
+
+def get_catalog():
+    """Возвращает ({кодировка: байты JSON}, etag) для текущей версии каталога"""
+    # версию читаем до запроса в базу: если каталог изменится во время
+    # сборки, свежие данные окажутся под старым ключом, а не наоборот
+    cache_key = f'catalog:products:{get_catalog_version()}'
+    catalog = cache.get(cache_key)
+    if catalog is None:
+        content = dump_json(serialize_products())
+        etag = hashlib.sha256(content).hexdigest()[:32]
+        catalog = (compress_variants(content), etag)
+        cache.set(cache_key, catalog, CATALOG_CACHE_TIMEOUT)
+    return catalog
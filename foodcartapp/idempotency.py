@@ -0,0 +1,139 @@
+"""Заголовок Idempotency-Key: повтор запроса получает сохранённый ответ.
+
+Первый запрос с ключом в одной транзакции вставляет строку IdempotencyKey,
+выполняет представление и сохраняет ответ, так что заказ и ответ на него
+фиксируются вместе. Пока транзакция открыта, незафиксированный уникальный
+ключ держит параллельный повтор: тот дождётся её конца и получит сохранённый
+ответ. Повтор с тем же телом получает сохранённые байты без записи в базу,
+повтор с другим телом — 422. Ответы 5xx и исключения откатывают транзакцию
+целиком: от запроса ничего не остаётся, и клиент может его повторить.
+Ключ без ответа может остаться только от старых версий; он никогда
+не выполняется заново, повтор получает 409.
+
+Ключи принадлежат клиенту: пользователю, а анонимному покупателю — его
+сессии, так что чужой ключ не вернёт чужой ответ. Проверка идёт внутри
+представления DRF, уже после аутентификации, прав и ограничения частоты.
+"""
+import functools
+import hashlib
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.http import HttpResponse, JsonResponse
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+
+from .models import IdempotencyKey
+
+
+IDEMPOTENCY_KEY_MAX_LENGTH = 255
+# вставка ключа в точке сохранения: SAVEPOINT, INSERT и RELEASE или ROLLBACK TO
+KEY_INSERT_QUERIES = 3
+# худший случай: точка сохранения внешней транзакции (в тестах и под
+# ATOMIC_REQUESTS), вставка ключа, чтение занятого ключа, удаление устаревшего,
+# повторная вставка и запись ответа
+IDEMPOTENCY_QUERIES = 2 + KEY_INSERT_QUERIES + 1 + 1 + KEY_INSERT_QUERIES + 1
+
+
+def error_response(message, status):
+    return JsonResponse(
+        {'status': 'error', 'message': message},
+        status=status,
+        json_dumps_params={'ensure_ascii': False},
+    )
+
+
+def is_expired(record):
+    # ключ без ответа не истекает: неизвестно, что сделал его запрос
+    if record.status_code is None:
+        return False
+    return (timezone.now() - record.created_at).total_seconds() > settings.IDEMPOTENCY_KEY_TTL
+
+
+def get_client(request):
+    """Владелец ключей: пользователь или сессия анонимного покупателя"""
+    if request.user.is_authenticated:
+        return f'user:{request.user.pk}'
+    session = getattr(request, 'session', None)
+    if session is not None and session.session_key:
+        return f'session:{session.session_key}'
+    return None
+
+
+def acquire_key(client, key, request_hash):
+    """Возвращает (запись, создана ли она этим запросом); вызывается в транзакции"""
+    while True:
+        try:
+            with transaction.atomic():
+                return IdempotencyKey.objects.create(client=client, key=key, request_hash=request_hash), True
+        except IntegrityError:
+            pass
+        record = IdempotencyKey.objects.filter(client=client, key=key).first()
+        if record is None:
+            continue
+        if not is_expired(record):
+            return record, False
+        # удаляем, только если запись не успел заменить параллельный запрос
+        IdempotencyKey.objects.filter(pk=record.pk, created_at=record.created_at).delete()
+
+
+def replay_response(record, request_hash):
+    if record.request_hash != request_hash:
+        return error_response('Idempotency-Key уже использован с другим телом запроса', 422)
+    if record.status_code is None:
+        return error_response('Результат запроса с этим Idempotency-Key неизвестен, нужен новый ключ', 409)
+    response = HttpResponse(bytes(record.content), status=record.status_code, content_type=record.content_type)
+    response['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def render_content(response):
+    """Тело и тип ответа для повтора; ответ DRF здесь ещё не отрисован"""
+    if isinstance(response, Response):
+        return JSONRenderer().render(response.data), 'application/json'
+    return response.content, response.get('Content-Type', '')
+
+
+def idempotent(view):
+    """Поддержка заголовка Idempotency-Key; ставится под api_view и декораторами политик DRF"""
+    @functools.wraps(view)
+    def wrapper(request, *args, **kwargs):
+        header = request.headers.get('Idempotency-Key')
+        if header is None:
+            return view(request, *args, **kwargs)
+        header = header.strip()
+        if not header or len(header) > IDEMPOTENCY_KEY_MAX_LENGTH:
+            return error_response(
+                f'Idempotency-Key должен быть непустой строкой до {IDEMPOTENCY_KEY_MAX_LENGTH} символов', 400,
+            )
+
+        client = get_client(request)
+        if client is None:
+            # ключ не к кому привязать: без сессии запрос выполняется как обычный
+            return view(request, *args, **kwargs)
+
+        # бюджет проверяет middleware на исходном HttpRequest
+        http_request = request._request
+        if getattr(http_request, 'query_budget', None) is not None:
+            http_request.query_budget += IDEMPOTENCY_QUERIES
+
+        request_hash = hashlib.sha256(request.body).hexdigest()
+        with transaction.atomic():
+            record, created = acquire_key(client, f'{request.path}:{header}', request_hash)
+            if not created:
+                return replay_response(record, request_hash)
+
+            response = view(request, *args, **kwargs)
+            if response.status_code >= 500 or response.streaming:
+                transaction.set_rollback(True)
+                return response
+
+            content, content_type = render_content(response)
+            IdempotencyKey.objects.filter(pk=record.pk).update(
+                status_code=response.status_code,
+                content_type=content_type,
+                content=content,
+            )
+        return response
+    return wrapper
@@ -0,0 +1,176 @@
+"""Уменьшенные копии картинок товаров в JPEG и WebP.
+
+Копии лежат рядом с оригиналами в хранилище под именами с хэшем
+содержимого оригинала, поэтому их можно кэшировать в браузере и CDN
+бессрочно: новая картинка получит новые имена. Описание копий хранится
+в Product.image_variants:
+
+    {'source': 'burger.jpg', 'hash': '…', 'variants': {'webp': [[100, 'имя'], …], 'jpeg': […]}}
+
+Копии создаёт команда generate_image_variants вне запросов админки; копии
+заменённой картинки удаляются, если на них больше не ссылается другой товар.
+"""
+import hashlib
+import io
+import logging
+
+from django.core.files.base import ContentFile
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+from .models import Product
+
+
+logger = logging.getLogger(__name__)
+
+IMAGE_VARIANT_WIDTHS = (100, 300, 600)
+IMAGE_VARIANTS_DIR = 'variants'
+
+# формат Pillow, расширение и параметры сохранения; порядок — порядок
+# <source> в <picture>: браузер берёт первый поддерживаемый
+IMAGE_VARIANT_FORMATS = {
+    'webp': ('WEBP', 'webp', {'quality': 80, 'method': 6}),
+    'jpeg': ('JPEG', 'jpg', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+
+
+def get_variant_widths(original_width):
+    """Ширины копий без увеличения: маленький оригинал даёт одну копию своей ширины"""
+    widths = [width for width in IMAGE_VARIANT_WIDTHS if width < original_width]
+    if len(widths) < len(IMAGE_VARIANT_WIDTHS):
+        widths.append(original_width)
+    return widths
+
+
+def resize_progressively(image, widths):
+    """{ширина: картинка}; каждая копия уменьшается из предыдущей, а не из оригинала.
+
+    Первая копия считается с reducing_gap: Pillow сначала грубо ужимает
+    большой оригинал и только потом применяет LANCZOS.
+    """
+    resized_by_width = {}
+    source = image
+    for width in sorted(widths, reverse=True):
+        height = max(1, round(image.height * width / image.width))
+        if (width, height) == source.size:
+            resized = source
+        else:
+            resized = source.resize((width, height), Image.LANCZOS, reducing_gap=3.0)
+        resized_by_width[width] = source = resized
+    return resized_by_width
+
+
+def render_variant(resized, image_format, options):
+    if image_format == 'JPEG' and resized.mode != 'RGB':
+        # у JPEG нет прозрачности: кладём картинку на белый фон
+        background = Image.new('RGB', resized.size, 'white')
+        background.paste(resized, mask=resized.getchannel('A') if 'A' in resized.getbands() else None)
+        resized = background
+    buffer = io.BytesIO()
+    resized.save(buffer, image_format, **options)
+    return buffer.getvalue()
+
+
+def generate_image_variants(product, force=False):
+    """Создаёт недостающие копии картинки товара и сохраняет их описание.
+
+    Возвращает True, если появились копии, — тогда вызывающему нужно
+    сбросить кэш каталога. Битая, пропавшая или слишком большая картинка
+    пишется в лог, а у товара остаётся только оригинал.
+    """
+    if not product.image:
+        return False
+    if not force and product.image_variants.get('source') == product.image.name:
+        return False
+
+    storage = product.image.storage
+    try:
+        with storage.open(product.image.name, 'rb') as image_file:
+            content = image_file.read()
+        image = ImageOps.exif_transpose(Image.open(io.BytesIO(content)))
+        image.load()
+    except (OSError, UnidentifiedImageError, Image.DecompressionBombError) as e:
+        logger.warning('Не удалось прочитать картинку товара %s (%s): %s', product.pk, product.image.name, e)
+        # запоминаем картинку, чтобы обработчик не брал её снова; --force повторит попытку
+        product.image_variants = {'source': product.image.name, 'variants': {}}
+        Product.objects.filter(pk=product.pk).update(image_variants=product.image_variants)
+        return False
+
+    if image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA' if 'transparency' in image.info or 'A' in image.getbands() else 'RGB')
+
+    content_hash = hashlib.sha256(content).hexdigest()[:16]
+    widths = get_variant_widths(image.width)
+    resized_by_width = None
+    variants = {}
+    for variant_format, (image_format, extension, options) in IMAGE_VARIANT_FORMATS.items():
+        variants[variant_format] = []
+        for width in widths:
+            name = f'{IMAGE_VARIANTS_DIR}/{content_hash}-{width}.{extension}'
+            # имя зависит только от содержимого, так что готовую копию не пересчитываем
+            if not storage.exists(name):
+                if resized_by_width is None:
+                    resized_by_width = resize_progressively(image, widths)
+                name = storage.save(name, ContentFile(render_variant(resized_by_width[width], image_format, options)))
+            variants[variant_format].append([width, name])
+
+    old_variants = product.image_variants
+    product.image_variants = {
+        'source': product.image.name,
+        'hash': content_hash,
+        'variants': variants,
+    }
+    # update, а не save: сохранение товара снова запустило бы генерацию
+    Product.objects.filter(pk=product.pk).update(image_variants=product.image_variants)
+    delete_unused_variants(old_variants, storage)
+    return True
+
+
+def delete_unused_variants(image_variants, storage):
+    """Удаляет из хранилища копии, на которые не ссылается ни один товар"""
+    content_hash = image_variants.get('hash')
+    if not content_hash or Product.objects.filter(image_variants__hash=content_hash).exists():
+        return
+    for names in image_variants.get('variants', {}).values():
+        for _, name in names:
+            storage.delete(name)
+
+
+def process_image_variants(batch_size=20):
+    """Создаёт копии для пачки товаров с новой картинкой.
+
+    Возвращает (сколько товаров разобрано, у скольких появились копии).
+    """
+    products = list(Product.objects.without_image_variants().order_by('pk')[:batch_size])
+    updated = sum(generate_image_variants(product) for product in products)
+    return len(products), updated
+
+
+def get_image_variant_urls(product, variant_format):
+    """[(ширина, url)] по возрастанию ширины; пусто, если копий ещё нет"""
+    if product.image_variants.get('source') != product.image.name:
+        return []
+    storage = product.image.storage
+    return [
+        (width, storage.url(name))
+        for width, name in product.image_variants.get('variants', {}).get(variant_format, [])
+    ]
+
+
+def get_image_srcset(product):
+    """{'webp': 'url 100w, url 300w, …', 'jpeg': …} для атрибута srcset"""
+    return {
+        variant_format: ', '.join(f'{url} {width}w' for width, url in urls)
+        for variant_format in IMAGE_VARIANT_FORMATS
+        if (urls := get_image_variant_urls(product, variant_format))
+    }
+
+
+def get_thumbnail_url(product, min_width=IMAGE_VARIANT_WIDTHS[0], variant_format='jpeg'):
+    """Самая узкая копия не уже min_width, а без копий — оригинал"""
+    if not product.image:
+        return None
+    urls = get_image_variant_urls(product, variant_format)
+    for width, url in urls:
+        if width >= min_width:
+            return url
+    return urls[-1][1] if urls else product.image.url
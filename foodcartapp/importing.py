@@ -0,0 +1,169 @@
+"""Загрузка записанных заказов из JSON Lines: в базу пачками или повтором по HTTP.
+
+Каждая строка файла — тело запроса к /api/order/.
+"""
+import json
+import time
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from locations.geocoder import create_session
+
+from .models import Product
+from .serializers import OrderSerializer
+
+
+IMPORT_BATCH_SIZE = 500
+
+
+class ImportStats:
+    def __init__(self):
+        self.processed = 0
+        self.created = 0
+        self.rejected = 0
+        self.started_at = time.perf_counter()
+
+    @property
+    def elapsed(self):
+        return time.perf_counter() - self.started_at
+
+    @property
+    def throughput(self):
+        return self.processed / self.elapsed if self.elapsed else 0
+
+
+def read_payloads(lines):
+    """Отдаёт (номер строки, заказ или None, ошибка разбора); пустые строки пропускаются"""
+    for line_number, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+        try:
+            payload = json.loads(line)
+        except ValueError as e:
+            yield line_number, None, f'Некорректный JSON: {e}'
+            continue
+        if not isinstance(payload, dict):
+            yield line_number, None, 'Ожидался JSON-объект заказа'
+            continue
+        yield line_number, payload, None
+
+
+def collect_product_ids(payloads):
+    product_ids = set()
+    for payload in payloads:
+        products = payload.get('products')
+        if not isinstance(products, list):
+            continue
+        for item in products:
+            if not isinstance(item, dict):
+                continue
+            try:
+                product_ids.add(int(item.get('product')))
+            except (TypeError, ValueError):
+                pass
+    return product_ids
+
+
+def validate_order_payloads(payloads):
+    """Проверяет заказы по правилам OrderSerializer, загружая товары одним запросом.
+
+    Возвращает годные заказы {индекс: validated_data} и ошибки {индекс: ошибки}.
+    """
+    products = Product.objects.in_bulk(
+        collect_product_ids(payload for payload in payloads if isinstance(payload, dict))
+    )
+    valid_orders = {}
+    errors = {}
+    for index, payload in enumerate(payloads):
+        if not isinstance(payload, dict):
+            errors[index] = 'Ожидался JSON-объект заказа'
+            continue
+        serializer = OrderSerializer(data=payload, context={'products': products})
+        if serializer.is_valid():
+            valid_orders[index] = serializer.validated_data
+        else:
+            errors[index] = serializer.errors
+    return valid_orders, errors
+
+
+def import_batch(batch, stats, on_reject=None):
+    """Проверяет пачку по правилам OrderSerializer и создаёт годные заказы разом"""
+    valid_orders, errors = validate_order_payloads([payload for _, payload, _ in batch])
+
+    for index, (line_number, payload, error) in enumerate(batch):
+        stats.processed += 1
+        if index in valid_orders:
+            continue
+        stats.rejected += 1
+        if on_reject:
+            on_reject(line_number, error or errors[index])
+
+    if valid_orders:
+        OrderSerializer(many=True).create(list(valid_orders.values()))
+        stats.created += len(valid_orders)
+
+
+def import_orders(lines, batch_size=IMPORT_BATCH_SIZE, on_reject=None, on_batch=None):
+    """Загружает заказы в базу; каждая пачка — отдельная транзакция"""
+    stats = ImportStats()
+    batch = []
+    for record in read_payloads(lines):
+        batch.append(record)
+        if len(batch) >= batch_size:
+            import_batch(batch, stats, on_reject)
+            batch = []
+            if on_batch:
+                on_batch(stats)
+    if batch:
+        import_batch(batch, stats, on_reject)
+        if on_batch:
+            on_batch(stats)
+    return stats
+
+
+def replay_orders(lines, url, concurrency=8, timeout=10):
+    """Отправляет заказы на url в concurrency потоков.
+
+    Возвращает статистику, задержки ответов в секундах и число ответов
+    по кодам статуса (0 — ошибка соединения). В очереди держится не больше
+    нескольких запросов на поток, так что файл любого размера читается потоком.
+    """
+    stats = ImportStats()
+    latencies = []
+    status_codes = Counter()
+    session = create_session(pool_size=concurrency)
+
+    def send(payload):
+        started_at = time.perf_counter()
+        try:
+            status_code = session.post(url, json=payload, timeout=timeout).status_code
+        except requests.RequestException:
+            status_code = 0
+        return status_code, time.perf_counter() - started_at
+
+    def collect(future):
+        status_code, latency = future.result()
+        stats.processed += 1
+        latencies.append(latency)
+        status_codes[status_code] += 1
+        if status_code == 200:
+            stats.created += 1
+        else:
+            stats.rejected += 1
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        pending = deque()
+        for _, payload, _ in read_payloads(lines):
+            if payload is None:
+                stats.processed += 1
+                stats.rejected += 1
+                continue
+            pending.append(executor.submit(send, payload))
+            if len(pending) >= concurrency * 4:
+                collect(pending.popleft())
+        while pending:
+            collect(pending.popleft())
+
+    return stats, latencies, status_codes
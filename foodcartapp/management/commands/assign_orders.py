@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand
+
+from foodcartapp.assignment import ASSIGNMENT_BATCH_SIZE, run_assignment_worker
+
+
+class Command(BaseCommand):
+    help = 'Фоновое назначение ресторанов новым заказам с учётом наличия, расстояния и загрузки'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=ASSIGNMENT_BATCH_SIZE,
+            help='сколько заказов разбирать за одну транзакцию',
+        )
+        parser.add_argument(
+            '--sleep',
+            type=float,
+            default=5,
+            help='пауза в секундах, когда новых заказов нет',
+        )
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='разобрать ждущие заказы и завершиться',
+        )
+
+    def handle(self, *args, **options):
+        self.stdout.write('Автоназначение ресторанов запущено')
+
+        decided = run_assignment_worker(
+            batch_size=options['batch_size'],
+            idle_sleep=options['sleep'],
+            once=options['once'],
+        )
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Разобрано {decided} заказов'
+            )
+        )
@@ -0,0 +1,48 @@
+import json
+import logging
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import override_settings, setup_test_environment, teardown_test_environment
+
+from foodcartapp.benchmarks import BENCHMARK_CACHES, format_results, generate_fixtures, run_benchmarks
+
+
+class Command(BaseCommand):
+    help = 'Замеряет задержки, число SQL-запросов и память на горячих путях API и страниц менеджера'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--restaurants', type=int, default=20)
+        parser.add_argument('--products', type=int, default=100)
+        parser.add_argument('--orders', type=int, default=1000)
+        parser.add_argument('--iterations', type=int, default=50, help='запросов на каждый сценарий')
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--json', dest='json_path', help='сохранить результаты в JSON-файл')
+
+    def handle(self, *args, **options):
+        # построчный лог метрик на каждый запрос только мешает читать таблицу
+        logging.getLogger('star_burger.metrics').setLevel(logging.WARNING)
+        # замеры идут в отдельной тестовой базе и своём кэше, рабочие данные не трогаются
+        setup_test_environment()
+        old_database_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            with override_settings(DEBUG=False, CACHES=BENCHMARK_CACHES):
+                self.stdout.write('Генерируем данные...')
+                fixtures = generate_fixtures(
+                    restaurants=options['restaurants'],
+                    products=options['products'],
+                    orders=options['orders'],
+                    seed=options['seed'],
+                )
+                results = run_benchmarks(fixtures, iterations=options['iterations'], seed=options['seed'])
+        finally:
+            connection.creation.destroy_test_db(old_database_name, verbosity=0)
+            teardown_test_environment()
+
+        self.stdout.write(format_results(results))
+
+        if options['json_path']:
+            with open(options['json_path'], 'w') as json_file:
+                json.dump(results, json_file, ensure_ascii=False, indent=4)
+            self.stdout.write(self.style.SUCCESS(f"Результаты сохранены в {options['json_path']}"))
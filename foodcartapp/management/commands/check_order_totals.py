@@ -0,0 +1,49 @@
+from django.core.management.base import BaseCommand
+from django.db.models import F, Q
+
+from foodcartapp.models import Order
+
+
+class Command(BaseCommand):
+    help = 'Сверяет сохранённые суммы и число позиций заказов с их составом'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--fix',
+            action='store_true',
+            help='пересчитать заказы, у которых суммы разошлись',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='сколько заказов исправлять одним запросом',
+        )
+
+    def handle(self, *args, **options):
+        mismatched_ids = list(
+            Order.objects.with_calculated_totals()
+            .filter(
+                ~Q(total_cost=F('calculated_total_cost')) |
+                ~Q(items_count=F('calculated_items_count'))
+            )
+            .values_list('pk', flat=True)
+        )
+
+        if not mismatched_ids:
+            self.stdout.write(self.style.SUCCESS('Суммы всех заказов сходятся'))
+            return
+
+        self.stdout.write(
+            self.style.WARNING(f'Суммы расходятся у {len(mismatched_ids)} заказов')
+        )
+        if not options['fix']:
+            return
+
+        batch_size = options['batch_size']
+        for start in range(0, len(mismatched_ids), batch_size):
+            Order.objects.filter(pk__in=mismatched_ids[start:start + batch_size]).refresh_totals()
+
+        self.stdout.write(
+            self.style.SUCCESS(f'Пересчитано {len(mismatched_ids)} заказов')
+        )
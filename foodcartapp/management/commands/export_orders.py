@@ -0,0 +1,47 @@
+import sys
+from datetime import date
+
+from django.core.management.base import BaseCommand
+
+from foodcartapp.export import EXPORT_CHUNK_SIZE, EXPORT_FORMATS, export_orders, filter_orders_for_export
+from foodcartapp.models import Order
+
+
+class Command(BaseCommand):
+    help = 'Выгружает заказы с позициями, суммами, рестораном и координатами в CSV или JSON Lines'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=list(EXPORT_FORMATS), default='csv')
+        parser.add_argument('--from', dest='created_from', type=date.fromisoformat, help='ГГГГ-ММ-ДД, включительно')
+        parser.add_argument('--to', dest='created_to', type=date.fromisoformat, help='ГГГГ-ММ-ДД, включительно')
+        parser.add_argument(
+            '--status', action='append', choices=[status for status, _ in Order.STATUS_CHOICES],
+            help='можно указать несколько раз',
+        )
+        parser.add_argument('--gzip', action='store_true')
+        parser.add_argument('--chunk-size', type=int, default=EXPORT_CHUNK_SIZE)
+        parser.add_argument('--output', '-o', help='файл для выгрузки, по умолчанию stdout')
+
+    def handle(self, *args, **options):
+        orders = filter_orders_for_export(
+            Order.objects.all(),
+            created_from=options['created_from'],
+            created_to=options['created_to'],
+            statuses=options['status'],
+        )
+        chunks = export_orders(
+            orders,
+            options['format'],
+            compress=options['gzip'],
+            chunk_size=options['chunk_size'],
+        )
+
+        output = open(options['output'], 'wb') if options['output'] else sys.stdout.buffer
+        try:
+            for chunk in chunks:
+                output.write(chunk)
+        finally:
+            if options['output']:
+                output.close()
+            else:
+                output.flush()
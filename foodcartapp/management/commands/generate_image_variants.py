@@ -0,0 +1,54 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from foodcartapp.catalog import bump_catalog_version
+from foodcartapp.images import generate_image_variants, process_image_variants
+from foodcartapp.models import Product
+
+
+class Command(BaseCommand):
+    help = 'Создаёт уменьшенные копии картинок товаров в JPEG и WebP'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--force',
+            action='store_true',
+            help='пересоздать описание копий и для товаров, где они уже есть',
+        )
+        parser.add_argument(
+            '--watch',
+            action='store_true',
+            help='не завершаться, а ждать новых картинок, загруженных через админку',
+        )
+        parser.add_argument(
+            '--sleep',
+            type=float,
+            default=5,
+            help='пауза в секундах, когда новых картинок нет',
+        )
+
+    def handle(self, *args, **options):
+        if options['force']:
+            updated = 0
+            for product in Product.objects.exclude(image='').order_by('pk').iterator():
+                if generate_image_variants(product, force=True):
+                    updated += 1
+            if updated:
+                bump_catalog_version()
+            self.stdout.write(self.style.SUCCESS(f'Обновлены картинки {updated} товаров'))
+            return
+
+        updated_total = 0
+        while True:
+            processed, updated = process_image_variants()
+            if updated:
+                bump_catalog_version()
+            updated_total += updated
+            if processed:
+                continue
+            if not options['watch']:
+                break
+            time.sleep(options['sleep'])
+
+        self.stdout.write(self.style.SUCCESS(f'Обновлены картинки {updated_total} товаров'))
@@ -0,0 +1,77 @@
+import json
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from foodcartapp.importing import IMPORT_BATCH_SIZE, import_orders, replay_orders
+from foodcartapp.utils import percentile
+
+
+class Command(BaseCommand):
+    help = 'Загружает заказы из JSON Lines в базу пачками или повторяет их запросами к /api/order/'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='файл JSON Lines с телами запросов к /api/order/, «-» — stdin')
+        parser.add_argument('--batch-size', type=int, default=IMPORT_BATCH_SIZE)
+        parser.add_argument('--rejects', help='куда записать отклонённые строки с ошибками, JSON Lines')
+        parser.add_argument(
+            '--replay', metavar='URL',
+            help='не писать в базу, а отправить заказы POST-запросами, например http://127.0.0.1:8000/api/order/',
+        )
+        parser.add_argument('--concurrency', type=int, default=8, help='потоков в режиме --replay')
+
+    def handle(self, *args, **options):
+        if options['concurrency'] < 1 or options['batch_size'] < 1:
+            raise CommandError('--concurrency и --batch-size должны быть положительными')
+
+        lines = sys.stdin if options['path'] == '-' else open(options['path'], encoding='utf-8')
+        try:
+            if options['replay']:
+                self.replay(lines, options)
+            else:
+                self.load(lines, options)
+        finally:
+            if lines is not sys.stdin:
+                lines.close()
+
+    def load(self, lines, options):
+        rejects_file = open(options['rejects'], 'w', encoding='utf-8') if options['rejects'] else None
+
+        def on_reject(line_number, errors):
+            if rejects_file:
+                rejects_file.write(json.dumps({'line': line_number, 'errors': errors}, ensure_ascii=False) + '\n')
+
+        def on_batch(stats):
+            self.stdout.write(
+                f'{stats.processed} строк, создано {stats.created}, отклонено {stats.rejected}, '
+                f'{stats.throughput:.0f} заказов/с'
+            )
+
+        try:
+            stats = import_orders(lines, batch_size=options['batch_size'], on_reject=on_reject, on_batch=on_batch)
+        finally:
+            if rejects_file:
+                rejects_file.close()
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Готово за {stats.elapsed:.1f} с: создано {stats.created}, отклонено {stats.rejected}, '
+            f'{stats.throughput:.0f} заказов/с'
+        ))
+
+    def replay(self, lines, options):
+        stats, latencies, status_codes = replay_orders(
+            lines, options['replay'], concurrency=options['concurrency']
+        )
+        self.stdout.write(', '.join(
+            f"{f'HTTP {status_code}' if status_code else 'нет ответа'}: {count}" for status_code, count in sorted(status_codes.items())
+        ))
+        if latencies:
+            self.stdout.write(
+                f'задержка p50 {percentile(latencies, 0.5) * 1000:.1f} мс, '
+                f'p90 {percentile(latencies, 0.9) * 1000:.1f} мс, '
+                f'p99 {percentile(latencies, 0.99) * 1000:.1f} мс'
+            )
+        self.stdout.write(self.style.SUCCESS(
+            f'Отправлено {stats.processed} за {stats.elapsed:.1f} с: успешно {stats.created}, '
+            f'с ошибкой {stats.rejected}, {stats.throughput:.0f} запросов/с'
+        ))
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from foodcartapp.models import Order, Restaurant
+from locations.utils import link_locations
+
+
+class Command(BaseCommand):
+    help = 'Связывает заказы и рестораны, созданные до появления ссылки, с местоположениями их адресов'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='сколько записей связывать за один проход',
+        )
+
+    def handle(self, *args, **options):
+        for model in [Restaurant, Order]:
+            linked = link_locations(model.objects.all(), batch_size=options['batch_size'])
+            self.stdout.write(
+                self.style.SUCCESS(f'{model._meta.verbose_name_plural.capitalize()}: связано {linked}')
+            )
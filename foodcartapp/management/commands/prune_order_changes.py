@@ -0,0 +1,14 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from foodcartapp.models import OrderChange
+
+
+class Command(BaseCommand):
+    help = 'Удаляет из журнала изменений заказов записи старше ORDER_CHANGES_RETENTION_DAYS'
+
+    def handle(self, *args, **options):
+        deleted, _ = OrderChange.objects.expired(timedelta(days=settings.ORDER_CHANGES_RETENTION_DAYS)).delete()
+        self.stdout.write(self.style.SUCCESS(f'Удалено записей журнала: {deleted}'))
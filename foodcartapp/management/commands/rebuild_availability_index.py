@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from foodcartapp.availability import refresh_products_availability
+
+
+class Command(BaseCommand):
+    help = 'Пересобирает индекс наличия товаров в ресторанах'
+
+    def handle(self, *args, **options):
+        masks = refresh_products_availability()
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Индекс пересобран для {len(masks)} товаров'
+            )
+        )
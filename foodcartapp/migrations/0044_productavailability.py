@@ -0,0 +1,46 @@
+# Generated by Django 4.2.30 on 2026-10-18 04:01
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def build_availability_index(apps, schema_editor):
+    Product = apps.get_model('foodcartapp', 'Product')
+    RestaurantMenuItem = apps.get_model('foodcartapp', 'RestaurantMenuItem')
+    ProductAvailability = apps.get_model('foodcartapp', 'ProductAvailability')
+
+    masks = {product_id: 0 for product_id in Product.objects.values_list('pk', flat=True)}
+    menu_items = RestaurantMenuItem.objects.filter(availability=True) \
+        .values_list('product_id', 'restaurant_id')
+    for product_id, restaurant_id in menu_items:
+        masks[product_id] |= 1 << restaurant_id
+
+    ProductAvailability.objects.bulk_create(
+        ProductAvailability(
+            product_id=product_id,
+            restaurants_mask=mask.to_bytes((mask.bit_length() + 7) // 8, 'little'),
+        )
+        for product_id, mask in masks.items()
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('foodcartapp', '0043_alter_orderitem_price'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductAvailability',
+            fields=[
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='availability_index', serialize=False, to='foodcartapp.product', verbose_name='товар')),
+                ('restaurants_mask', models.BinaryField(default=b'', help_text='бит с номером id ресторана выставлен, если товар там в продаже', verbose_name='маска ресторанов')),
+            ],
+            options={
+                'verbose_name': 'наличие товара в ресторанах',
+                'verbose_name_plural': 'наличие товаров в ресторанах',
+            },
+        ),
+        migrations.RunPython(build_availability_index, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 4.2.30 on 2026-10-18 04:12
+
+from django.db import migrations, models
+from django.db.models import Count, DecimalField, F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+
+def fill_order_totals(apps, schema_editor):
+    Order = apps.get_model('foodcartapp', 'Order')
+    OrderItem = apps.get_model('foodcartapp', 'OrderItem')
+
+    money = DecimalField(max_digits=10, decimal_places=2)
+    items = OrderItem.objects.filter(order=OuterRef('pk')).order_by().values('order')
+    Order.objects.update(
+        total_cost=Coalesce(
+            Subquery(items.annotate(total=Sum(F('price') * F('quantity'), output_field=money)).values('total')),
+            Value(0),
+            output_field=money,
+        ),
+        items_count=Coalesce(Subquery(items.annotate(count=Count('pk')).values('count')), Value(0)),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('foodcartapp', '0045_order_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='items_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='позиций в заказе'),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='total_cost',
+            field=models.DecimalField(db_index=True, decimal_places=2, default=0, editable=False, max_digits=10, verbose_name='сумма заказа'),
+        ),
+        migrations.RunPython(fill_order_totals, migrations.RunPython.noop),
+    ]
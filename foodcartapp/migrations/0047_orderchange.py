@@ -0,0 +1,26 @@
+# Generated by Django 4.2.30 on 2026-10-18 04:13
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('foodcartapp', '0046_order_total_cost_items_count'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrderChange',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='время изменения')),
+                ('order', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='changes', to='foodcartapp.order', verbose_name='заказ')),
+            ],
+            options={
+                'verbose_name': 'изменение заказа',
+                'verbose_name_plural': 'изменения заказов',
+            },
+        ),
+    ]
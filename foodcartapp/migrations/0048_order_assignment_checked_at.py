@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-18 04:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('foodcartapp', '0047_orderchange'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='assignment_checked_at',
+            field=models.DateTimeField(blank=True, db_index=True, editable=False, help_text='когда заказ разобрал автоназначатель; пусто — ещё ждёт', null=True, verbose_name='автоназначение ресторана'),
+        ),
+    ]
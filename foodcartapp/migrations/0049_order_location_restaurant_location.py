@@ -0,0 +1,25 @@
+# Generated by Django 4.2.30 on 2026-10-18 04:33
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('locations', '0004_location_geocode_backoff'),
+        ('foodcartapp', '0048_order_assignment_checked_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='location',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='orders', to='locations.location', verbose_name='местоположение'),
+        ),
+        migrations.AddField(
+            model_name='restaurant',
+            name='location',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='restaurants', to='locations.location', verbose_name='местоположение'),
+        ),
+    ]
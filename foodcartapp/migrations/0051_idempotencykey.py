@@ -0,0 +1,29 @@
+# Generated by Django 4.2.30 on 2026-10-18 04:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('foodcartapp', '0050_product_image_variants'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IdempotencyKey',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(help_text='путь запроса и значение заголовка', max_length=300, unique=True, verbose_name='ключ')),
+                ('request_hash', models.CharField(max_length=64, verbose_name='хэш тела запроса')),
+                ('status_code', models.PositiveSmallIntegerField(blank=True, null=True, verbose_name='код ответа')),
+                ('content_type', models.CharField(blank=True, max_length=100, verbose_name='тип ответа')),
+                ('content', models.BinaryField(blank=True, null=True, verbose_name='тело ответа')),
+                ('created_at', models.DateTimeField(auto_now_add=True, db_index=True, verbose_name='создан')),
+            ],
+            options={
+                'verbose_name': 'ключ идемпотентности',
+                'verbose_name_plural': 'ключи идемпотентности',
+            },
+        ),
+    ]
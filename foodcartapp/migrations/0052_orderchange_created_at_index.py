@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-18 04:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('foodcartapp', '0051_idempotencykey'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='orderchange',
+            name='created_at',
+            field=models.DateTimeField(auto_now_add=True, db_index=True, verbose_name='время изменения'),
+        ),
+    ]
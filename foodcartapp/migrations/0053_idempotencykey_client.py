@@ -0,0 +1,28 @@
+# Generated by Django 4.2.30 on 2026-10-18 06:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('foodcartapp', '0052_orderchange_created_at_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='idempotencykey',
+            name='client',
+            field=models.CharField(default='', help_text='пользователь или сессия, приславшие ключ', max_length=100, verbose_name='клиент'),
+            preserve_default=False,
+        ),
+        migrations.AlterField(
+            model_name='idempotencykey',
+            name='key',
+            field=models.CharField(help_text='путь запроса и значение заголовка', max_length=300, verbose_name='ключ'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='idempotencykey',
+            unique_together={('client', 'key')},
+        ),
+    ]
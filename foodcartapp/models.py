@@ -1,12 +1,43 @@
+from datetime import datetime, time, timedelta
+
 from django.db import models
 from django.core.validators import MinValueValidator
 from phonenumber_field.modelfields import PhoneNumberField
 from django.core.exceptions import ValidationError
 from django.utils import timezone
 from geopy.distance import distance
-from django.db.models import F, Sum, ExpressionWrapper, DecimalField
+from django.db.models import F, Q, Sum, Count, ExpressionWrapper, DecimalField, OuterRef, Subquery, Value
+from django.db.models.fields.json import KT
+from django.db.models.functions import Coalesce
+
+from locations.models import Location
+
+
+class LocatedModelMixin:
+    """Модель с адресом и ссылкой на Location этого адреса.
+
+    Ссылку ставит сигнал pre_save, когда записи ещё нет или адрес изменился
+    после загрузки из базы или последнего сохранения.
+    """
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance.remember_address()
+        return instance
+
+    def remember_address(self):
+        self._loaded_address = self.__dict__.get('address')
 
-class Restaurant(models.Model):
+    def needs_location_link(self):
+        if 'address' not in self.__dict__:
+            return False
+        if self.location_id is None:
+            return True
+        return not self._state.adding and self.address != getattr(self, '_loaded_address', None)
+
+
+class Restaurant(LocatedModelMixin, models.Model):
     name = models.CharField(
         'название',
         max_length=50
@@ -16,6 +47,15 @@ class Restaurant(models.Model):
         max_length=100,
         blank=True,
     )
+    location = models.ForeignKey(
+        Location,
+        verbose_name='местоположение',
+        related_name='restaurants',
+        blank=True,
+        null=True,
+        editable=False,
+        on_delete=models.SET_NULL
+    )
     contact_phone = models.CharField(
         'контактный телефон',
         max_length=50,
@@ -39,6 +79,14 @@ class ProductQuerySet(models.QuerySet):
         )
         return self.filter(pk__in=products)
 
+    def without_image_variants(self):
+        """Товары, чья картинка ещё не описана в image_variants"""
+        return (
+            self.exclude(image='')
+            .annotate(variants_source=KT('image_variants__source'))
+            .filter(Q(variants_source__isnull=True) | ~Q(variants_source=F('image')))
+        )
+
 
 class ProductCategory(models.Model):
     name = models.CharField(
@@ -76,6 +124,12 @@ class Product(models.Model):
     image = models.ImageField(
         'картинка'
     )
+    image_variants = models.JSONField(
+        'уменьшенные копии картинки',
+        default=dict,
+        blank=True,
+        editable=False,
+    )
     special_status = models.BooleanField(
         'спец.предложение',
         default=False,
@@ -126,6 +180,33 @@ class RestaurantMenuItem(models.Model):
     def __str__(self):
         return f"{self.restaurant.name} - {self.product.name}"
 
+
+class ProductAvailability(models.Model):
+    product = models.OneToOneField(
+        Product,
+        primary_key=True,
+        related_name='availability_index',
+        verbose_name='товар',
+        on_delete=models.CASCADE,
+    )
+    restaurants_mask = models.BinaryField(
+        'маска ресторанов',
+        default=b'',
+        help_text='бит с номером id ресторана выставлен, если товар там в продаже',
+    )
+
+    class Meta:
+        verbose_name = 'наличие товара в ресторанах'
+        verbose_name_plural = 'наличие товаров в ресторанах'
+
+    def __str__(self):
+        return f"{self.product_id}: {self.mask:b}"
+
+    @property
+    def mask(self):
+        return int.from_bytes(self.restaurants_mask, 'little')
+
+
 class OrderItem(models.Model):
     order = models.ForeignKey(
         'Order',
@@ -157,18 +238,69 @@ class OrderItem(models.Model):
     def __str__(self):
         return f"{self.product.name} x{self.quantity}"
 
+
+def start_of_day(day):
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
 class OrderQuerySet(models.QuerySet):
-    def with_total_cost(self):
+    def with_calculated_totals(self):
+        """Суммы, посчитанные по позициям заказа, для сверки с сохранёнными"""
         return self.annotate(
-            total_cost=Sum(
-                ExpressionWrapper(
-                    F('items__price') * F('items__quantity'),
-                    output_field=DecimalField(max_digits=10, decimal_places=2)
-                )
-            )
+            calculated_total_cost=Coalesce(
+                Sum(
+                    ExpressionWrapper(
+                        F('items__price') * F('items__quantity'),
+                        output_field=DecimalField(max_digits=10, decimal_places=2)
+                    )
+                ),
+                Value(0),
+                output_field=DecimalField(max_digits=10, decimal_places=2)
+            ),
+            calculated_items_count=Count('items'),
+        )
+
+    def created_between(self, created_from=None, created_to=None):
+        """Заказы за даты включительно, по началу суток в текущем часовом поясе"""
+        orders = self
+        if created_from:
+            orders = orders.filter(created_at__gte=start_of_day(created_from))
+        if created_to:
+            orders = orders.filter(created_at__lt=start_of_day(created_to + timedelta(days=1)))
+        return orders
+
+    def awaiting_assignment(self):
+        """Новые заказы без ресторана, которые автоназначатель ещё не разбирал"""
+        return self.filter(
+            status='new',
+            cooking_restaurant__isnull=True,
+            assignment_checked_at__isnull=True,
+        )
+
+    def refresh_totals(self):
+        """Пересчитывает сохранённые суммы заказов одним UPDATE"""
+        items = OrderItem.objects.filter(order=OuterRef('pk')).order_by().values('order')
+        return self.update(
+            total_cost=Coalesce(
+                Subquery(
+                    items.annotate(
+                        total=Sum(
+                            F('price') * F('quantity'),
+                            output_field=DecimalField(max_digits=10, decimal_places=2)
+                        )
+                    ).values('total')
+                ),
+                Value(0),
+                output_field=DecimalField(max_digits=10, decimal_places=2)
+            ),
+            items_count=Coalesce(
+                Subquery(items.annotate(count=Count('pk')).values('count')),
+                Value(0)
+            ),
         )
 
-class Order(models.Model):
+
+class Order(LocatedModelMixin, models.Model):
     STATUS_CHOICES = [
         ('new', 'Новый'),
         ('processing', 'В обработке'),
@@ -198,6 +330,15 @@ class Order(models.Model):
         'адрес',
         max_length=200
     )
+    location = models.ForeignKey(
+        Location,
+        verbose_name='местоположение',
+        related_name='orders',
+        blank=True,
+        null=True,
+        editable=False,
+        on_delete=models.SET_NULL
+    )
     status = models.CharField(
         'статус',
         max_length=20,
@@ -245,16 +386,143 @@ class Order(models.Model):
         'комментарий менеджера',
         blank=True
     )
+    total_cost = models.DecimalField(
+        'сумма заказа',
+        max_digits=10,
+        decimal_places=2,
+        default=0,
+        db_index=True,
+        editable=False
+    )
+    items_count = models.PositiveIntegerField(
+        'позиций в заказе',
+        default=0,
+        editable=False
+    )
+    assignment_checked_at = models.DateTimeField(
+        'автоназначение ресторана',
+        blank=True,
+        null=True,
+        db_index=True,
+        editable=False,
+        help_text='когда заказ разобрал автоназначатель; пусто — ещё ждёт'
+    )
     objects = OrderQuerySet.as_manager()
 
     class Meta:
         verbose_name = 'заказ'
         verbose_name_plural = 'заказы'
         ordering = ['-created_at']
+        # под постраничный вывод по ключу (created_at, id) с фильтрами менеджера
+        indexes = [
+            models.Index(fields=['-created_at', '-id'], name='order_created_id_idx'),
+            models.Index(fields=['status', '-created_at', '-id'], name='order_status_created_idx'),
+            models.Index(fields=['payment_method', '-created_at', '-id'], name='order_payment_created_idx'),
+            models.Index(fields=['cooking_restaurant', '-created_at', '-id'], name='order_restaurant_created_idx'),
+        ]
 
     def __str__(self):
         return f"Заказ #{self.id} - {self.firstname} {self.lastname}"
 
     def is_address_found(self):
-        return self.get_coordinates() is not None
+        return self.location is not None and self.location.latitude is not None
+
+
+class OrderChangeQuerySet(models.QuerySet):
+    def record(self, order_ids):
+        """Записывает изменения заказов; нужно там, где сигналы не срабатывают"""
+        return self.bulk_create(OrderChange(order_id=order_id) for order_id in order_ids)
+
+    def expired(self, ttl):
+        return self.filter(created_at__lt=timezone.now() - ttl)
+
+
+class OrderChange(models.Model):
+    """Журнал изменений заказов для ленты менеджера.
+
+    id растёт монотонно и служит курсором: клиент запрашивает изменения после
+    последнего увиденного id. Внешний ключ без ограничения в базе, чтобы
+    в журнале оставались и удалённые заказы.
+    """
+    id = models.BigAutoField(primary_key=True)
+    order = models.ForeignKey(
+        Order,
+        related_name='changes',
+        verbose_name='заказ',
+        on_delete=models.DO_NOTHING,
+        db_constraint=False
+    )
+    created_at = models.DateTimeField(
+        'время изменения',
+        auto_now_add=True,
+        db_index=True
+    )
+
+    objects = OrderChangeQuerySet.as_manager()
+
+    class Meta:
+        verbose_name = 'изменение заказа'
+        verbose_name_plural = 'изменения заказов'
+
+    def __str__(self):
+        return f"#{self.id}: заказ {self.order_id}"
+
+
+class IdempotencyKeyQuerySet(models.QuerySet):
+    def expired(self, ttl):
+        return self.filter(created_at__lt=timezone.now() - ttl)
+
 
+class IdempotencyKey(models.Model):
+    """Ответ на запрос с заголовком Idempotency-Key для повтора клиенту.
+
+    Запись вставляется и получает ответ в одной транзакции с самим запросом:
+    пока она не зафиксирована, уникальный ключ держит параллельные повторы.
+    Ключи разных клиентов не пересекаются.
+    """
+    client = models.CharField(
+        'клиент',
+        max_length=100,
+        help_text='пользователь или сессия, приславшие ключ'
+    )
+    key = models.CharField(
+        'ключ',
+        max_length=300,
+        help_text='путь запроса и значение заголовка'
+    )
+    request_hash = models.CharField(
+        'хэш тела запроса',
+        max_length=64
+    )
+    status_code = models.PositiveSmallIntegerField(
+        'код ответа',
+        blank=True,
+        null=True
+    )
+    content_type = models.CharField(
+        'тип ответа',
+        max_length=100,
+        blank=True
+    )
+    content = models.BinaryField(
+        'тело ответа',
+        blank=True,
+        null=True
+    )
+    created_at = models.DateTimeField(
+        'создан',
+        auto_now_add=True,
+        db_index=True
+    )
+
+    objects = IdempotencyKeyQuerySet.as_manager()
+
+    class Meta:
+        verbose_name = 'ключ идемпотентности'
+        verbose_name_plural = 'ключи идемпотентности'
+        unique_together = [
+            ['client', 'key']
+        ]
+
+    def __str__(self):
+        return self.key
@@ -0,0 +1,14 @@
+from rest_framework.permissions import BasePermission
+from rest_framework.throttling import UserRateThrottle
+
+
+class CanAddOrders(BasePermission):
+    """Пачки заказов принимаются только от пользователей с правом «Can add order»"""
+
+    def has_permission(self, request, view):
+        return bool(request.user and request.user.has_perm('foodcartapp.add_order'))
+
+
+class OrderBatchRateThrottle(UserRateThrottle):
+    """Частота пачек на пользователя; лимит — ORDER_BATCH_THROTTLE_RATE"""
+    scope = 'order_batch'
@@ -0,0 +1,104 @@
+"""Компактные JSON-ответы API с заранее сжатыми вариантами.
+
+Тело ответа сериализуется без отступов и сразу сжимается во все доступные
+кодировки; варианты хранятся вместе и кэшируются целиком, так что на запрос
+остаётся только выбрать вариант по Accept-Encoding. Brotli используется,
+если установлен пакет brotli, gzip есть всегда.
+"""
+import gzip
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import HttpResponse
+from django.utils.cache import patch_vary_headers
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+GZIP_LEVEL = 9
+BROTLI_QUALITY = 11
+
+# в порядке предпочтения при равном q
+COMPRESSORS = {
+    'gzip': lambda content: gzip.compress(content, compresslevel=GZIP_LEVEL, mtime=0),
+}
+if brotli is not None:
+    COMPRESSORS = {
+        'br': lambda content: brotli.compress(content, quality=BROTLI_QUALITY),
+        **COMPRESSORS,
+    }
+
+# ответы меньше этого размера не сжимаются: заголовки сжатия съедят выигрыш
+MIN_COMPRESS_SIZE = 200
+
+
+def dump_json(data):
+    return json.dumps(data, cls=DjangoJSONEncoder, ensure_ascii=False, separators=(',', ':')).encode()
+
+
+def compress_variants(content):
+    """{кодировка: байты}; 'identity' есть всегда, сжатые — только если они меньше"""
+    variants = {'identity': content}
+    if len(content) < MIN_COMPRESS_SIZE:
+        return variants
+    for encoding, compress in COMPRESSORS.items():
+        compressed = compress(content)
+        if len(compressed) < len(content):
+            variants[encoding] = compressed
+    return variants
+
+
+def parse_accept_encoding(header):
+    """{кодировка: q} из заголовка Accept-Encoding"""
+    weights = {}
+    for part in header.split(','):
+        encoding, _, params = part.strip().partition(';')
+        encoding = encoding.strip().lower()
+        if not encoding:
+            continue
+        weight = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                weight = float(params[2:])
+            except ValueError:
+                weight = 0.0
+        weights[encoding] = weight
+    return weights
+
+
+def choose_encoding(accept_encoding, variants):
+    weights = parse_accept_encoding(accept_encoding)
+    best_encoding, best_weight = 'identity', 0.0
+    for encoding in variants:
+        if encoding == 'identity':
+            continue
+        weight = weights.get(encoding, weights.get('*', 0.0))
+        if weight > best_weight:
+            best_encoding, best_weight = encoding, weight
+    return best_encoding
+
+
+def choose_request_encoding(request, variants):
+    return choose_encoding(request.headers.get('Accept-Encoding', ''), variants)
+
+
+def encoding_etag(etag, encoding):
+    """Свой ETag на каждую кодировку: сильный ETag обязан различать байты тела"""
+    if encoding == 'identity':
+        return etag
+    return f'{etag}-{encoding}'
+
+
+def precompressed_response(request, variants, content_type='application/json'):
+    encoding = choose_request_encoding(request, variants)
+    response = HttpResponse(variants[encoding], content_type=content_type)
+    if encoding != 'identity':
+        response['Content-Encoding'] = encoding
+    response['Content-Length'] = len(variants[encoding])
+    if len(variants) > 1:
+        patch_vary_headers(response, ['Accept-Encoding'])
+    return response
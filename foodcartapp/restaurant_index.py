@@ -0,0 +1,93 @@
+"""Пространственный индекс ресторанов для поиска ближайших, кто может приготовить заказ.
+
+Индекс строится в памяти процесса и пересобирается, когда меняется его версия
+в общем кэше: при изменении ресторанов и при геокодировании их адресов.
+Построение только читает базу: ссылки на местоположения ставит сигнал
+link_location и команда link_locations.
+"""
+import threading
+
+from locations.distances import distance_matrix
+from locations.spatial import SpatialIndex
+from star_burger.cache_versions import bump_cache_version, get_cache_version
+
+from .models import Restaurant
+
+
+RESTAURANT_INDEX_VERSION_KEY = 'restaurants:index_version'
+
+_index_lock = threading.Lock()
+_built_index = {'version': None, 'index': None}
+
+
+def build_restaurant_index(restaurants):
+    """Индекс по координатам ресторанов; restaurants — строки (id, широта, долгота)"""
+    return SpatialIndex({
+        restaurant_id: (latitude, longitude)
+        for restaurant_id, latitude, longitude in restaurants
+        if latitude is not None and longitude is not None
+    })
+
+
+def get_restaurant_index():
+    """Индекс текущей версии; вызывается раз на запрос и передаётся дальше"""
+    version = get_cache_version(RESTAURANT_INDEX_VERSION_KEY)
+    with _index_lock:
+        if _built_index['version'] != version:
+            # координаты приходят JOIN'ом по ссылке на Location, без поиска по адресу
+            _built_index['index'] = build_restaurant_index(
+                Restaurant.objects.values_list('id', 'location__latitude', 'location__longitude')
+            )
+            _built_index['version'] = version
+        return _built_index['index']
+
+
+def invalidate_restaurant_index():
+    bump_cache_version(RESTAURANT_INDEX_VERSION_KEY)
+
+
+def is_restaurant_address(address_keys):
+    """Есть ли ресторан, связанный с местоположением одного из адресов"""
+    return Restaurant.objects.filter(location__address_key__in=address_keys).exists()
+
+
+def find_nearest_capable_restaurants(point, capable_restaurant_ids, k, method='haversine', index=None):
+    """До k ближайших к точке ресторанов из capable_restaurant_ids: [(id, км)]
+
+    Отбор всегда идёт по индексу; при method='geodesic' расстояния
+    до найденных ресторанов уточняются и список пересортировывается.
+    Для нескольких заказов передавайте один index из get_restaurant_index().
+    """
+    capable_restaurant_ids = set(capable_restaurant_ids)
+    if not capable_restaurant_ids or point is None:
+        return []
+
+    if index is None:
+        index = get_restaurant_index()
+    nearest = index.nearest(point, k=k, predicate=capable_restaurant_ids.__contains__)
+    if method != 'haversine' and nearest:
+        restaurant_ids = [restaurant_id for restaurant_id, _ in nearest]
+        distances = distance_matrix(
+            [point],
+            [index.points[restaurant_id] for restaurant_id in restaurant_ids],
+            method=method,
+        )[0]
+        nearest = sorted(zip(restaurant_ids, map(float, distances)), key=lambda found: found[1])
+    return nearest
+
+
+def list_candidate_restaurants(point, capable_restaurant_ids, k, method='haversine', index=None):
+    """Кандидаты для страницы заказов: [(id, км или None)]
+
+    Сначала до k ближайших, затем рестораны, расстояние до которых
+    неизвестно: у них или у заказа ещё нет координат.
+    """
+    capable_restaurant_ids = set(capable_restaurant_ids)
+    if point is not None and index is None:
+        index = get_restaurant_index()
+    nearest = find_nearest_capable_restaurants(point, capable_restaurant_ids, k, method=method, index=index)
+    located_ids = index.points if point is not None else {}
+    unranked_ids = sorted(
+        restaurant_id for restaurant_id in capable_restaurant_ids if restaurant_id not in located_ids
+    )
+    return nearest + [(restaurant_id, None) for restaurant_id in unranked_ids]
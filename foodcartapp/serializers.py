@@ -1,6 +1,9 @@
+from django.conf import settings
 from rest_framework import serializers
 from django.db import transaction
-from .models import Order, OrderItem, Product
+from locations.utils import get_or_enqueue_location_ids
+
+from .models import Order, OrderChange, OrderItem, Product, Restaurant
 
 
 class OrderItemSerializer(serializers.ModelSerializer):
@@ -10,12 +13,6 @@ class OrderItemSerializer(serializers.ModelSerializer):
         model = OrderItem
         fields = ['product', 'quantity']
 
-    def validate_product(self, value):
-        """Проверяем что продукт существует"""
-        if not Product.objects.filter(id=value).exists():
-            raise serializers.ValidationError(f"Продукт с ID {value} не найден")
-        return value
-
     def validate_quantity(self, value):
         if value < 1:
             raise serializers.ValidationError("Количество должно быть положительным")
@@ -24,12 +21,55 @@ class OrderItemSerializer(serializers.ModelSerializer):
         return value
 
 
+def calculate_totals(items):
+    return {
+        'total_cost': sum(item['product'].price * item['quantity'] for item in items),
+        'items_count': len(items),
+    }
+
+
+class OrderListSerializer(serializers.ListSerializer):
+    @transaction.atomic
+    def create(self, validated_data):
+        """Создаёт пачку заказов несколькими INSERT'ами на всю пачку, а не на каждый заказ.
+
+        bulk_create не отправляет сигналы, поэтому журнал изменений,
+        очередь геокодирования и ссылки на местоположения заполняются здесь же.
+        """
+        orders_items = [order_data.pop('items') for order_data in validated_data]
+        location_ids = get_or_enqueue_location_ids({order_data['address'] for order_data in validated_data})
+        orders = Order.objects.bulk_create([
+            Order(**order_data, **calculate_totals(items), location_id=location_ids.get(order_data['address']))
+            for order_data, items in zip(validated_data, orders_items)
+        ])
+
+        OrderItem.objects.bulk_create([
+            OrderItem(
+                order=order,
+                product=item['product'],
+                quantity=item['quantity'],
+                price=item['product'].price
+            )
+            for order, items in zip(orders, orders_items)
+            for item in items
+        ])
+        OrderChange.objects.record(order.id for order in orders)
+
+        return orders
+
+
 class OrderSerializer(serializers.ModelSerializer):
+    """Заказ с позициями.
+
+    Товары можно заранее загрузить одним запросом на много заказов
+    и передать в context['products'] словарём {id: Product}.
+    """
     products = OrderItemSerializer(many=True, source='items')
 
     class Meta:
         model = Order
         fields = ['firstname', 'lastname', 'phonenumber', 'address', 'products']
+        list_serializer_class = OrderListSerializer
 
     def validate_firstname(self, value):
         if len(value.strip()) < 2:
@@ -52,26 +92,91 @@ class OrderSerializer(serializers.ModelSerializer):
         return value.strip()
 
     def validate_products(self, value):
+        """Проверяем что все продукты существуют, загружая их одним запросом"""
         if not value:
             raise serializers.ValidationError("Список продуктов не может быть пустым")
-        return value
 
+        product_ids = {item['product']['id'] for item in value}
+        if 'products' in self.context:
+            products = {
+                product_id: self.context['products'][product_id]
+                for product_id in product_ids
+                if product_id in self.context['products']
+            }
+        else:
+            products = Product.objects.in_bulk(product_ids)
+
+        if len(products) < len(product_ids):
+            raise serializers.ValidationError([
+                {} if item['product']['id'] in products else
+                {'product': [f"Продукт с ID {item['product']['id']} не найден"]}
+                for item in value
+            ])
+
+        for item in value:
+            item['product'] = products[item['product']['id']]
+        return value
 
-    @transaction.atomic    
+    @transaction.atomic
     def create(self, validated_data):
         products_data = validated_data.pop('items')
-        order = Order.objects.create(**validated_data)
+        address = validated_data['address']
+        order = Order.objects.create(
+            **validated_data,
+            **calculate_totals(products_data),
+            location_id=get_or_enqueue_location_ids([address]).get(address),
+        )
+
+        OrderItem.objects.bulk_create([
+            OrderItem(
+                order=order,
+                product=product_data['product'],
+                quantity=product_data['quantity'],
+                price=product_data['product'].price
+            )
+            for product_data in products_data
+        ])
 
-        for product_data in products_data:
-            product_id = product_data['product']['id']
-            quantity = product_data['quantity']
-            product = Product.objects.get(id=product_id)
+        return order
 
-            OrderItem.objects.create(
-                order=order,
-                product=product,
-                quantity=quantity,
-                price=product.price
+
+class OrderBatchSerializer(serializers.Serializer):
+    """Обёртка пачки заказов; сами заказы проверяются по правилам OrderSerializer"""
+    orders = serializers.ListField(child=serializers.JSONField(), allow_empty=False)
+
+    def validate_orders(self, value):
+        if len(value) > settings.ORDER_BATCH_MAX_SIZE:
+            raise serializers.ValidationError(
+                f"В пачке может быть не больше {settings.ORDER_BATCH_MAX_SIZE} заказов"
+            )
+        return value
+
+
+class MenuAvailabilitySerializer(serializers.Serializer):
+    """Массовое изменение наличия: рестораны × товары → в продаже или нет.
+
+    Пропущенный список означает «все», но хотя бы один из двух нужен.
+    """
+    restaurants = serializers.ListField(child=serializers.IntegerField(), required=False, allow_empty=False)
+    products = serializers.ListField(child=serializers.IntegerField(), required=False, allow_empty=False)
+    availability = serializers.BooleanField()
+
+    def check_ids_exist(self, model, ids):
+        ids = set(ids)
+        missing_ids = ids - set(model.objects.filter(pk__in=ids).values_list('pk', flat=True))
+        if missing_ids:
+            raise serializers.ValidationError(
+                f"Не найдены объекты с ID {', '.join(map(str, sorted(missing_ids)))}"
             )
+        return sorted(ids)
+
+    def validate_restaurants(self, value):
+        return self.check_ids_exist(Restaurant, value)
+
+    def validate_products(self, value):
+        return self.check_ids_exist(Product, value)
 
-        return order
\ No newline at end of file
+    def validate(self, data):
+        if 'restaurants' not in data and 'products' not in data:
+            raise serializers.ValidationError("Укажите рестораны, товары или и то и другое")
+        return data
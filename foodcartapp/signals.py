@@ -0,0 +1,112 @@
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from locations.models import Location
+from locations.signals import locations_geocoded
+from locations.utils import get_or_enqueue_location_ids
+
+from .assignment import process_assignment_queue
+from .availability import menu_availability_changed, refresh_products_availability
+from .catalog import bump_catalog_version
+from .images import delete_unused_variants
+from .models import Order, OrderChange, OrderItem, Product, ProductCategory, Restaurant, RestaurantMenuItem
+from .restaurant_index import invalidate_restaurant_index, is_restaurant_address
+
+
+@receiver(post_save, sender=RestaurantMenuItem)
+@receiver(post_delete, sender=RestaurantMenuItem)
+def update_product_availability(sender, instance, **kwargs):
+    # пересчёт после коммита: при каскадном удалении товара
+    # строка индекса не должна появиться заново
+    product_id = instance.product_id
+    transaction.on_commit(lambda: refresh_products_availability([product_id]))
+
+
+@receiver(menu_availability_changed)
+def refresh_changed_menu(sender, product_ids, **kwargs):
+    def refresh():
+        refresh_products_availability(product_ids)
+        bump_catalog_version()
+    transaction.on_commit(refresh)
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+@receiver(post_save, sender=ProductCategory)
+@receiver(post_delete, sender=ProductCategory)
+@receiver(post_save, sender=Restaurant)
+@receiver(post_delete, sender=Restaurant)
+@receiver(post_save, sender=RestaurantMenuItem)
+@receiver(post_delete, sender=RestaurantMenuItem)
+def invalidate_catalog(sender, **kwargs):
+    transaction.on_commit(bump_catalog_version)
+
+
+@receiver(post_delete, sender=Product)
+def delete_product_image_variants(sender, instance, **kwargs):
+    # копии новых картинок создаёт команда generate_image_variants, не запрос админки
+    if instance.image_variants:
+        transaction.on_commit(lambda: delete_unused_variants(instance.image_variants, instance.image.storage))
+
+
+@receiver(post_save, sender=Restaurant)
+@receiver(post_delete, sender=Restaurant)
+def invalidate_restaurants_on_change(sender, **kwargs):
+    transaction.on_commit(invalidate_restaurant_index)
+
+
+@receiver(post_save, sender=Location)
+def invalidate_restaurants_on_location_save(sender, instance, **kwargs):
+    if is_restaurant_address({instance.address_key}):
+        transaction.on_commit(invalidate_restaurant_index)
+
+
+@receiver(locations_geocoded)
+def invalidate_restaurants_on_geocoding(sender, address_keys, **kwargs):
+    if is_restaurant_address(set(address_keys)):
+        transaction.on_commit(invalidate_restaurant_index)
+
+
+@receiver(locations_geocoded)
+def assign_orders_on_geocoding(sender, **kwargs):
+    # заказы с этими адресами перестали ждать геокодера
+    if settings.ORDER_AUTO_ASSIGNMENT:
+        transaction.on_commit(process_assignment_queue)
+
+
+@receiver(pre_save, sender=Order)
+@receiver(pre_save, sender=Restaurant)
+def link_location(sender, instance, update_fields=None, **kwargs):
+    if update_fields is not None and 'address' not in update_fields:
+        return
+    if instance.needs_location_link():
+        instance.location_id = get_or_enqueue_location_ids([instance.address]).get(instance.address)
+
+
+@receiver(post_save, sender=Order)
+@receiver(post_save, sender=Restaurant)
+def remember_linked_address(sender, instance, update_fields=None, **kwargs):
+    # без этого у созданной через create() записи каждое сохранение заново ищет Location
+    if update_fields is None or 'address' in update_fields:
+        instance.remember_address()
+
+
+@receiver(post_save, sender=OrderItem)
+@receiver(post_delete, sender=OrderItem)
+def update_order_totals(sender, instance, **kwargs):
+    # bulk_create сигналов не шлёт: там суммы проставляет сам создающий код
+    Order.objects.filter(pk=instance.order_id).refresh_totals()
+
+
+@receiver(post_save, sender=Order)
+@receiver(post_delete, sender=Order)
+def record_order_change(sender, instance, **kwargs):
+    OrderChange.objects.create(order_id=instance.pk)
+
+
+@receiver(post_save, sender=OrderItem)
+@receiver(post_delete, sender=OrderItem)
+def record_order_item_change(sender, instance, **kwargs):
+    OrderChange.objects.create(order_id=instance.order_id)
@@ -0,0 +1,993 @@
+import gzip
+import io
+import json
+import shutil
+import tempfile
+from unittest.mock import patch
+
+from django.contrib.auth.models import Permission, User
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import DatabaseError
+from django.http import HttpResponse
+from django.test import Client, TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from PIL import Image
+from rest_framework.authtoken.models import Token
+
+from locations.models import Location
+from locations.utils import link_locations, save_geocoded_locations
+
+from .assignment import assign_new_orders, assign_orders, process_assignment_queue
+from .availability import (
+    get_availability_masks,
+    get_capable_restaurant_ids,
+    ids_to_mask,
+    menu_availability_changed,
+    refresh_products_availability,
+    set_menu_availability,
+)
+from .benchmarks import format_results, generate_fixtures, measure, run_benchmarks
+from .catalog import get_catalog_version
+from .images import get_image_srcset, get_thumbnail_url
+from .importing import import_orders
+from .models import (
+    IdempotencyKey,
+    IdempotencyKeyQuerySet,
+    Order,
+    OrderChange,
+    OrderItem,
+    Product,
+    ProductAvailability,
+    Restaurant,
+    RestaurantMenuItem,
+)
+from .permissions import OrderBatchRateThrottle
+from .responses import choose_encoding
+from .restaurant_index import find_nearest_capable_restaurants, invalidate_restaurant_index, list_candidate_restaurants
+
+
+class RegisterOrderTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.products = Product.objects.bulk_create(
+            Product(name=f'Бургер {number}', price=100 + number, image='burger.jpg')
+            for number in range(20)
+        )
+
+    def make_payload(self, products):
+        return {
+            'firstname': 'Иван',
+            'lastname': 'Петров',
+            'phonenumber': '+79291000000',
+            'address': 'Москва, Новый Арбат, 10',
+            'products': [
+                {'product': product.id, 'quantity': 2}
+                for product in products
+            ],
+        }
+
+    def test_order_is_created_with_current_prices(self):
+        response = self.client.post(
+            '/api/order/',
+            self.make_payload(self.products[:3]),
+            content_type='application/json',
+        )
+
+        self.assertEqual(response.status_code, 200)
+        order = Order.objects.get(pk=response.json()['order_id'])
+        self.assertEqual(
+            sorted(order.items.values_list('product_id', 'quantity', 'price')),
+            [(product.id, 2, product.price) for product in self.products[:3]],
+        )
+        self.assertTrue(Location.objects.pending().filter(address=order.address).exists())
+        self.assertEqual(order.items_count, 3)
+        self.assertEqual(order.total_cost, sum(product.price * 2 for product in self.products[:3]))
+
+    def test_totals_follow_item_changes(self):
+        response = self.client.post(
+            '/api/order/',
+            self.make_payload(self.products[:2]),
+            content_type='application/json',
+        )
+        order = Order.objects.get(pk=response.json()['order_id'])
+
+        first_item, second_item = order.items.order_by('pk')
+        first_item.quantity = 5
+        first_item.save()
+        second_item.delete()
+
+        order.refresh_from_db()
+        self.assertEqual(order.items_count, 1)
+        self.assertEqual(order.total_cost, self.products[0].price * 5)
+
+    # приём без автоназначения: его запросы считает AssignmentTest
+    @override_settings(ORDER_AUTO_ASSIGNMENT=False)
+    def test_query_count_does_not_depend_on_cart_size(self):
+        # товары, очередь геокодирования и id местоположения, заказ, журнал,
+        # позиции и точка сохранения транзакции
+        for cart_size in (1, 20):
+            with self.subTest(cart_size=cart_size), self.assertNumQueries(8):
+                response = self.client.post(
+                    '/api/order/',
+                    self.make_payload(self.products[:cart_size]),
+                    content_type='application/json',
+                )
+            self.assertEqual(response.status_code, 200)
+
+    def test_unknown_product_is_rejected(self):
+        payload = self.make_payload(self.products[:1])
+        payload['products'].append({'product': 0, 'quantity': 1})
+
+        response = self.client.post('/api/order/', payload, content_type='application/json')
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('product', response.json()['errors']['products'][1])
+        self.assertFalse(Order.objects.exists())
+
+
+class IdempotencyKeyTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.product = Product.objects.create(name='Бургер', price=100, image='burger.jpg')
+
+    def setUp(self):
+        # стартовая страница заводит сессию, к которой привязываются ключи
+        self.client.get(reverse('start_page'))
+
+    def post_order(self, key, quantity=1, client=None):
+        return (client or self.client).post(
+            '/api/order/',
+            {
+                'firstname': 'Иван',
+                'lastname': 'Петров',
+                'phonenumber': '+79291000000',
+                'address': 'Москва, Новый Арбат, 10',
+                'products': [{'product': self.product.id, 'quantity': quantity}],
+            },
+            content_type='application/json',
+            headers={'Idempotency-Key': key},
+        )
+
+    def test_retry_replays_the_first_response(self):
+        first_response = self.post_order('checkout-1')
+        # сессия, транзакция ключа, неудачная вставка в точке сохранения и чтение сохранённого ответа
+        with self.assertNumQueries(8):
+            retry_response = self.post_order('checkout-1')
+
+        self.assertEqual(retry_response.status_code, 200)
+        self.assertEqual(retry_response.json()['order_id'], first_response.json()['order_id'])
+        self.assertEqual(retry_response['Idempotent-Replayed'], 'true')
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_key_cannot_be_reused_for_another_order(self):
+        self.post_order('checkout-1')
+
+        response = self.post_order('checkout-1', quantity=2)
+
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_key_with_unknown_result_is_never_processed_again(self):
+        self.post_order('checkout-1')
+        IdempotencyKey.objects.update(
+            status_code=None, content=None, created_at=timezone.now() - timezone.timedelta(days=2),
+        )
+
+        response = self.post_order('checkout-1')
+
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_order_and_response_are_committed_together(self):
+        with patch.object(IdempotencyKeyQuerySet, 'update', side_effect=DatabaseError('сбой при записи ответа')):
+            with self.assertRaises(DatabaseError):
+                self.post_order('checkout-1')
+
+        self.assertFalse(Order.objects.exists())
+        self.assertFalse(IdempotencyKey.objects.exists())
+        self.assertEqual(self.post_order('checkout-1').status_code, 200)
+
+    def test_expired_key_is_processed_again(self):
+        self.post_order('checkout-1')
+        IdempotencyKey.objects.update(created_at=timezone.now() - timezone.timedelta(days=2))
+
+        response = self.post_order('checkout-1')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('Idempotent-Replayed', response)
+        self.assertEqual(Order.objects.count(), 2)
+        self.assertEqual(IdempotencyKey.objects.count(), 1)
+
+    def test_key_of_another_client_is_not_replayed(self):
+        first_response = self.post_order('checkout-1')
+        stranger = Client()
+        stranger.get(reverse('start_page'))
+
+        response = self.post_order('checkout-1', client=stranger)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('Idempotent-Replayed', response)
+        self.assertNotEqual(response.json()['order_id'], first_response.json()['order_id'])
+        self.assertEqual(IdempotencyKey.objects.count(), 2)
+
+    def test_key_without_session_is_ignored(self):
+        responses = [self.post_order('checkout-1', client=Client()) for _ in range(2)]
+
+        self.assertEqual([response.status_code for response in responses], [200, 200])
+        self.assertEqual(Order.objects.count(), 2)
+        self.assertFalse(IdempotencyKey.objects.exists())
+
+    def test_invalid_order_is_replayed_too(self):
+        self.product.delete()
+
+        responses = [self.post_order('checkout-1') for _ in range(2)]
+
+        self.assertEqual([response.status_code for response in responses], [400, 400])
+        self.assertEqual(responses[1]['Idempotent-Replayed'], 'true')
+
+
+class ProductCatalogTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.restaurant = Restaurant.objects.create(name='Star Burger Арбат')
+        cls.product = Product.objects.create(name='Чизбургер', price=150, image='burger.jpg')
+        RestaurantMenuItem.objects.create(restaurant=cls.restaurant, product=cls.product)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_repeated_request_is_answered_with_304(self):
+        response = self.client.get('/api/products/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()[0]['name'], 'Чизбургер')
+
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/products/', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_catalog_changes_invalidate_etag(self):
+        etag = self.client.get('/api/products/')['ETag']
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.name = 'Двойной чизбургер'
+            self.product.save()
+
+        response = self.client.get('/api/products/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()[0]['name'], 'Двойной чизбургер')
+
+    def test_catalog_is_compact_and_precompressed(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            for number in range(5):
+                product = Product.objects.create(name=f'Бургер {number}', price=100, image='burger.jpg')
+                RestaurantMenuItem.objects.create(restaurant=self.restaurant, product=product)
+
+        identity = self.client.get('/api/products/')
+        self.assertNotIn(b'\n', identity.content)
+        self.assertNotIn('Content-Encoding', identity)
+
+        compressed = self.client.get('/api/products/', HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual(compressed['Content-Encoding'], 'gzip')
+        self.assertEqual(compressed['Vary'], 'Accept-Encoding')
+        self.assertEqual(compressed['ETag'], identity['ETag'][:-1] + '-gzip"')
+        self.assertEqual(gzip.decompress(compressed.content), identity.content)
+
+        # сжатый вариант не подтверждает кэш несжатого, и наоборот
+        response = self.client.get('/api/products/', HTTP_IF_NONE_MATCH=compressed['ETag'])
+        self.assertEqual(response.status_code, 200)
+        response = self.client.get(
+            '/api/products/', HTTP_IF_NONE_MATCH=compressed['ETag'], HTTP_ACCEPT_ENCODING='gzip',
+        )
+        self.assertEqual(response.status_code, 304)
+
+    def test_encoding_negotiation(self):
+        variants = dict.fromkeys(['identity', 'gzip', 'br'])
+        self.assertEqual(choose_encoding('', variants), 'identity')
+        self.assertEqual(choose_encoding('gzip;q=0.5, br', variants), 'br')
+        self.assertEqual(choose_encoding('br;q=0, *', variants), 'gzip')
+        self.assertEqual(choose_encoding('gzip;q=0', variants), 'identity')
+        self.assertEqual(choose_encoding('br', {'identity': None}), 'identity')
+
+
+class ImportOrdersTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.products = Product.objects.bulk_create(
+            Product(name=f'Бургер {number}', price=100 + number, image='burger.jpg')
+            for number in range(5)
+        )
+
+    def make_line(self, products, address='Москва, Новый Арбат, 10'):
+        return json.dumps({
+            'firstname': 'Иван',
+            'lastname': 'Петров',
+            'phonenumber': '+79291000000',
+            'address': address,
+            'products': [{'product': product_id, 'quantity': 2} for product_id in products],
+        })
+
+    def test_valid_orders_are_created_and_rejects_reported(self):
+        lines = [
+            self.make_line([self.products[0].id, self.products[1].id]),
+            '{не json',
+            self.make_line([self.products[2].id, 999999]),
+            '',
+            self.make_line([str(self.products[3].id)], address='Москва, Тверская, 1'),
+        ]
+        rejects = []
+
+        with self.captureOnCommitCallbacks(execute=True):
+            stats = import_orders(lines, batch_size=2, on_reject=lambda *reject: rejects.append(reject))
+
+        self.assertEqual((stats.processed, stats.created, stats.rejected), (4, 2, 2))
+        self.assertEqual([line_number for line_number, _ in rejects], [2, 3])
+        self.assertEqual(rejects[1][1]['products'][1]['product'], ['Продукт с ID 999999 не найден'])
+
+        orders = list(Order.objects.order_by('pk'))
+        self.assertEqual([order.items_count for order in orders], [2, 1])
+        self.assertEqual(orders[0].total_cost, (self.products[0].price + self.products[1].price) * 2)
+        self.assertEqual(OrderChange.objects.filter(order__in=orders).count(), 2)
+        self.assertEqual(Location.objects.pending().count(), 2)
+
+    def test_batch_is_inserted_with_constant_number_of_queries(self):
+        lines = [self.make_line([product.id for product in self.products])] * 40
+
+        # товары, очередь геокодирования и id местоположений, заказы, позиции,
+        # журнал изменений плюс точка сохранения транзакции пачки
+        with self.assertNumQueries(8), self.captureOnCommitCallbacks(execute=True):
+            stats = import_orders(lines, batch_size=40)
+
+        self.assertEqual(stats.created, 40)
+        self.assertEqual(OrderItem.objects.count(), 200)
+
+
+class OrderBatchTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.products = Product.objects.bulk_create(
+            Product(name=f'Бургер {number}', price=100 + number, image='burger.jpg')
+            for number in range(5)
+        )
+        cls.partner = User.objects.create_user('partner')
+        cls.partner.user_permissions.add(Permission.objects.get(codename='add_order'))
+        cls.token = Token.objects.create(user=cls.partner)
+
+    def setUp(self):
+        # счётчики частоты запросов лежат в кэше
+        cache.clear()
+
+    def make_order(self, product_ids, address='Москва, Новый Арбат, 10'):
+        return {
+            'firstname': 'Иван',
+            'lastname': 'Петров',
+            'phonenumber': '+79291000000',
+            'address': address,
+            'products': [{'product': product_id, 'quantity': 2} for product_id in product_ids],
+        }
+
+    def post_batch(self, orders, token=None, **headers):
+        return self.client.post(
+            '/api/orders/batch/',
+            {'orders': orders},
+            content_type='application/json',
+            headers={'Authorization': f'Token {token or self.token.key}', **headers},
+        )
+
+    def test_only_partners_with_token_can_post(self):
+        orders = [self.make_order([self.products[0].id])]
+        stranger_token = Token.objects.create(user=User.objects.create_user('stranger'))
+
+        response = self.client.post('/api/orders/batch/', {'orders': orders}, content_type='application/json')
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(self.post_batch(orders, token=stranger_token.key).status_code, 403)
+        self.assertFalse(Order.objects.exists())
+
+    def test_refusal_is_not_replayed_by_idempotency_key(self):
+        orders = [self.make_order([self.products[0].id])]
+
+        response = self.client.post(
+            '/api/orders/batch/', {'orders': orders}, content_type='application/json',
+            headers={'Idempotency-Key': 'batch-1'},
+        )
+        self.assertEqual(response.status_code, 401)
+
+        response = self.post_batch(orders, **{'Idempotency-Key': 'batch-1'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['created'], 1)
+
+    def test_anonymous_request_with_stored_key_is_refused(self):
+        orders = [self.make_order([self.products[0].id])]
+        self.post_batch(orders, **{'Idempotency-Key': 'batch-1'})
+
+        response = self.client.post(
+            '/api/orders/batch/', {'orders': orders}, content_type='application/json',
+            headers={'Idempotency-Key': 'batch-1'},
+        )
+
+        self.assertEqual(response.status_code, 401)
+        self.assertNotIn('Idempotent-Replayed', response)
+
+    def test_batches_are_throttled(self):
+        orders = [self.make_order([self.products[0].id])]
+        with patch.object(OrderBatchRateThrottle, 'THROTTLE_RATES', {'order_batch': '2/min'}):
+            statuses = [self.post_batch(orders).status_code for _ in range(3)]
+
+        self.assertEqual(statuses, [200, 200, 429])
+
+    def test_valid_orders_are_created_and_errors_reported_per_order(self):
+        orders = [
+            self.make_order([self.products[0].id, self.products[1].id]),
+            self.make_order([999999]),
+            'не заказ',
+            self.make_order([self.products[2].id], address='Москва, Тверская, 1'),
+        ]
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.post_batch(orders)
+
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual((data['created'], data['rejected']), (2, 2))
+        results = data['results']
+        self.assertEqual([result['status'] for result in results], ['success', 'error', 'error', 'success'])
+        self.assertEqual(results[1]['errors']['products'][0]['product'], ['Продукт с ID 999999 не найден'])
+
+        created = Order.objects.in_bulk([results[0]['order_id'], results[3]['order_id']])
+        self.assertEqual(created[results[0]['order_id']].items_count, 2)
+        self.assertEqual(created[results[3]['order_id']].address, 'Москва, Тверская, 1')
+        self.assertEqual(OrderChange.objects.filter(order__in=created).count(), 2)
+
+    # приём без автоназначения: его запросы считает AssignmentTest
+    @override_settings(ORDER_AUTO_ASSIGNMENT=False)
+    def test_query_count_does_not_depend_on_batch_size(self):
+        # токен и права партнёра, товары, очередь геокодирования и id
+        # местоположений, заказы, журнал, позиции и точки сохранения транзакции
+        for batch_size in (1, 20):
+            orders = [
+                self.make_order([product.id for product in self.products], address=f'Москва, Тверская, {number}')
+                for number in range(batch_size)
+            ]
+            with self.subTest(batch_size=batch_size), self.assertNumQueries(11):
+                response = self.post_batch(orders)
+            self.assertEqual(response.json()['created'], batch_size)
+
+    @override_settings(ORDER_BATCH_MAX_SIZE=2)
+    def test_oversized_and_empty_batches_are_rejected(self):
+        for orders in ([], [self.make_order([self.products[0].id])] * 3):
+            with self.subTest(batch_size=len(orders)):
+                response = self.post_batch(orders)
+                self.assertEqual(response.status_code, 400)
+                self.assertIn('orders', response.json()['errors'])
+        self.assertFalse(Order.objects.exists())
+
+
+class AvailabilityIndexTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.restaurants = [Restaurant.objects.create(name=f'Star Burger {number}') for number in range(3)]
+        cls.products = Product.objects.bulk_create(
+            Product(name=f'Бургер {number}', price=100, image='burger.jpg') for number in range(2)
+        )
+
+    def get_mask(self, product):
+        return get_availability_masks([product.id])[product.id]
+
+    def test_menu_changes_update_the_index(self):
+        burger = self.products[0]
+        with self.captureOnCommitCallbacks(execute=True):
+            first_item = RestaurantMenuItem.objects.create(restaurant=self.restaurants[0], product=burger)
+            RestaurantMenuItem.objects.create(restaurant=self.restaurants[2], product=burger)
+        self.assertEqual(self.get_mask(burger), ids_to_mask([self.restaurants[0].id, self.restaurants[2].id]))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            first_item.availability = False
+            first_item.save()
+        self.assertEqual(self.get_mask(burger), ids_to_mask([self.restaurants[2].id]))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.restaurants[2].delete()
+        self.assertEqual(self.get_mask(burger), 0)
+
+    def test_capable_restaurants_have_every_product(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            for restaurant in self.restaurants[:2]:
+                RestaurantMenuItem.objects.create(restaurant=restaurant, product=self.products[0])
+            RestaurantMenuItem.objects.create(restaurant=self.restaurants[1], product=self.products[1])
+
+        product_ids = [product.id for product in self.products]
+        masks = get_availability_masks(product_ids)
+        self.assertEqual(get_capable_restaurant_ids(product_ids, masks), [self.restaurants[1].id])
+        self.assertEqual(get_capable_restaurant_ids([], masks), [])
+
+    def test_deleted_product_leaves_no_index_row(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            RestaurantMenuItem.objects.create(restaurant=self.restaurants[0], product=self.products[0])
+            self.products[0].delete()
+
+        refresh_products_availability([self.products[0].id])
+        self.assertFalse(ProductAvailability.objects.filter(product_id=self.products[0].id).exists())
+
+    def test_bulk_changes_need_a_rebuild(self):
+        RestaurantMenuItem.objects.bulk_create(
+            RestaurantMenuItem(restaurant=restaurant, product=self.products[0]) for restaurant in self.restaurants
+        )
+        # bulk_create сигналов не шлёт — индекс прежний до пересборки
+        self.assertEqual(self.get_mask(self.products[0]), 0)
+
+        call_command('rebuild_availability_index', stdout=io.StringIO())
+
+        self.assertEqual(
+            self.get_mask(self.products[0]),
+            ids_to_mask(restaurant.id for restaurant in self.restaurants),
+        )
+
+
+class MenuAvailabilityTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser('admin', password='admin')
+        cls.restaurants = [Restaurant.objects.create(name=f'Star Burger {number}') for number in range(2)]
+        cls.products = Product.objects.bulk_create(
+            Product(name=f'Бургер {number}', price=100, image='burger.jpg') for number in range(3)
+        )
+        RestaurantMenuItem.objects.bulk_create(
+            RestaurantMenuItem(restaurant=cls.restaurants[0], product=product) for product in cls.products
+        )
+        refresh_products_availability()
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.admin)
+
+    def available_pairs(self):
+        return set(
+            RestaurantMenuItem.objects.filter(availability=True).values_list('restaurant_id', 'product_id')
+        )
+
+    def test_product_is_enabled_everywhere_with_one_event(self):
+        events = []
+        menu_availability_changed.connect(lambda **kwargs: events.append(kwargs), weak=False, dispatch_uid='test')
+        self.addCleanup(menu_availability_changed.disconnect, dispatch_uid='test')
+        catalog_version = get_catalog_version()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/menu/availability/', {
+                'products': [self.products[0].id],
+                'availability': True,
+            }, content_type='application/json')
+
+        self.assertEqual(response.status_code, 200)
+        # в первом ресторане товар уже был в продаже
+        self.assertEqual(response.json()['changed'], 1)
+        self.assertIn((self.restaurants[1].id, self.products[0].id), self.available_pairs())
+        self.assertEqual(len(events), 1)
+        self.assertEqual(get_availability_masks([self.products[0].id])[self.products[0].id],
+                         ids_to_mask(restaurant.id for restaurant in self.restaurants))
+        self.assertNotEqual(get_catalog_version(), catalog_version)
+
+    def test_whole_restaurant_is_enabled_without_new_menu_items(self):
+        RestaurantMenuItem.objects.filter(product=self.products[0]).update(availability=False)
+
+        response = self.client.post('/api/menu/availability/', {
+            'restaurants': [restaurant.id for restaurant in self.restaurants],
+            'availability': True,
+        }, content_type='application/json')
+
+        self.assertEqual(response.json()['changed'], 1)
+        self.assertEqual(RestaurantMenuItem.objects.count(), len(self.products))
+        self.assertEqual(self.available_pairs(), {
+            (self.restaurants[0].id, product.id) for product in self.products
+        })
+
+    def test_changed_counts_only_real_changes(self):
+        changed_count = set_menu_availability(
+            True,
+            restaurant_ids=[restaurant.id for restaurant in self.restaurants],
+            product_ids=[product.id for product in self.products[:2]],
+        )
+
+        self.assertEqual(changed_count, 2)
+        self.assertEqual(set_menu_availability(True, product_ids=[self.products[0].id]), 0)
+
+    def test_restaurant_menu_is_disabled_by_admin_action(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post('/admin/foodcartapp/restaurant/', {
+                'action': 'disable_restaurants_menu',
+                '_selected_action': [self.restaurants[0].id],
+            })
+
+        self.assertEqual(self.available_pairs(), set())
+        self.assertEqual(set(get_availability_masks([product.id for product in self.products]).values()), {0})
+
+    def test_query_count_does_not_depend_on_selection_size(self):
+        for products in [self.products[:1], self.products]:
+            # подсчёт уже включённых и UPSERT в точке сохранения, два чтения
+            # на пересчёт индекса и удаление лишних строк с UPSERT'ом в своей точке сохранения
+            with self.subTest(products=len(products)), self.assertNumQueries(10):
+                with self.captureOnCommitCallbacks(execute=True):
+                    set_menu_availability(
+                        True,
+                        restaurant_ids=[restaurant.id for restaurant in self.restaurants],
+                        product_ids=[product.id for product in products],
+                    )
+
+    def test_unknown_ids_and_empty_selection_are_rejected(self):
+        response = self.client.post('/api/menu/availability/', {
+            'restaurants': [999999],
+            'availability': False,
+        }, content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('restaurants', response.json()['errors'])
+
+        response = self.client.post('/api/menu/availability/', {'availability': False}, content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_only_staff_can_toggle(self):
+        self.client.logout()
+
+        response = self.client.post('/api/menu/availability/', {
+            'products': [self.products[0].id],
+            'availability': False,
+        }, content_type='application/json')
+
+        self.assertEqual(response.status_code, 403)
+
+
+class RestaurantIndexTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        Location.objects.create(address='Москва, Тверская, 1', latitude=55.757, longitude=37.613)
+        Location.objects.create(address='Москва, Профсоюзная, 150', latitude=55.62, longitude=37.50)
+        Location.objects.create(address='Москва, Арбат, 2')
+        cls.near = Restaurant.objects.create(name='У метро', address='Москва, Тверская, 1')
+        cls.far = Restaurant.objects.create(name='На окраине', address='Москва, Профсоюзная, 150')
+        cls.new = Restaurant.objects.create(name='Новый', address='Москва, Арбат, 2')
+
+    def setUp(self):
+        cache.clear()
+
+    def find(self, capable_restaurants, k=5):
+        restaurant_ids = [restaurant.id for restaurant in capable_restaurants]
+        return [
+            restaurant_id
+            for restaurant_id, _ in find_nearest_capable_restaurants((55.752, 37.594), restaurant_ids, k=k)
+        ]
+
+    def test_nearest_capable_restaurants(self):
+        self.assertEqual(self.find([self.near, self.far, self.new]), [self.near.id, self.far.id])
+        self.assertEqual(self.find([self.near, self.far], k=1), [self.near.id])
+        self.assertEqual(self.find([self.far]), [self.far.id])
+
+    def test_candidates_keep_restaurants_without_coordinates(self):
+        restaurant_ids = [self.near.id, self.far.id, self.new.id]
+
+        self.assertEqual(
+            [restaurant_id for restaurant_id, _ in list_candidate_restaurants((55.752, 37.594), restaurant_ids, k=1)],
+            [self.near.id, self.new.id],
+        )
+        self.assertEqual(
+            list_candidate_restaurants(None, restaurant_ids, k=1),
+            [(self.near.id, None), (self.far.id, None), (self.new.id, None)],
+        )
+
+    def test_index_is_rebuilt_when_restaurant_is_geocoded(self):
+        self.find([self.new])
+
+        location = Location.objects.get(address='Москва, Арбат, 2')
+        location.latitude, location.longitude = 55.751, 37.597
+        with self.captureOnCommitCallbacks(execute=True):
+            save_geocoded_locations([location])
+
+        self.assertEqual(self.find([self.near, self.far, self.new]), [self.new.id, self.near.id, self.far.id])
+
+    def test_index_uses_linked_location(self):
+        self.find([self.near])
+        # координаты берутся по ссылке, а не по строке адреса
+        Restaurant.objects.filter(pk=self.far.pk).update(address='Москва, неизвестный адрес')
+        invalidate_restaurant_index()
+
+        with self.assertNumQueries(1):
+            self.assertEqual(self.find([self.near, self.far]), [self.near.id, self.far.id])
+
+    def test_index_only_reads_restaurants(self):
+        Restaurant.objects.filter(pk=self.far.pk).update(location=None)
+        invalidate_restaurant_index()
+
+        # один SELECT ресторанов: ссылки ставит не индекс, а link_locations
+        with self.assertNumQueries(1):
+            self.assertEqual(self.find([self.far]), [])
+        self.far.refresh_from_db()
+        self.assertIsNone(self.far.location)
+
+    def test_index_is_rebuilt_when_restaurant_moves(self):
+        self.find([self.near])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.near.address = 'Москва, Арбат, 2'
+            self.near.save()
+
+        self.assertEqual(self.find([self.near]), [])
+
+
+@override_settings(ASSIGNMENT_LOAD_PENALTY_KM=0.5, ASSIGNMENT_MAX_OPEN_ORDERS=2)
+class AssignmentTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        Location.objects.create(address='Москва, Тверская, 1', latitude=55.757, longitude=37.613)
+        Location.objects.create(address='Москва, Профсоюзная, 150', latitude=55.62, longitude=37.50)
+        cls.near = Restaurant.objects.create(name='У метро', address='Москва, Тверская, 1')
+        cls.far = Restaurant.objects.create(name='На окраине', address='Москва, Профсоюзная, 150')
+        Location.objects.create(address='Москва, Пушкинская, 3', latitude=55.765, longitude=37.605)
+        Location.objects.create(
+            address='Москва, Несуществующая, 0',
+            last_geocode_attempt=timezone.now(),
+            geocode_attempts=1,
+        )
+
+        cls.burger = Product.objects.create(name='Бургер', price=100, image='burger.jpg')
+        cls.shake = Product.objects.create(name='Коктейль', price=50, image='shake.jpg')
+        RestaurantMenuItem.objects.bulk_create([
+            RestaurantMenuItem(restaurant=cls.near, product=cls.burger),
+            RestaurantMenuItem(restaurant=cls.far, product=cls.burger),
+            RestaurantMenuItem(restaurant=cls.far, product=cls.shake),
+        ])
+        refresh_products_availability()
+
+    def setUp(self):
+        cache.clear()
+
+    def create_order(self, address='Москва, Пушкинская, 3', products=None):
+        order = Order.objects.create(
+            firstname='Иван',
+            lastname='Петров',
+            phonenumber='+79161234567',
+            address=address,
+            payment_method='cash',
+        )
+        for product in products or [self.burger]:
+            OrderItem.objects.create(order=order, product=product, quantity=1, price=product.price)
+        return order
+
+    def test_nearest_restaurant_with_all_products_is_assigned(self):
+        burger_order = self.create_order()
+        combo_order = self.create_order(products=[self.burger, self.shake])
+
+        assignments = assign_orders([burger_order, combo_order])
+
+        self.assertEqual(assignments, {burger_order.id: self.near.id, combo_order.id: self.far.id})
+        burger_order.refresh_from_db()
+        self.assertEqual(burger_order.cooking_restaurant, self.near)
+        self.assertIsNotNone(burger_order.assignment_checked_at)
+        self.assertTrue(OrderChange.objects.filter(order=burger_order).exists())
+
+    def test_busy_restaurant_passes_orders_to_the_next_one(self):
+        orders = [self.create_order() for _ in range(3)]
+
+        assignments = assign_orders(orders)
+
+        self.assertEqual(sorted(assignments.values()), [self.near.id, self.near.id, self.far.id])
+
+    def test_orders_without_candidates_are_left_to_manager(self):
+        shake_order = self.create_order(products=[self.shake, self.burger])
+        unknown_address_order = self.create_order(address='Москва, Несуществующая, 0')
+        RestaurantMenuItem.objects.filter(restaurant=self.far, product=self.shake).update(availability=False)
+        refresh_products_availability()
+
+        assignments = assign_orders([shake_order, unknown_address_order])
+
+        self.assertEqual(assignments, {shake_order.id: None, unknown_address_order.id: None})
+        self.assertFalse(Order.objects.awaiting_assignment().exists())
+
+    def test_coordinates_come_from_linked_location(self):
+        order = self.create_order()
+        Order.objects.filter(pk=order.pk).update(address='Москва, Несуществующая, 0')
+
+        self.assertEqual(assign_new_orders([order]), {order.id: self.near.id})
+
+    def test_order_decided_by_worker_is_not_assigned_again(self):
+        order = self.create_order()
+        Order.objects.filter(pk=order.pk).update(assignment_checked_at=timezone.now())
+
+        self.assertEqual(assign_new_orders([order]), {})
+
+    def test_orders_wait_for_geocoder(self):
+        order = self.create_order(address='Москва, Тверская, 7')
+        self.assertEqual(order.location.address, 'Москва, Тверская, 7')
+
+        self.assertEqual(process_assignment_queue(), 0)
+        self.assertTrue(Order.objects.awaiting_assignment().filter(pk=order.pk).exists())
+
+        location = Location.objects.get(address='Москва, Тверская, 7')
+        location.mark_geocoded((37.61, 55.76))
+        with self.settings(ORDER_AUTO_ASSIGNMENT=True), self.captureOnCommitCallbacks(execute=True):
+            save_geocoded_locations([location])
+
+        order.refresh_from_db()
+        self.assertEqual(order.cooking_restaurant, self.near)
+
+    @override_settings(ORDER_AUTO_ASSIGNMENT=True)
+    def test_known_address_is_assigned_on_registration(self):
+        # ORDER_REGISTRATION_WITH_ASSIGNMENT_QUERIES держит запас над этим числом
+        with self.assertNumQueries(19):
+            response = self.client.post('/api/order/', {
+                'firstname': 'Иван',
+                'lastname': 'Петров',
+                'phonenumber': '+79161234567',
+                'address': 'Москва, Пушкинская, 3',
+                'products': [{'product': self.burger.id, 'quantity': 1}],
+            }, content_type='application/json')
+
+        self.assertEqual(response.status_code, 200)
+        order = Order.objects.get(pk=response.json()['order_id'])
+        self.assertEqual(order.cooking_restaurant, self.near)
+
+
+class LocationLinkTest(TestCase):
+    def test_restaurant_is_relinked_when_address_changes(self):
+        restaurant = Restaurant.objects.create(name='Star Burger', address='Москва, Тверская, 1')
+        first_location = restaurant.location
+
+        restaurant = Restaurant.objects.get(pk=restaurant.pk)
+        restaurant.name = 'Star Burger Тверская'
+        restaurant.save()
+        self.assertEqual(restaurant.location, first_location)
+
+        restaurant.address = 'Москва, Арбат, 2'
+        restaurant.save()
+        self.assertEqual(restaurant.location.address, 'Москва, Арбат, 2')
+        self.assertTrue(Location.objects.pending().filter(pk=restaurant.location_id).exists())
+
+    def test_created_record_is_not_relinked_on_save(self):
+        restaurant = Restaurant.objects.create(name='Star Burger', address='Москва, Тверская, 1')
+
+        restaurant.name = 'Star Burger Тверская'
+        with self.assertNumQueries(1):
+            restaurant.save()
+
+        restaurant.address = 'Москва, Арбат, 2'
+        restaurant.save()
+        self.assertEqual(restaurant.location.address, 'Москва, Арбат, 2')
+        with self.assertNumQueries(1):
+            restaurant.save()
+
+    def test_existing_orders_are_linked_in_batches(self):
+        Order.objects.bulk_create(
+            Order(firstname='Иван', lastname='Петров', phonenumber='+79161234567', address=address)
+            for address in ['Москва, Тверская, 1', 'москва тверская 1', 'Москва, Арбат, 2']
+        )
+
+        # по четыре запроса на пачку и один пустой в конце
+        with self.assertNumQueries(9):
+            self.assertEqual(link_locations(Order.objects.all(), batch_size=2), 3)
+
+        self.assertFalse(Order.objects.filter(location__isnull=True).exists())
+        self.assertEqual(Location.objects.count(), 2)
+
+
+class BenchmarkTest(TestCase):
+    def test_fixtures_are_consistent(self):
+        fixtures = generate_fixtures(restaurants=3, products=10, orders=20, geocoded_share=1)
+
+        self.assertEqual(
+            [len(fixtures[name]) for name in ['restaurants', 'products', 'orders']],
+            [3, 10, 20],
+        )
+        self.assertFalse(Order.objects.filter(location__isnull=True).exists())
+        self.assertFalse(Restaurant.objects.filter(location__isnull=True).exists())
+        self.assertEqual(ProductAvailability.objects.count(), 10)
+        for order in Order.objects.prefetch_related('items'):
+            self.assertEqual(order.items_count, len(order.items.all()))
+            self.assertEqual(order.total_cost, sum(item.price * item.quantity for item in order.items.all()))
+
+    def test_measure_reports_latency_queries_and_size(self):
+        def make_request():
+            Product.objects.exists()
+            return HttpResponse(b'x' * 10)
+
+        result = measure('сценарий', make_request, iterations=3)
+
+        self.assertEqual((result['iterations'], result['queries'], result['response_bytes']), (3, 1, 10))
+        self.assertLessEqual(result['p50_ms'], result['max_ms'])
+        table = format_results([result])
+        self.assertEqual(len(table.splitlines()), 2)
+        self.assertIn('сценарий', table.splitlines()[1])
+
+    def test_failed_request_is_reported(self):
+        with self.assertRaisesMessage(RuntimeError, 'сломанный: ответ 500'):
+            measure('сломанный', lambda: HttpResponse(status=500), iterations=1)
+
+    def test_benchmarks_do_not_touch_configured_cache(self):
+        fixtures = generate_fixtures(restaurants=2, products=5, orders=5)
+        cache.set('production-key', 'value')
+
+        results = run_benchmarks(fixtures, iterations=1)
+
+        self.assertEqual(cache.get('production-key'), 'value')
+        self.assertTrue(all(result['iterations'] == 1 for result in results))
+
+
+class ImageVariantsTest(TestCase):
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        self.enterContext(override_settings(MEDIA_ROOT=media_root, MEDIA_URL='/media/'))
+        cache.clear()
+
+    def make_upload(self, size, name='burger.png'):
+        buffer = io.BytesIO()
+        Image.new('RGBA', size, (200, 100, 0, 128)).save(buffer, 'PNG')
+        return SimpleUploadedFile(name, buffer.getvalue(), content_type='image/png')
+
+    def generate_variants(self):
+        call_command('generate_image_variants', stdout=io.StringIO())
+
+    def create_product(self, size):
+        with self.captureOnCommitCallbacks(execute=True):
+            product = Product.objects.create(name='Бургер', price=100, image=self.make_upload(size))
+            RestaurantMenuItem.objects.create(restaurant=Restaurant.objects.create(name='Арбат'), product=product)
+        self.generate_variants()
+        product.refresh_from_db()
+        return product
+
+    def test_variants_are_generated_on_upload(self):
+        product = self.create_product((800, 400))
+
+        variants = product.image_variants['variants']
+        self.assertEqual([width for width, _ in variants['webp']], [100, 300, 600])
+        self.assertEqual([width for width, _ in variants['jpeg']], [100, 300, 600])
+        with product.image.storage.open(variants['jpeg'][1][1]) as variant_file:
+            self.assertEqual(Image.open(variant_file).size, (300, 150))
+        self.assertTrue(variants['webp'][0][1].startswith(f"variants/{product.image_variants['hash']}-100"))
+
+        self.assertEqual(get_thumbnail_url(product), f"/media/{variants['jpeg'][0][1]}")
+        catalog_product = self.client.get('/api/products/').json()[0]
+        self.assertEqual(catalog_product['image_srcset'], get_image_srcset(product))
+        self.assertIn(' 600w', catalog_product['image_srcset']['webp'])
+
+    def test_small_image_is_not_upscaled(self):
+        product = self.create_product((60, 60))
+
+        self.assertEqual(product.image_variants['variants']['jpeg'], [[60, product.image_variants['variants']['jpeg'][0][1]]])
+
+    def test_new_upload_replaces_variants(self):
+        product = self.create_product((400, 400))
+        old_hash = product.image_variants['hash']
+
+        with self.captureOnCommitCallbacks(execute=True):
+            product.name = 'Чизбургер'
+            product.save()
+        product.refresh_from_db()
+        self.assertEqual(product.image_variants['hash'], old_hash)
+
+        buffer = io.BytesIO()
+        Image.new('RGB', (400, 400), 'green').save(buffer, 'JPEG')
+        old_names = [name for _, name in product.image_variants['variants']['jpeg']]
+        with self.captureOnCommitCallbacks(execute=True):
+            product.image = SimpleUploadedFile('green.jpg', buffer.getvalue(), content_type='image/jpeg')
+            product.save()
+        # до обработчика каталог отдаёт оригинал, а не копии старой картинки
+        self.assertEqual(get_image_srcset(product), {})
+        self.generate_variants()
+
+        product.refresh_from_db()
+        self.assertNotEqual(product.image_variants['hash'], old_hash)
+        self.assertFalse(any(product.image.storage.exists(name) for name in old_names))
+
+    def test_variants_are_not_generated_in_request(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            product = Product.objects.create(name='Бургер', price=100, image=self.make_upload((400, 400)))
+        product.refresh_from_db()
+
+        self.assertEqual(product.image_variants, {})
+        self.assertEqual(Product.objects.without_image_variants().get(), product)
+
+    def test_decompression_bomb_is_skipped(self):
+        with patch.object(Image, 'MAX_IMAGE_PIXELS', 1000), self.assertLogs('foodcartapp.images', level='WARNING'):
+            product = self.create_product((800, 400))
+
+        self.assertEqual(get_image_srcset(product), {})
+        self.assertFalse(Product.objects.without_image_variants().exists())
@@ -1,6 +1,6 @@
 from django.urls import path
 
-from .views import product_list_api, banners_list_api, register_order
+from .views import product_list_api, banners_list_api, register_order, register_orders_batch, menu_availability_api
 
 
 app_name = "foodcartapp"
@@ -9,4 +9,6 @@ urlpatterns = [
     path('products/', product_list_api),
     path('banners/', banners_list_api),
     path('order/', register_order),
+    path('orders/batch/', register_orders_batch),
+    path('menu/availability/', menu_availability_api),
 ]
@@ -0,0 +1,5 @@
+def percentile(values, share):
+    """Значение, ниже которого лежит доля share отсортированных values (0.5 — медиана)"""
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, round(share * (len(ordered) - 1)))
+    return ordered[index]
@@ -1,75 +1,98 @@
-import json
-from django.http import JsonResponse
+import functools
+from django.conf import settings
+from django.shortcuts import render
 from django.templatetags.static import static
-from django.views.decorators.csrf import csrf_exempt
-from django.db import transaction
+from django.views.decorators.http import condition
+from django.utils.cache import patch_cache_control
 from rest_framework.response import Response
 from rest_framework import status
-from django.views.decorators.csrf import csrf_exempt
 
-from .models import Product, Order, OrderItem, Restaurant
-from .serializers import OrderSerializer
+from star_burger.metrics import query_budget
 
-from rest_framework.decorators import api_view
+from .assignment import assign_new_orders, get_order_registration_budget
+from .availability import set_menu_availability
+from .catalog import get_catalog
+from .idempotency import idempotent
+from .importing import validate_order_payloads
+from .permissions import CanAddOrders, OrderBatchRateThrottle
+from .responses import choose_request_encoding, compress_variants, dump_json, encoding_etag, precompressed_response
+from .serializers import MenuAvailabilitySerializer, OrderBatchSerializer, OrderSerializer
+
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.decorators import api_view, authentication_classes, permission_classes, throttle_classes
+from rest_framework.permissions import IsAdminUser
+
+
+BANNERS = [
+    {
+        'title': 'Burger',
+        'src': 'burger.jpg',
+        'text': 'Tasty Burger at your door step',
+    },
+    {
+        'title': 'Spices',
+        'src': 'food.jpg',
+        'text': 'All Cuisines',
+    },
+    {
+        'title': 'New York',
+        'src': 'tasty.jpg',
+        'text': 'Food is incomplete without a tasty dessert',
+    },
+]
+
+
+@functools.cache
+def get_banners():
+    # баннеры не меняются, пока жив процесс: сжимаем один раз
+    return compress_variants(dump_json([
+        {**banner, 'src': static(banner['src'])} for banner in BANNERS
+    ]))
 
 
 def banners_list_api(request):
-    return JsonResponse([
-        {
-            'title': 'Burger',
-            'src': static('burger.jpg'),
-            'text': 'Tasty Burger at your door step',
-        },
-        {
-            'title': 'Spices',
-            'src': static('food.jpg'),
-            'text': 'All Cuisines',
-        },
-        {
-            'title': 'New York',
-            'src': static('tasty.jpg'),
-            'text': 'Food is incomplete without a tasty dessert',
-        }
-    ], safe=False, json_dumps_params={
-        'ensure_ascii': False,
-        'indent': 4,
-    })
+    return precompressed_response(request, get_banners())
+
 
+def get_catalog_etag(request):
+    variants, etag = get_catalog()
+    return encoding_etag(etag, choose_request_encoding(request, variants))
 
+
+@query_budget(2)
+@condition(etag_func=get_catalog_etag)
 def product_list_api(request):
-    products = Product.objects.select_related('category').available()
-
-    dumped_products = []
-    for product in products:
-        dumped_product = {
-            'id': product.id,
-            'name': product.name,
-            'price': product.price,
-            'special_status': product.special_status,
-            'description': product.description,
-            'category': {
-                'id': product.category.id,
-                'name': product.category.name,
-            } if product.category else None,
-            'image': product.image.url,
-            'restaurant': {
-                'id': product.id,
-                'name': product.name,
-            }
-        }
-        dumped_products.append(dumped_product)
-    return JsonResponse(dumped_products, safe=False, json_dumps_params={
-        'ensure_ascii': False,
-        'indent': 4,
-    })
+    variants, etag = get_catalog()
+    response = precompressed_response(request, variants)
+    patch_cache_control(response, no_cache=True)
+    return response
 
 
+def start_page(request):
+    # Idempotency-Key анонимного покупателя привязан к сессии: она нужна
+    # до оформления заказа, иначе повтор не найдёт ответ первого запроса
+    if request.session.session_key is None:
+        request.session.save()
+    return render(request, 'index.html')
+
+
+# чтение сессии покупателя, к которой привязан Idempotency-Key
+ORDER_SESSION_QUERIES = 1
+
+
+# запросы на Idempotency-Key idempotent добавляет к бюджету сам
+@query_budget(lambda: get_order_registration_budget() + ORDER_SESSION_QUERIES)
 @api_view(['POST'])
+@idempotent
 def register_order(request):
     serializer = OrderSerializer(data=request.data)
     if serializer.is_valid():
         order = serializer.save()
-            
+        if settings.ORDER_AUTO_ASSIGNMENT:
+            # адрес уже знаком геокодеру — ресторан назначится сразу,
+            # новый адрес дождётся геокодирования
+            assign_new_orders([order])
+
         return Response({
                 'order_id': order.id,
                 'status': 'success',
@@ -80,4 +103,67 @@ def register_order(request):
             'status': 'error',
             'message': 'Невалидные данные заказа',
             'errors': serializer.errors
-        }, status=status.HTTP_400_BAD_REQUEST)
\ No newline at end of file
+        }, status=status.HTTP_400_BAD_REQUEST)
+
+
+# токен вместе с пользователем и права пользователя и его групп
+ORDER_BATCH_AUTH_QUERIES = 3
+
+
+# число запросов не зависит от размера пачки: товары, очередь геокодирования,
+# INSERT'ы заказов, позиций и журнала, плюс токен и пользователь с правами
+@query_budget(lambda: get_order_registration_budget() + ORDER_BATCH_AUTH_QUERIES)
+@api_view(['POST'])
+@authentication_classes([TokenAuthentication])
+@permission_classes([CanAddOrders])
+@throttle_classes([OrderBatchRateThrottle])
+@idempotent
+def register_orders_batch(request):
+    """Пачка заказов от колл-центра и партнёров: годные создаются, на остальные — ошибки"""
+    serializer = OrderBatchSerializer(data=request.data)
+    if not serializer.is_valid():
+        return Response({
+            'status': 'error',
+            'message': 'Невалидная пачка заказов',
+            'errors': serializer.errors
+        }, status=status.HTTP_400_BAD_REQUEST)
+
+    payloads = serializer.validated_data['orders']
+    valid_orders, errors = validate_order_payloads(payloads)
+    orders = OrderSerializer(many=True).create(list(valid_orders.values())) if valid_orders else []
+    if orders and settings.ORDER_AUTO_ASSIGNMENT:
+        assign_new_orders(orders)
+
+    order_ids = {index: order.id for index, order in zip(valid_orders, orders)}
+    return Response({
+        'status': 'success',
+        'created': len(order_ids),
+        'rejected': len(errors),
+        'results': [
+            {'status': 'success', 'order_id': order_ids[index]} if index in order_ids else
+            {'status': 'error', 'errors': errors[index]}
+            for index in range(len(payloads))
+        ],
+    })
+
+
+@api_view(['POST'])
+@permission_classes([IsAdminUser])
+def menu_availability_api(request):
+    serializer = MenuAvailabilitySerializer(data=request.data)
+    if not serializer.is_valid():
+        return Response({
+            'status': 'error',
+            'message': 'Невалидные данные',
+            'errors': serializer.errors
+        }, status=status.HTTP_400_BAD_REQUEST)
+
+    changed_count = set_menu_availability(
+        serializer.validated_data['availability'],
+        restaurant_ids=serializer.validated_data.get('restaurants'),
+        product_ids=serializer.validated_data.get('products'),
+    )
+    return Response({
+        'status': 'success',
+        'changed': changed_count,
+    })
@@ -4,17 +4,32 @@ from .models import Location
 
 @admin.register(Location)
 class LocationAdmin(admin.ModelAdmin):
-    list_display = ['address', 'latitude', 'longitude', 'updated_at', 'last_geocode_attempt']
-    list_filter = ['updated_at', 'last_geocode_attempt']
+    list_display = [
+        'address',
+        'latitude',
+        'longitude',
+        'updated_at',
+        'last_geocode_attempt',
+        'geocode_attempts',
+        'last_geocode_error',
+    ]
+    list_filter = ['updated_at', 'last_geocode_attempt', 'last_geocode_error']
     search_fields = ['address']
-    readonly_fields = ['created_at', 'updated_at']
+    readonly_fields = ['address_key', 'created_at', 'updated_at']
 
     fieldsets = (
         (None, {
-            'fields': ('address', 'latitude', 'longitude')
+            'fields': ('address', 'address_key', 'latitude', 'longitude')
         }),
         ('Даты', {
-            'fields': ('created_at', 'updated_at', 'last_geocode_attempt'),
+            'fields': (
+                'created_at',
+                'updated_at',
+                'last_geocode_attempt',
+                'geocode_attempts',
+                'last_geocode_error',
+                'next_geocode_attempt',
+            ),
             'classes': ('collapse',)
         }),
     )
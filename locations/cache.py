@@ -0,0 +1,142 @@
+"""Двухуровневый кэш координат адресов: LRU в памяти процесса и общий кэш Django.
+
+Записи хранятся по каноническому ключу адреса. Адреса без записи Location
+не кэшируются: их ставят в очередь геокодирования, и следующий запрос
+должен увидеть новую запись. При сохранении Location ключ удаляется
+из общего кэша, а версия кэша растёт — по ней каждый процесс сбрасывает
+свой LRU при следующем обращении.
+"""
+import hashlib
+import threading
+from collections import OrderedDict, namedtuple
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+from star_burger.cache_versions import bump_cache_version, get_cache_version
+from star_burger.metrics import registry
+
+from .models import Location
+from .normalization import make_address_key
+
+
+COORDINATES_VERSION_KEY = 'locations:coordinates_version'
+# запись, прочитанная из базы до сброса, но сохранённая после, живёт не дольше часа
+COORDINATES_CACHE_TIMEOUT = 60 * 60
+
+CachedLocation = namedtuple(
+    'CachedLocation',
+    ['latitude', 'longitude', 'last_geocode_attempt', 'next_geocode_attempt'],
+)
+
+
+def is_pending(location):
+    """То же условие, что и у Location.objects.pending(); подходит и для Location, и для CachedLocation"""
+    if location.latitude is not None:
+        return False
+    if location.last_geocode_attempt is None:
+        return True
+    return location.next_geocode_attempt is not None and location.next_geocode_attempt <= timezone.now()
+
+
+def get_coordinates(location):
+    if location.latitude is None or location.longitude is None:
+        return None
+    return location.latitude, location.longitude
+
+
+class LRUCache:
+    """Ограниченный по размеру словарь с вытеснением давно не читанных ключей"""
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.version = None
+        self.lock = threading.Lock()
+
+    def get_many(self, keys, version):
+        with self.lock:
+            if version != self.version:
+                self.entries.clear()
+                self.version = version
+            found = {}
+            for key in keys:
+                if key in self.entries:
+                    self.entries.move_to_end(key)
+                    found[key] = self.entries[key]
+            return found
+
+    def set_many(self, entries, version):
+        with self.lock:
+            if version != self.version:
+                return
+            self.entries.update(entries)
+            for key in entries:
+                self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+
+local_cache = LRUCache(settings.LOCATION_CACHE_SIZE)
+
+
+def make_cache_key(address_key):
+    # в ключе адреса пробелы и кириллица, которые не принимает memcached
+    return f'locations:coordinates:{hashlib.md5(address_key.encode()).hexdigest()}'
+
+
+def get_cached_locations(addresses):
+    """Сопоставляет адреса с CachedLocation; адреса без записи Location получают None"""
+    keys_by_address = {
+        address: make_address_key(address)
+        for address in addresses
+        if address and address.strip()
+    }
+    address_keys = set(keys_by_address.values())
+
+    version = get_cache_version(COORDINATES_VERSION_KEY)
+    found = local_cache.get_many(address_keys, version)
+    local_hits = len(found)
+
+    missing_keys = address_keys - found.keys()
+    shared_found = {}
+    if missing_keys:
+        cached = cache.get_many([make_cache_key(address_key) for address_key in missing_keys])
+        shared_found = {
+            address_key: cached[make_cache_key(address_key)]
+            for address_key in missing_keys
+            if make_cache_key(address_key) in cached
+        }
+        missing_keys -= shared_found.keys()
+
+    loaded = {}
+    if missing_keys:
+        loaded = {
+            address_key: CachedLocation(*fields)
+            for address_key, *fields in Location.objects.filter(address_key__in=missing_keys).values_list(
+                'address_key', 'latitude', 'longitude', 'last_geocode_attempt', 'next_geocode_attempt',
+            )
+        }
+        cache.set_many(
+            {make_cache_key(address_key): location for address_key, location in loaded.items()},
+            COORDINATES_CACHE_TIMEOUT,
+        )
+
+    local_cache.set_many({**shared_found, **loaded}, version)
+    found.update(shared_found)
+    found.update(loaded)
+    registry.observe_location_cache(
+        local_hits=local_hits,
+        shared_hits=len(shared_found),
+        misses=len(address_keys) - local_hits - len(shared_found),
+    )
+    return {
+        address: found.get(address_key)
+        for address, address_key in keys_by_address.items()
+    }
+
+
+def invalidate_cached_locations(address_keys):
+    cache.delete_many([make_cache_key(address_key) for address_key in address_keys])
+    bump_cache_version(COORDINATES_VERSION_KEY)
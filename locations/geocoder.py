@@ -1,45 +1,107 @@
+import threading
+import time
+
 import requests
-from requests.exceptions import HTTPError, RequestException
+from requests.adapters import HTTPAdapter
+from requests.exceptions import RequestException
 from django.conf import settings
 
+from star_burger.metrics import track_geocoder_call
+
+
+class GeocoderError(Exception):
+    """Геокодер не ответил или ответил ошибкой"""
+
+    def __init__(self, message, retryable=True, status_code=None):
+        super().__init__(message)
+        self.retryable = retryable
+        self.status_code = status_code
+
+    @property
+    def error_class(self):
+        """Короткое имя причины ошибки для хранения в Location"""
+        if self.status_code:
+            return f'HTTP{self.status_code}'
+        if self.__cause__:
+            return type(self.__cause__).__name__
+        return type(self).__name__
+
+
+class TokenBucket:
+    """Потокобезопасный ограничитель частоты запросов: rate запросов в секунду"""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or max(1, rate)
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+def create_session(pool_size=10):
+    """Сессия с keep-alive соединениями, которую можно делить между потоками"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
 
-def fetch_coordinates(apikey, address):
-    base_url = "https://geocode-maps.yandex.ru/1.x"
 
+def request_coordinates(apikey, address, session=None):
+    """Возвращает (долгота, широта) или None, если адрес не найден.
+
+    Ошибки сети и геокодера не глотаются, а поднимаются как GeocoderError.
+    """
+    http = session or requests
     try:
-        response = requests.get(base_url, params={
-            "geocode": address,
-            "apikey": apikey,
-            "format": "json",
-        }, timeout=10)
-
-        if response.status_code == 403:
-            print("Ошибка 403: Проверьте API-ключ и его настройки")
-            return None
-        elif response.status_code == 404:
-            print("Ошибка 404: API endpoint не найден")
-            return None
-        elif response.status_code != 200:
-            print(f"Ошибка {response.status_code}: {response.text}")
-            return None
-
-        response.raise_for_status()
+        with track_geocoder_call():
+            response = http.get(settings.YANDEX_GEOCODER_URL, params={
+                "geocode": address,
+                "apikey": apikey,
+                "format": "json",
+            }, timeout=10)
+    except RequestException as e:
+        raise GeocoderError(f"Ошибка соединения: {e}") from e
+
+    if response.status_code == 403:
+        raise GeocoderError(
+            "Ошибка 403: Проверьте API-ключ и его настройки",
+            retryable=False,
+            status_code=403,
+        )
+    elif response.status_code == 404:
+        raise GeocoderError("Ошибка 404: API endpoint не найден", retryable=False, status_code=404)
+    elif response.status_code != 200:
+        raise GeocoderError(
+            f"Ошибка {response.status_code}: {response.text}",
+            retryable=response.status_code == 429 or response.status_code >= 500,
+            status_code=response.status_code,
+        )
 
+    try:
         found_places = response.json()['response']['GeoObjectCollection']['featureMember']
+    except (ValueError, KeyError, TypeError) as e:
+        raise GeocoderError(f"Неожиданный ответ геокодера: {e!r}") from e
 
-        if not found_places:
-            return None
+    if not found_places:
+        return None
 
-        most_relevant = found_places[0]
-        lon, lat = most_relevant['GeoObject']['Point']['pos'].split(" ")
+    try:
+        lon, lat = found_places[0]['GeoObject']['Point']['pos'].split(" ")
         return float(lon), float(lat)
+    except (ValueError, KeyError, IndexError, TypeError, AttributeError) as e:
+        # повтор вернёт тот же ответ: адрес подождёт следующей попытки по расписанию
+        raise GeocoderError(f"Неожиданный ответ геокодера: {e!r}", retryable=False) from e
 
-    except HTTPError as e:
-        print(f"HTTP ошибка: {e}")
-        return None
-    except RequestException as e:
-        print(f"Ошибка соединения: {e}")
-        return None
-    except Exception as e:
-        print(f"Общая ошибка при геокодировании адреса {address}: {e}")
-        return None
@@ -0,0 +1,71 @@
+import random
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand
+from geopy.distance import distance
+
+from locations.distances import distance_matrix
+from locations.spatial import SpatialIndex
+
+
+def random_points(count, center=(55.75, 37.62), spread=0.3, seed=None):
+    rng = random.Random(seed)
+    return [
+        (center[0] + rng.uniform(-spread, spread), center[1] + rng.uniform(-spread, spread))
+        for _ in range(count)
+    ]
+
+
+class Command(BaseCommand):
+    help = 'Сравнивает попарный расчёт расстояний через geopy с матричным расчётом NumPy'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--orders', type=int, default=1000)
+        parser.add_argument('--restaurants', type=int, default=100)
+        parser.add_argument('--repeat', type=int, default=3, help='сколько раз повторить замер')
+
+    def measure(self, label, func, repeat):
+        timings = []
+        for _ in range(repeat):
+            started_at = time.perf_counter()
+            result = func()
+            timings.append(time.perf_counter() - started_at)
+        self.stdout.write(f'{label:<32} лучшее {min(timings) * 1000:10.1f} мс')
+        return result, min(timings)
+
+    def handle(self, *args, **options):
+        orders = random_points(options['orders'], seed=1)
+        restaurants = random_points(options['restaurants'], seed=2)
+        self.stdout.write(f"{len(orders)} заказов × {len(restaurants)} ресторанов")
+
+        def per_pair_geopy():
+            return [
+                [distance(order, restaurant).km for restaurant in restaurants]
+                for order in orders
+            ]
+
+        geopy_result, geopy_time = self.measure('geopy, попарно', per_pair_geopy, 1)
+        haversine_result, haversine_time = self.measure(
+            'haversine, матрица NumPy',
+            lambda: distance_matrix(orders, restaurants),
+            options['repeat'],
+        )
+
+        index = SpatialIndex(dict(enumerate(restaurants)))
+        self.measure(
+            'KD-дерево, 5 ближайших',
+            lambda: [index.nearest(order, k=5) for order in orders],
+            options['repeat'],
+        )
+        self.measure(
+            'матрица NumPy + сортировка',
+            lambda: np.argsort(distance_matrix(orders, restaurants), axis=1)[:, :5],
+            options['repeat'],
+        )
+
+        relative_error = np.abs(haversine_result - np.array(geopy_result)) / np.array(geopy_result)
+        self.stdout.write(f'максимальная относительная ошибка haversine: {relative_error.max():.4%}')
+        self.stdout.write(
+            self.style.SUCCESS(f'ускорение: {geopy_time / haversine_time:.0f}x')
+        )
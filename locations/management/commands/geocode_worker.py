@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand
+from locations.utils import run_geocoding_worker
+
+
+class Command(BaseCommand):
+    help = 'Фоновый обработчик очереди геокодирования адресов'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=20,
+            help='сколько адресов забирать из очереди за раз',
+        )
+        parser.add_argument(
+            '--sleep',
+            type=float,
+            default=5,
+            help='пауза в секундах, когда очередь пуста',
+        )
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='обработать очередь и завершиться',
+        )
+
+    def handle(self, *args, **options):
+        self.stdout.write('Обработчик очереди геокодирования запущен')
+
+        processed = run_geocoding_worker(
+            batch_size=options['batch_size'],
+            idle_sleep=options['sleep'],
+            once=options['once'],
+        )
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Обработано {processed} адресов'
+            )
+        )
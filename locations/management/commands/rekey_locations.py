@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from locations.utils import rekey_locations
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает ключи адресов после изменения правил нормализации и сливает дубликаты'
+
+    def handle(self, *args, **options):
+        changed, merged = rekey_locations()
+        self.stdout.write(
+            self.style.SUCCESS(f'Новый ключ у {changed} местоположений, слито дубликатов: {merged}')
+        )
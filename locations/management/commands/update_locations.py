@@ -1,11 +1,39 @@
+import time
+
 from django.core.management.base import BaseCommand
-from locations.utils import batch_update_locations
+from locations.utils import batch_update_locations, concurrent_update_locations
 from foodcartapp.models import Order, Restaurant
 
 
 class Command(BaseCommand):
     help = 'Обновляет координаты для всех заказов и ресторанов'
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=1,
+            help='число потоков; больше одного включает параллельный режим',
+        )
+        parser.add_argument(
+            '--rate',
+            type=float,
+            default=10,
+            help='не больше стольких запросов к геокодеру в секунду',
+        )
+        parser.add_argument(
+            '--retries',
+            type=int,
+            default=3,
+            help='сколько раз повторять запрос при ошибке геокодера',
+        )
+        parser.add_argument(
+            '--progress-every',
+            type=int,
+            default=100,
+            help='как часто печатать прогресс, в адресах',
+        )
+
     def handle(self, *args, **options):
 
         order_addresses = set(Order.objects.values_list('address', flat=True))
@@ -14,11 +42,29 @@ class Command(BaseCommand):
 
         self.stdout.write(f"Найдено {len(all_addresses)} уникальных адресов для геокодирования")
 
+        started_at = time.monotonic()
 
-        updated_locations = batch_update_locations(all_addresses)
+        def report_progress(done, total):
+            if done % options['progress_every'] and done != total:
+                return
+            elapsed = time.monotonic() - started_at
+            self.stdout.write(f"Геокодировано {done}/{total}, {done / elapsed:.1f} адр/с")
+
+        if options['workers'] > 1:
+            updated_locations = concurrent_update_locations(
+                all_addresses,
+                workers=options['workers'],
+                rate=options['rate'],
+                retries=options['retries'],
+                progress=report_progress,
+            )
+        else:
+            updated_locations = batch_update_locations(all_addresses)
 
+        elapsed = time.monotonic() - started_at
         self.stdout.write(
             self.style.SUCCESS(
-                f'Успешно обновлено {len(updated_locations)} местоположений'
+                f'Успешно обновлено {len(updated_locations)} местоположений '
+                f'за {elapsed:.1f} с'
             )
         )
@@ -0,0 +1,99 @@
+import re
+
+from django.db import migrations, models
+
+
+# копия locations.normalization на момент миграции: миграция должна делать
+# то же самое, даже когда правила нормализации поменяются; новые ключи
+# существующим записям проставляет команда rekey_locations
+
+# составные сокращения, которые разбились бы на токены по дефису
+COMPOUND_ABBREVIATIONS = {
+    'пр-т': 'проспект',
+    'пр-д': 'проезд',
+    'б-р': 'бульвар',
+}
+
+ABBREVIATIONS = {
+    'улица': 'ул',
+    'проспект': 'пр',
+    'просп': 'пр',
+    'переулок': 'пер',
+    'площадь': 'пл',
+    'бульвар': 'бул',
+    'бульв': 'бул',
+    'шоссе': 'ш',
+    'набережная': 'наб',
+    'проезд': 'прд',
+    'микрорайон': 'мкр',
+    'корпус': 'к',
+    'корп': 'к',
+    'строение': 'стр',
+    'квартира': 'кв',
+}
+
+# слова, которые не отличают один адрес от другого
+NOISE_WORDS = {'г', 'город', 'д', 'дом'}
+
+TOKEN_RE = re.compile(r'[^\W_]+(?:/[^\W_]+)?')
+COMPOUND_RE = re.compile(
+    r'(?<!\w)(' + '|'.join(re.escape(abbr) for abbr in COMPOUND_ABBREVIATIONS) + r')(?!\w)'
+)
+
+
+def make_address_key(address):
+    address = address.lower().replace('ё', 'е')
+    address = COMPOUND_RE.sub(lambda match: COMPOUND_ABBREVIATIONS[match.group(1)], address)
+
+    tokens = []
+    for token in TOKEN_RE.findall(address):
+        token = ABBREVIATIONS.get(token, token)
+        if token not in NOISE_WORDS:
+            tokens.append(token)
+    return ' '.join(tokens)[:200] or address.strip()[:200]
+
+
+def merge_duplicate_locations(apps, schema_editor):
+    Location = apps.get_model('locations', 'Location')
+
+    locations_by_key = {}
+    for location in Location.objects.order_by('id'):
+        location.address_key = make_address_key(location.address)
+        locations_by_key.setdefault(location.address_key, []).append(location)
+
+    duplicate_ids = []
+    for locations in locations_by_key.values():
+        # оставляем геокодированную и самую свежую запись
+        locations.sort(
+            key=lambda location: (
+                location.latitude is not None and location.longitude is not None,
+                location.updated_at,
+            ),
+            reverse=True,
+        )
+        location, *duplicates = locations
+        duplicate_ids.extend(duplicate.id for duplicate in duplicates)
+        location.save(update_fields=['address_key'])
+
+    Location.objects.filter(id__in=duplicate_ids).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('locations', '0002_alter_location_address'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='location',
+            name='address_key',
+            field=models.CharField(editable=False, max_length=200, null=True, verbose_name='ключ адреса'),
+        ),
+        migrations.RunPython(merge_duplicate_locations, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='location',
+            name='address_key',
+            field=models.CharField(editable=False, help_text='адрес без регистра, знаков препинания и с единообразными сокращениями', max_length=200, unique=True, verbose_name='ключ адреса'),
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 4.2.30 on 2026-10-18 04:09
+
+from datetime import timedelta
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def schedule_attempted_locations(apps, schema_editor):
+    # раньше повторная попытка разрешалась через сутки после предыдущей
+    Location = apps.get_model('locations', 'Location')
+    attempted_locations = Location.objects.filter(last_geocode_attempt__isnull=False)
+    attempted_locations.update(next_geocode_attempt=F('last_geocode_attempt') + timedelta(days=1))
+    attempted_locations.filter(latitude__isnull=True).update(geocode_attempts=1)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('locations', '0003_location_address_key'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='location',
+            name='geocode_attempts',
+            field=models.PositiveIntegerField(default=0, verbose_name='неудачных попыток подряд'),
+        ),
+        migrations.AddField(
+            model_name='location',
+            name='last_geocode_error',
+            field=models.CharField(blank=True, max_length=100, verbose_name='последняя ошибка геокодирования'),
+        ),
+        migrations.AddField(
+            model_name='location',
+            name='next_geocode_attempt',
+            field=models.DateTimeField(blank=True, db_index=True, null=True, verbose_name='следующая попытка геокодирования'),
+        ),
+        migrations.RunPython(schedule_attempted_locations, migrations.RunPython.noop),
+    ]
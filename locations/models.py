@@ -1,6 +1,37 @@
+from datetime import timedelta
+
 from django.db import models
+from django.db.models import Q
 from django.utils import timezone
 
+from .normalization import make_address_key
+
+
+# как часто уточнять координаты уже найденных адресов
+GEOCODE_REFRESH_INTERVAL = timedelta(days=1)
+# пауза после первой неудачи, дальше она удваивается до GEOCODE_RETRY_MAX_DELAY
+GEOCODE_RETRY_BASE_DELAY = timedelta(minutes=10)
+GEOCODE_RETRY_MAX_DELAY = timedelta(days=7)
+GEOCODE_NOT_FOUND = 'NotFound'
+# на сколько воркер забирает адрес из очереди на время запроса к геокодеру
+GEOCODE_LEASE_DURATION = timedelta(minutes=5)
+
+
+class LocationQuerySet(models.QuerySet):
+    def pending(self):
+        """Адреса без координат, которые ждут геокодера: ещё ни разу у него
+        не были или пора повторить попытку. В памяти то же условие проверяет
+        locations.cache.is_pending"""
+        return self.filter(
+            Q(last_geocode_attempt__isnull=True) |
+            Q(next_geocode_attempt__lte=timezone.now()),
+            latitude__isnull=True,
+        )
+
+    def claimable(self):
+        """Ждущие адреса, которые сейчас не забрал другой воркер"""
+        return self.pending().exclude(next_geocode_attempt__gt=timezone.now())
+
 
 class Location(models.Model):
     address = models.CharField(
@@ -8,6 +39,13 @@ class Location(models.Model):
         max_length=200,
         unique=True
     )
+    address_key = models.CharField(
+        'ключ адреса',
+        max_length=200,
+        unique=True,
+        editable=False,
+        help_text='адрес без регистра, знаков препинания и с единообразными сокращениями',
+    )
     latitude = models.FloatField(
         'Широта',
         null=True,
@@ -31,6 +69,23 @@ class Location(models.Model):
         null=True,
         blank=True
     )
+    geocode_attempts = models.PositiveIntegerField(
+        'неудачных попыток подряд',
+        default=0
+    )
+    last_geocode_error = models.CharField(
+        'последняя ошибка геокодирования',
+        max_length=100,
+        blank=True
+    )
+    next_geocode_attempt = models.DateTimeField(
+        'следующая попытка геокодирования',
+        null=True,
+        blank=True,
+        db_index=True
+    )
+
+    objects = LocationQuerySet.as_manager()
 
     class Meta:
         verbose_name = 'местоположение'
@@ -39,13 +94,36 @@ class Location(models.Model):
     def __str__(self):
         return f"{self.address} ({self.latitude}, {self.longitude})"
 
+    def save(self, *args, **kwargs):
+        self.address_key = make_address_key(self.address)
+        super().save(*args, **kwargs)
+
     def needs_geocoding(self):
-        if self.latitude is None or self.longitude is None:
-            return True
+        if self.next_geocode_attempt:
+            return self.next_geocode_attempt <= timezone.now()
+
+        return self.latitude is None or self.longitude is None
 
+    def mark_geocoded(self, coords):
+        """Запоминает результат геокодирования; координаты в порядке (долгота, широта)"""
+        now = timezone.now()
+        self.last_geocode_attempt = now
+        if not coords:
+            self.mark_geocode_failed(GEOCODE_NOT_FOUND)
+            return
 
-        if self.last_geocode_attempt and \
-            (timezone.now() - self.last_geocode_attempt).days >= 1:
-            return True
+        self.longitude, self.latitude = coords
+        self.geocode_attempts = 0
+        self.last_geocode_error = ''
+        self.next_geocode_attempt = now + GEOCODE_REFRESH_INTERVAL
 
-        return False
+    def mark_geocode_failed(self, error_class):
+        now = timezone.now()
+        self.last_geocode_attempt = now
+        self.geocode_attempts += 1
+        self.last_geocode_error = error_class[:100]
+        retry_delay = min(
+            GEOCODE_RETRY_BASE_DELAY * 2 ** min(self.geocode_attempts - 1, 16),
+            GEOCODE_RETRY_MAX_DELAY,
+        )
+        self.next_geocode_attempt = now + retry_delay
@@ -0,0 +1,52 @@
+"""Канонический ключ адреса.
+
+Разные написания одного адреса — «Москва, ул. Ленина 1» и «москва ул ленина, 1» —
+дают один ключ, поэтому попадают в одну строку Location и геокодируются один раз.
+"""
+import re
+
+
+# составные сокращения, которые разбились бы на токены по дефису
+COMPOUND_ABBREVIATIONS = {
+    'пр-т': 'проспект',
+    'пр-д': 'проезд',
+    'б-р': 'бульвар',
+}
+
+ABBREVIATIONS = {
+    'улица': 'ул',
+    'проспект': 'пр',
+    'просп': 'пр',
+    'переулок': 'пер',
+    'площадь': 'пл',
+    'бульвар': 'бул',
+    'бульв': 'бул',
+    'шоссе': 'ш',
+    'набережная': 'наб',
+    'проезд': 'прд',
+    'микрорайон': 'мкр',
+    'корпус': 'к',
+    'корп': 'к',
+    'строение': 'стр',
+    'квартира': 'кв',
+}
+
+# слова, которые не отличают один адрес от другого
+NOISE_WORDS = {'г', 'город', 'д', 'дом'}
+
+TOKEN_RE = re.compile(r'[^\W_]+(?:/[^\W_]+)?')
+COMPOUND_RE = re.compile(
+    r'(?<!\w)(' + '|'.join(re.escape(abbr) for abbr in COMPOUND_ABBREVIATIONS) + r')(?!\w)'
+)
+
+
+def make_address_key(address):
+    address = address.lower().replace('ё', 'е')
+    address = COMPOUND_RE.sub(lambda match: COMPOUND_ABBREVIATIONS[match.group(1)], address)
+
+    tokens = []
+    for token in TOKEN_RE.findall(address):
+        token = ABBREVIATIONS.get(token, token)
+        if token not in NOISE_WORDS:
+            tokens.append(token)
+    return ' '.join(tokens)[:200] or address.strip()[:200]
@@ -0,0 +1,22 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import Signal, receiver
+
+from .cache import invalidate_cached_locations
+from .models import Location
+
+
+# координаты записаны в обход Location.save() (bulk_update);
+# аргумент address_keys — ключи обновлённых адресов
+locations_geocoded = Signal()
+
+
+@receiver(post_save, sender=Location)
+@receiver(post_delete, sender=Location)
+def invalidate_cached_location(sender, instance, **kwargs):
+    transaction.on_commit(lambda: invalidate_cached_locations([instance.address_key]))
+
+
+@receiver(locations_geocoded)
+def invalidate_cached_geocoded_locations(sender, address_keys, **kwargs):
+    transaction.on_commit(lambda: invalidate_cached_locations(address_keys))
@@ -0,0 +1,109 @@
+"""KD-дерево для поиска ближайших точек на сфере.
+
+Точки переводятся в трёхмерные координаты на единичной сфере: длина хорды
+монотонно зависит от расстояния по дуге, поэтому порядок соседей тот же,
+что у haversine, и поиск корректен для любых городов, а не только в пределах
+одной проекции. Соседи выдаются по возрастанию расстояния лениво, так что
+поиск останавливается, как только набрано k подходящих точек.
+"""
+import heapq
+import math
+
+from .distances import EARTH_RADIUS_KM
+
+
+LEAF_SIZE = 8
+
+
+def to_unit_vector(point):
+    latitude, longitude = map(math.radians, point)
+    return (
+        math.cos(latitude) * math.cos(longitude),
+        math.cos(latitude) * math.sin(longitude),
+        math.sin(latitude),
+    )
+
+
+def chord_to_km(chord):
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, chord / 2))
+
+
+class KDNode:
+    __slots__ = ['lower', 'upper', 'axis', 'left', 'right', 'points']
+
+    def __init__(self, points):
+        self.lower = tuple(min(vector[axis] for vector, _ in points) for axis in range(3))
+        self.upper = tuple(max(vector[axis] for vector, _ in points) for axis in range(3))
+        self.left = self.right = None
+        self.points = None
+
+        if len(points) <= LEAF_SIZE:
+            self.points = points
+            return
+        # делим по самой длинной стороне ограничивающего параллелепипеда
+        self.axis = max(range(3), key=lambda axis: self.upper[axis] - self.lower[axis])
+        points = sorted(points, key=lambda point: point[0][self.axis])
+        middle = len(points) // 2
+        self.left = KDNode(points[:middle])
+        self.right = KDNode(points[middle:])
+
+    def squared_distance_to_box(self, vector):
+        total = 0.0
+        for axis in range(3):
+            if vector[axis] < self.lower[axis]:
+                total += (self.lower[axis] - vector[axis]) ** 2
+            elif vector[axis] > self.upper[axis]:
+                total += (vector[axis] - self.upper[axis]) ** 2
+        return total
+
+
+class SpatialIndex:
+    """Индекс точек {ключ: (широта, долгота)}; точки без координат пропускаются"""
+
+    def __init__(self, points):
+        self.points = {key: point for key, point in points.items() if point is not None}
+        vectors = [
+            (to_unit_vector(point), key)
+            for key, point in self.points.items()
+        ]
+        self.size = len(vectors)
+        self.root = KDNode(vectors) if vectors else None
+
+    def __len__(self):
+        return self.size
+
+    def iter_nearest(self, point):
+        """Отдаёт (ключ, расстояние в км) по возрастанию расстояния"""
+        if self.root is None:
+            return
+        vector = to_unit_vector(point)
+        # в куче вперемешку узлы и точки: узел с нижней оценкой расстояния
+        # раскрывается, только когда ближе него ничего не осталось
+        heap = [(self.root.squared_distance_to_box(vector), 0, self.root, None)]
+        counter = 1
+        while heap:
+            squared_distance, _, node, key = heapq.heappop(heap)
+            if node is None:
+                yield key, chord_to_km(math.sqrt(squared_distance))
+                continue
+            if node.points is not None:
+                for point_vector, point_key in node.points:
+                    point_distance = sum((point_vector[axis] - vector[axis]) ** 2 for axis in range(3))
+                    heapq.heappush(heap, (point_distance, counter, None, point_key))
+                    counter += 1
+                continue
+            for child in (node.left, node.right):
+                heapq.heappush(heap, (child.squared_distance_to_box(vector), counter, child, None))
+                counter += 1
+
+    def nearest(self, point, k=1, predicate=None):
+        """До k ближайших точек, для ключей которых predicate истинен"""
+        found = []
+        if k <= 0:
+            return found
+        for key, distance in self.iter_nearest(point):
+            if predicate is None or predicate(key):
+                found.append((key, distance))
+                if len(found) >= k:
+                    break
+        return found
@@ -0,0 +1,389 @@
+import io
+import json
+import random
+import threading
+import time
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest.mock import Mock, patch
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from foodcartapp.models import Restaurant
+
+from .cache import LRUCache, get_cached_locations, is_pending
+from .distances import distance_matrix
+from .geocoder import GeocoderError, TokenBucket
+from .models import GEOCODE_LEASE_DURATION, Location
+from .normalization import make_address_key
+from .spatial import SpatialIndex
+from .utils import concurrent_update_locations, enqueue_addresses, get_or_create_location, \
+    process_geocoding_queue, save_geocoded_locations
+
+
+class StubGeocoderHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        address = parse_qs(urlparse(self.path).query)['geocode'][0]
+        server = self.server
+        with server.lock:
+            server.requests.append(address)
+            attempt = server.requests.count(address)
+
+        if address in server.flaky and attempt == 1:
+            self.send_json(503, {'error': 'try later'})
+            return
+
+        feature_members = []
+        if address in server.malformed:
+            feature_members.append({'GeoObject': {'Point': {'pos': 'нет координат'}}})
+        elif address in server.places:
+            lon, lat = server.places[address]
+            feature_members.append({'GeoObject': {'Point': {'pos': f'{lon} {lat}'}}})
+        self.send_json(200, {'response': {'GeoObjectCollection': {'featureMember': feature_members}}})
+
+    def send_json(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class AddressKeyTest(TestCase):
+    def test_spellings_of_one_address_share_key(self):
+        spellings = [
+            'Москва, ул. Ленина 1',
+            'москва ул ленина, 1',
+            'г. Москва, улица Ленина, д. 1',
+            '  МОСКВА  УЛ.ЛЕНИНА,1 ',
+        ]
+        self.assertEqual({make_address_key(address) for address in spellings}, {'москва ул ленина 1'})
+
+    def test_house_numbers_are_kept(self):
+        self.assertNotEqual(
+            make_address_key('Москва, пр-т Мира, 10/2'),
+            make_address_key('Москва, проспект Мира, 10'),
+        )
+        self.assertEqual(
+            make_address_key('Москва, пр-т Мира, 10/2'),
+            make_address_key('москва проспект мира 10/2'),
+        )
+
+    def test_location_is_reused_for_another_spelling(self):
+        with patch('locations.utils.request_coordinates', return_value=(37.61, 55.76)) as fetch:
+            first = get_or_create_location('Москва, ул. Ленина 1')
+            second = get_or_create_location('москва улица ленина, д 1')
+
+        self.assertEqual(first.pk, second.pk)
+        fetch.assert_called_once()
+
+    def test_rekey_merges_addresses_that_now_share_key(self):
+        # ключи, посчитанные по старым правилам нормализации
+        geocoded, duplicate, renamed = Location.objects.bulk_create([
+            Location(address='Москва, Ленинский пр-т, 1', address_key='старый 1', latitude=55.7, longitude=37.6),
+            Location(address='москва ленинский проспект 1', address_key='старый 2'),
+            Location(address='Москва, Тверская, 1', address_key='старый 3'),
+        ])
+        restaurant = Restaurant.objects.create(name='Star Burger', address='Москва, Тверская, 2')
+        restaurant_location_id = restaurant.location_id
+        Restaurant.objects.filter(pk=restaurant.pk).update(location=duplicate)
+
+        call_command('rekey_locations', stdout=io.StringIO())
+
+        self.assertFalse(Location.objects.filter(pk=duplicate.pk).exists())
+        self.assertEqual(
+            dict(Location.objects.values_list('pk', 'address_key')),
+            {
+                geocoded.pk: make_address_key('Москва, Ленинский пр-т, 1'),
+                renamed.pk: make_address_key('Москва, Тверская, 1'),
+                restaurant_location_id: make_address_key('Москва, Тверская, 2'),
+            },
+        )
+        restaurant.refresh_from_db()
+        self.assertEqual(restaurant.location_id, geocoded.pk)
+
+
+class GeocodingBackoffTest(TestCase):
+    def test_failed_address_is_not_requested_until_retry_time(self):
+        with patch('locations.utils.request_coordinates', return_value=None) as request:
+            location = get_or_create_location('Нигде, 0')
+            get_or_create_location('Нигде, 0')
+        request.assert_called_once()
+
+        location.refresh_from_db()
+        self.assertEqual(location.geocode_attempts, 1)
+        self.assertEqual(location.last_geocode_error, 'NotFound')
+        self.assertFalse(Location.objects.pending().exists())
+
+        Location.objects.update(next_geocode_attempt=timezone.now() - timedelta(seconds=1))
+        error = GeocoderError('Ошибка 503', status_code=503)
+        with patch('locations.utils.request_coordinates', side_effect=error) as request:
+            with self.assertLogs('locations.utils', level='WARNING'):
+                self.assertEqual(process_geocoding_queue(), 1)
+        request.assert_called_once()
+
+        location.refresh_from_db()
+        self.assertEqual(location.geocode_attempts, 2)
+        self.assertEqual(location.last_geocode_error, 'HTTP503')
+        self.assertAlmostEqual(
+            location.next_geocode_attempt - location.last_geocode_attempt,
+            timedelta(minutes=20),
+            delta=timedelta(seconds=1),
+        )
+
+    def test_malformed_response_is_recorded_as_failure(self):
+        malformed_responses = [
+            {'response': {'GeoObjectCollection': {'featureMember': [{'GeoObject': {}}]}}},
+            {'response': {'GeoObjectCollection': {'featureMember': [{'GeoObject': {'Point': {'pos': '37.6'}}}]}}},
+            {'response': {'GeoObjectCollection': {'featureMember': [{'GeoObject': {'Point': {'pos': 'x y'}}}]}}},
+            [],
+        ]
+        enqueue_addresses([f'Москва, Тверская, {number}' for number in range(len(malformed_responses))])
+
+        responses = iter(malformed_responses)
+        with patch('locations.geocoder.requests.get') as get, self.assertLogs('locations.utils', level='WARNING'):
+            get.side_effect = lambda *args, **kwargs: Mock(status_code=200, json=Mock(return_value=next(responses)))
+            self.assertEqual(process_geocoding_queue(), len(malformed_responses))
+
+        self.assertFalse(Location.objects.pending().exists())
+        self.assertEqual(
+            set(Location.objects.values_list('geocode_attempts', 'last_geocode_error')),
+            {(1, 'KeyError'), (1, 'ValueError'), (1, 'TypeError')},
+        )
+
+    def test_success_resets_failures(self):
+        location = Location(address='Москва, Тверская, 1', geocode_attempts=5)
+        location.mark_geocoded((37.61, 55.76))
+
+        self.assertEqual(location.geocode_attempts, 0)
+        self.assertEqual(location.last_geocode_error, '')
+        self.assertFalse(location.needs_geocoding())
+
+
+class GeocodingQueueTest(TestCase):
+    def test_queued_addresses_are_geocoded_by_worker(self):
+        enqueue_addresses(['Москва, Тверская, 1 ', 'Москва, Тверская, 1', 'Нигде'])
+        self.assertEqual(Location.objects.pending().count(), 2)
+
+        found = {'Москва, Тверская, 1': (37.61, 55.76)}
+        with patch('locations.utils.request_coordinates', side_effect=lambda apikey, address: found.get(address)):
+            self.assertEqual(process_geocoding_queue(), 2)
+
+        self.assertFalse(Location.objects.pending().exists())
+        location = Location.objects.get(address='Москва, Тверская, 1')
+        self.assertEqual((location.latitude, location.longitude), (55.76, 37.61))
+        self.assertIsNone(Location.objects.get(address='Нигде').latitude)
+
+    def test_addresses_are_leased_while_geocoder_is_called(self):
+        enqueue_addresses(['Москва, Тверская, 1'])
+        pending_during_request = []
+
+        def request(apikey, address):
+            pending_during_request.append(Location.objects.claimable().exists())
+            raise RuntimeError('воркер упал')
+
+        with patch('locations.utils.request_coordinates', side_effect=request), self.assertRaises(RuntimeError):
+            process_geocoding_queue()
+
+        # забранный адрес другим воркерам не виден, а после аренды возвращается в очередь
+        # а для страницы заказов и автоназначения адрес всё это время ждёт геокодера
+        self.assertEqual(pending_during_request, [False])
+        self.assertFalse(Location.objects.claimable().exists())
+        self.assertTrue(Location.objects.pending().exists())
+        with patch('django.utils.timezone.now', return_value=timezone.now() + GEOCODE_LEASE_DURATION):
+            self.assertTrue(Location.objects.claimable().exists())
+
+
+class ConcurrentGeocodingTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), StubGeocoderHandler)
+        cls.server.lock = threading.Lock()
+        cls.server_thread = threading.Thread(target=cls.server.serve_forever, daemon=True)
+        cls.server_thread.start()
+        cls.geocoder_url = f'http://127.0.0.1:{cls.server.server_port}/1.x'
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        self.server.requests = []
+        self.server.places = {
+            f'Москва, Тверская, {number}': (37.6 + number / 1000, 55.7)
+            for number in range(30)
+        }
+        self.server.flaky = {'Москва, Тверская, 7'}
+        self.server.malformed = set()
+
+    def test_addresses_are_geocoded_with_retries(self):
+        addresses = list(self.server.places) + ['Нигде']
+        progress = []
+
+        with override_settings(YANDEX_GEOCODER_URL=self.geocoder_url):
+            updated = concurrent_update_locations(
+                addresses,
+                workers=4,
+                rate=1000,
+                backoff=0.01,
+                save_batch_size=7,
+                progress=lambda done, total: progress.append((done, total)),
+            )
+
+        self.assertEqual(len(updated), 31)
+        self.assertEqual(progress[-1], (31, 31))
+        self.assertEqual(self.server.requests.count('Москва, Тверская, 7'), 2)
+        self.assertEqual(Location.objects.filter(latitude__isnull=False).count(), 30)
+        self.assertEqual(Location.objects.get(address='Москва, Тверская, 7').longitude, 37.607)
+        self.assertIsNone(Location.objects.get(address='Нигде').latitude)
+        self.assertFalse(Location.objects.filter(last_geocode_attempt__isnull=True).exists())
+
+    def test_malformed_response_does_not_abort_backfill(self):
+        self.server.malformed = {'Москва, Тверская, 3'}
+
+        with override_settings(YANDEX_GEOCODER_URL=self.geocoder_url):
+            with self.assertLogs('locations.utils', level='WARNING') as logs:
+                updated = concurrent_update_locations(list(self.server.places), workers=4, rate=1000, backoff=0.01)
+
+        self.assertEqual(len(updated), 30)
+        self.assertEqual(self.server.requests.count('Москва, Тверская, 3'), 1)
+        self.assertEqual(Location.objects.get(address='Москва, Тверская, 3').last_geocode_error, 'ValueError')
+        self.assertIn('Москва, Тверская, 3', logs.output[0])
+        self.assertEqual(Location.objects.filter(latitude__isnull=False).count(), 29)
+
+    def test_geocoded_addresses_are_not_requested_again(self):
+        with override_settings(YANDEX_GEOCODER_URL=self.geocoder_url):
+            concurrent_update_locations(list(self.server.places), workers=4, rate=1000, backoff=0.01)
+            self.server.requests = []
+            updated = concurrent_update_locations(list(self.server.places), workers=4, rate=1000)
+
+        self.assertEqual(updated, [])
+        self.assertEqual(self.server.requests, [])
+
+
+class TokenBucketTest(TestCase):
+    def test_rate_is_limited(self):
+        limiter = TokenBucket(rate=50, capacity=1)
+
+        started_at = time.monotonic()
+        for _ in range(6):
+            limiter.acquire()
+
+        self.assertGreaterEqual(time.monotonic() - started_at, 0.09)
+
+
+class DistanceMatrixTest(TestCase):
+    def test_haversine_matches_geodesic_and_skips_missing_points(self):
+        orders = [(55.75, 37.62), None, (55.80, 37.50)]
+        restaurants = [(55.70, 37.70), (55.76, 37.60), None]
+
+        haversine = distance_matrix(orders, restaurants)
+        geodesic = distance_matrix(orders, restaurants, method='geodesic')
+
+        self.assertEqual(haversine.shape, (3, 3))
+        self.assertTrue(np.isnan(haversine[1]).all())
+        self.assertTrue(np.isnan(haversine[:, 2]).all())
+        known = ~np.isnan(geodesic)
+        np.testing.assert_allclose(haversine[known], geodesic[known], rtol=0.005)
+
+
+class SpatialIndexTest(TestCase):
+    def setUp(self):
+        rng = random.Random(1)
+        # две группы точек в разных городах и одна без координат
+        self.points = {
+            number: (
+                (55.75 if number % 2 else 59.93) + rng.uniform(-0.3, 0.3),
+                (37.62 if number % 2 else 30.31) + rng.uniform(-0.5, 0.5),
+            )
+            for number in range(300)
+        }
+        self.points[300] = None
+        self.index = SpatialIndex(self.points)
+
+    def brute_force(self, point, predicate=lambda key: True):
+        known_keys = [key for key, known_point in self.points.items() if known_point and predicate(key)]
+        distances = distance_matrix([point], [self.points[key] for key in known_keys])[0]
+        return sorted(zip(known_keys, distances), key=lambda found: found[1])
+
+    def test_nearest_matches_brute_force(self):
+        for point in [(55.75, 37.62), (59.9, 30.3), (57.0, 34.0)]:
+            with self.subTest(point=point):
+                expected = self.brute_force(point)[:5]
+                found = self.index.nearest(point, k=5)
+
+                self.assertEqual([key for key, _ in found], [key for key, _ in expected])
+                np.testing.assert_allclose([distance for _, distance in found],
+                                           [distance for _, distance in expected])
+
+    def test_predicate_and_missing_points(self):
+        capable = {3, 4, 250, 300}
+
+        found = self.index.nearest((59.93, 30.31), k=10, predicate=capable.__contains__)
+
+        self.assertEqual([key for key, _ in found], [key for key, _ in self.brute_force((59.93, 30.31), capable.__contains__)])
+        self.assertEqual(len(self.index), 300)
+        self.assertEqual(SpatialIndex({}).nearest((55.75, 37.62), k=3), [])
+
+
+class LocationCacheTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.location = Location.objects.create(address='Москва, Тверская, 1', latitude=55.757, longitude=37.613)
+        Location.objects.create(address='Москва, Арбат, 2')
+
+    def setUp(self):
+        cache.clear()
+
+    def test_repeated_lookup_does_not_query_database(self):
+        addresses = ['Москва, Тверская, 1', 'москва тверская 1', 'Москва, Арбат, 2', 'Нигде, 0']
+        with self.assertNumQueries(1):
+            locations = get_cached_locations(addresses)
+        # адреса без записи не кэшируются: их вот-вот поставят в очередь
+        with self.assertNumQueries(0):
+            self.assertEqual(get_cached_locations(addresses[:3]), {
+                address: locations[address] for address in addresses[:3]
+            })
+
+        self.assertEqual(locations['москва тверская 1'][:2], (55.757, 37.613))
+        self.assertTrue(is_pending(locations['Москва, Арбат, 2']))
+        self.assertIsNone(locations['Нигде, 0'])
+
+    def test_saved_location_is_reloaded(self):
+        get_cached_locations(['Москва, Тверская, 1', 'Москва, Арбат, 2'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.location.latitude = 55.76
+            self.location.save()
+        location = Location.objects.get(address='Москва, Арбат, 2')
+        location.mark_geocoded((37.597, 55.751))
+        with self.captureOnCommitCallbacks(execute=True):
+            save_geocoded_locations([location])
+
+        locations = get_cached_locations(['Москва, Тверская, 1', 'Москва, Арбат, 2'])
+        self.assertEqual(locations['Москва, Тверская, 1'].latitude, 55.76)
+        self.assertFalse(is_pending(locations['Москва, Арбат, 2']))
+
+    def test_lru_evicts_least_recently_read(self):
+        lru = LRUCache(maxsize=2)
+        lru.get_many([], version=1)
+        lru.set_many({'a': 1, 'b': 2}, version=1)
+        lru.get_many(['a'], version=1)
+        lru.set_many({'c': 3}, version=1)
+
+        self.assertEqual(lru.get_many(['a', 'b', 'c'], version=1), {'a': 1, 'c': 3})
+        self.assertEqual(lru.get_many(['a'], version=2), {})
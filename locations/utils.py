@@ -1,9 +1,38 @@
-from .models import Location
-from .geocoder import fetch_coordinates
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from django.db import transaction
+from .cache import invalidate_cached_locations
+from .models import GEOCODE_LEASE_DURATION, Location
+from .normalization import make_address_key
+from .signals import locations_geocoded
+from .geocoder import GeocoderError, TokenBucket, create_session, request_coordinates
 from django.conf import settings
 from django.utils import timezone
 
 
+logger = logging.getLogger(__name__)
+
+
+def fetch_coordinates(location):
+    """Запрашивает координаты у геокодера и отмечает попытку, не сохраняя её"""
+    try:
+        coords = request_coordinates(settings.YANDEX_GEOCODER_APIKEY, location.address)
+        location.mark_geocoded(coords)
+    except GeocoderError as e:
+        logger.warning('Ошибка геокодирования для адреса %s: %s', location.address, e)
+        location.mark_geocode_failed(e.error_class)
+    return location
+
+
+def geocode_location(location):
+    """Запрашивает координаты у геокодера и сохраняет попытку"""
+    fetch_coordinates(location)
+    location.save()
+    return location
+
+
 def get_or_create_location(address):
     """Получает или создает Location для адреса"""
     if not address:
@@ -12,19 +41,12 @@ def get_or_create_location(address):
     normalized_address = address.strip()
 
     location, created = Location.objects.get_or_create(
-        address=normalized_address,
-        defaults={}
+        address_key=make_address_key(normalized_address),
+        defaults={'address': normalized_address}
     )
 
     if created or location.needs_geocoding():
-        try:
-            coords = fetch_coordinates(settings.YANDEX_GEOCODER_APIKEY, normalized_address)
-            if coords:
-                location.longitude, location.latitude = coords
-            location.last_geocode_attempt = timezone.now()
-            location.save()
-        except Exception as e:
-            print(f"Ошибка геокодирования для адреса {normalized_address}: {e}")
+        geocode_location(location)
 
     return location
 
@@ -38,3 +60,257 @@ def batch_update_locations(addresses):
             if location:
                 locations.append(location)
     return locations
+
+
+def request_coordinates_with_retry(address, session, limiter, retries=3, backoff=0.5):
+    """Запрос к геокодеру с ограничением частоты и экспоненциальной паузой между попытками"""
+    for attempt in range(retries + 1):
+        limiter.acquire()
+        try:
+            return request_coordinates(settings.YANDEX_GEOCODER_APIKEY, address, session=session)
+        except GeocoderError as e:
+            if not e.retryable or attempt == retries:
+                raise
+            time.sleep(backoff * 2 ** attempt)
+
+
+def concurrent_update_locations(addresses, workers=8, rate=10, retries=3, backoff=0.5,
+                                 save_batch_size=100, progress=None):
+    """Геокодирует адреса в пуле потоков с общей keep-alive сессией.
+
+    Потоки только ходят в геокодер, в базу пишет вызывающий поток пачками
+    через bulk_update. progress(done, total) вызывается после каждого адреса.
+    """
+    enqueue_addresses(addresses)
+    locations = [
+        location
+        for location in set(get_locations_by_address(addresses).values())
+        if location and location.needs_geocoding()
+    ]
+
+    limiter = TokenBucket(rate)
+    session = create_session(pool_size=workers)
+    updated_locations = []
+    unsaved_locations = []
+    with session, ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(
+                request_coordinates_with_retry,
+                location.address, session, limiter, retries, backoff,
+            ): location
+            for location in locations
+        }
+        for done, future in enumerate(as_completed(futures), start=1):
+            location = futures[future]
+            try:
+                location.mark_geocoded(future.result())
+            except GeocoderError as e:
+                logger.warning('Ошибка геокодирования для адреса %s: %s', location.address, e)
+                location.mark_geocode_failed(e.error_class)
+            updated_locations.append(location)
+            unsaved_locations.append(location)
+
+            if len(unsaved_locations) >= save_batch_size:
+                save_geocoded_locations(unsaved_locations)
+                unsaved_locations = []
+            if progress:
+                progress(done, len(locations))
+
+    save_geocoded_locations(unsaved_locations)
+    return updated_locations
+
+
+def save_geocoded_locations(locations):
+    for location in locations:
+        location.updated_at = timezone.now()
+    Location.objects.bulk_update(
+        locations,
+        [
+            'latitude',
+            'longitude',
+            'last_geocode_attempt',
+            'geocode_attempts',
+            'last_geocode_error',
+            'next_geocode_attempt',
+            'updated_at',
+        ],
+    )
+    if locations:
+        locations_geocoded.send(sender=Location, address_keys=[location.address_key for location in locations])
+
+
+def enqueue_addresses(addresses):
+    """Ставит новые адреса в очередь на геокодирование, не обращаясь к геокодеру"""
+    normalized_addresses = {address.strip() for address in addresses if address and address.strip()}
+    if not normalized_addresses:
+        return
+    Location.objects.bulk_create(
+        [
+            Location(address=address, address_key=make_address_key(address))
+            for address in normalized_addresses
+        ],
+        ignore_conflicts=True,
+    )
+
+
+def get_or_enqueue_location_ids(addresses):
+    """Как enqueue_addresses, но ещё возвращает {адрес: id Location} одним запросом"""
+    addresses = {address for address in addresses if address and address.strip()}
+    enqueue_addresses(addresses)
+    keys_by_address = {address: make_address_key(address) for address in addresses}
+    ids_by_key = dict(
+        Location.objects
+        .filter(address_key__in=set(keys_by_address.values()))
+        .values_list('address_key', 'id')
+    )
+    return {
+        address: ids_by_key.get(address_key)
+        for address, address_key in keys_by_address.items()
+    }
+
+
+def link_locations(objects, batch_size=1000):
+    """Проставляет location записям с адресом, у которых её ещё нет.
+
+    objects — выборка модели с полями address и location; записи идут
+    пачками по возрастанию pk, на пачку — четыре запроса. Возвращает число
+    связанных записей.
+    """
+    linked = 0
+    last_pk = 0
+    while True:
+        batch = list(
+            objects.filter(location__isnull=True, pk__gt=last_pk)
+            .order_by('pk')
+            .only('pk', 'address')[:batch_size]
+        )
+        if not batch:
+            return linked
+        last_pk = batch[-1].pk
+
+        location_ids = get_or_enqueue_location_ids({obj.address for obj in batch})
+        for obj in batch:
+            obj.location_id = location_ids.get(obj.address)
+        objects.bulk_update(batch, ['location'])
+        linked += sum(obj.location_id is not None for obj in batch)
+
+
+def get_locations_by_address(addresses, locations=None):
+    """Сопоставляет адреса с Location по каноническому ключу одним запросом
+
+    Разные написания одного адреса получают одну и ту же запись,
+    для адресов без записи возвращается None.
+    """
+    if locations is None:
+        locations = Location.objects.all()
+    keys_by_address = {
+        address: make_address_key(address)
+        for address in addresses
+        if address and address.strip()
+    }
+    locations_by_key = {
+        location.address_key: location
+        for location in locations.filter(address_key__in=set(keys_by_address.values()))
+    }
+    return {
+        address: locations_by_key.get(address_key)
+        for address, address_key in keys_by_address.items()
+    }
+
+
+def choose_primary_location(locations):
+    """Из записей одного адреса оставляем геокодированную и самую свежую"""
+    return max(
+        locations,
+        key=lambda location: (
+            location.latitude is not None and location.longitude is not None,
+            location.updated_at,
+        ),
+    )
+
+
+def rekey_locations():
+    """Пересчитывает address_key после изменения правил нормализации.
+
+    Записи, которые теперь дают один ключ, сливаются: ссылки на дубликаты
+    переводятся на оставшуюся запись, дубликаты удаляются. Возвращает
+    (число записей с новым ключом, число удалённых дубликатов).
+    """
+    locations_by_key = {}
+    for location in Location.objects.order_by('id'):
+        locations_by_key.setdefault(make_address_key(location.address), []).append(location)
+
+    stale_keys = set()
+    duplicate_ids = []
+    changed = []
+    with transaction.atomic():
+        for address_key, locations in locations_by_key.items():
+            primary = choose_primary_location(locations)
+            duplicates = [location for location in locations if location is not primary]
+            if duplicates:
+                for relation in Location._meta.related_objects:
+                    relation.related_model._base_manager.filter(
+                        **{f'{relation.field.name}__in': duplicates}
+                    ).update(**{relation.field.name: primary})
+                duplicate_ids.extend(location.id for location in duplicates)
+                stale_keys.update(location.address_key for location in duplicates)
+            if primary.address_key != address_key:
+                stale_keys.add(primary.address_key)
+                changed.append((primary, address_key))
+        Location.objects.filter(id__in=duplicate_ids).delete()
+
+        # сначала временные ключи: иначе новый ключ одной записи может
+        # совпасть с ещё не пересчитанным старым ключом другой
+        for location, _ in changed:
+            location.address_key = f'~{location.id}'
+        Location.objects.bulk_update([location for location, _ in changed], ['address_key'])
+        for location, address_key in changed:
+            location.address_key = address_key
+        Location.objects.bulk_update([location for location, _ in changed], ['address_key'])
+
+    invalidate_cached_locations(stale_keys | {address_key for _, address_key in changed})
+    return len(changed), len(duplicate_ids)
+
+
+def claim_pending_locations(batch_size):
+    """Забирает пачку адресов из очереди в короткой транзакции.
+
+    Забранным адресам следующая попытка переносится на срок аренды: другие
+    воркеры их не берут, а если этот воркер упадёт, адреса вернутся в очередь.
+    """
+    with transaction.atomic():
+        locations = list(
+            Location.objects.claimable()
+            .select_for_update(skip_locked=True)
+            .order_by('created_at')[:batch_size]
+        )
+        Location.objects.filter(pk__in=[location.pk for location in locations]).update(
+            next_geocode_attempt=timezone.now() + GEOCODE_LEASE_DURATION,
+        )
+    return locations
+
+
+def process_geocoding_queue(batch_size=20):
+    """Геокодирует очередную пачку адресов из очереди, возвращает их количество.
+
+    Геокодер вызывается вне транзакции: строки не держат блокировок,
+    пока идут HTTP-запросы.
+    """
+    locations = claim_pending_locations(batch_size)
+    for location in locations:
+        fetch_coordinates(location)
+    save_geocoded_locations(locations)
+    return len(locations)
+
+
+def run_geocoding_worker(batch_size=20, idle_sleep=5, once=False):
+    """Обрабатывает очередь, пока она не опустеет; без once ждёт новых адресов"""
+    processed_total = 0
+    while True:
+        processed = process_geocoding_queue(batch_size)
+        processed_total += processed
+        if processed:
+            continue
+        if once:
+            return processed_total
+        time.sleep(idle_sleep)
@@ -1,3 +1,307 @@
+import csv
+import gzip
+import io
+import json
+import threading
+from datetime import timedelta
+from unittest.mock import patch
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
 from django.test import TestCase
+from django.utils import timezone
+
+from foodcartapp.availability import refresh_products_availability
+from foodcartapp.export import export_orders
+from foodcartapp.models import Order, OrderChange, OrderItem, Product, ProductCategory, Restaurant, RestaurantMenuItem
+from locations.models import Location
+from . import views
+
+
+class OrdersPageTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.manager = User.objects.create_user('manager', is_staff=True)
+        created_at = timezone.now()
+        cls.orders = []
+        for number in range(7):
+            order = Order.objects.create(
+                firstname='Иван',
+                lastname='Петров',
+                phonenumber='+79291000000',
+                address=f'Москва, Тверская, {number}',
+                payment_method='cash' if number % 2 else 'electronic',
+                status='completed' if number == 6 else 'new',
+            )
+            cls.orders.append(order)
+        # у части заказов одинаковое время создания: порядок решает id
+        Order.objects.filter(pk__in=[order.pk for order in cls.orders[:4]]).update(created_at=created_at)
+        for shift, order in enumerate(cls.orders[4:], start=1):
+            Order.objects.filter(pk=order.pk).update(created_at=created_at - timedelta(days=shift))
+
+    def setUp(self):
+        self.client.force_login(self.manager)
+
+    def fetch_all_pages(self, query=''):
+        order_ids = []
+        url = f'/manager/orders/?{query}'
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            order_ids.extend(order['id'] for order in response.context['orders'])
+            next_page_url = response.context['next_page_url']
+            url = next_page_url and f'/manager/orders/{next_page_url}'
+        return order_ids
+
+    def test_keyset_pages_cover_open_orders_once(self):
+        with self.modify_page_size(2):
+            order_ids = self.fetch_all_pages()
+
+        expected = [order.pk for order in reversed(self.orders[:4])] + \
+            [order.pk for order in self.orders[4:6]]
+        self.assertEqual(order_ids, expected)
+
+    def test_filters(self):
+        with self.modify_page_size(2):
+            electronic_ids = self.fetch_all_pages('payment_method=electronic')
+            completed_ids = self.fetch_all_pages('status=completed')
+
+        self.assertEqual(electronic_ids, [self.orders[2].pk, self.orders[0].pk, self.orders[4].pk])
+        self.assertEqual(completed_ids, [self.orders[6].pk])
+
+    def test_broken_cursor_is_reported(self):
+        response = self.client.get('/manager/orders/?after=garbage')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['orders'], [])
+        self.assertIn('after', response.context['filter_form'].errors)
+
+    def modify_page_size(self, page_size):
+        return patch.object(views, 'ORDERS_PAGE_SIZE', page_size)
+
+
+class OrderChangesFeedTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.manager = User.objects.create_user('manager', is_staff=True)
+
+    def setUp(self):
+        self.client.force_login(self.manager)
+
+    def create_order(self, number):
+        return Order.objects.create(
+            firstname='Иван', lastname='Петров', phonenumber=f'+7929100000{number}',
+            address=f'Москва, Тверская, {number}', payment_method='cash',
+        )
+
+    def read_feed(self, cursor):
+        with patch.object(views, 'FEED_STREAM_DURATION', 0):
+            response = self.client.get('/manager/orders/feed/', {'after': cursor})
+            self.assertEqual(response['Content-Type'], 'text/event-stream')
+            return b''.join(response.streaming_content).decode()
+
+    @patch.object(views, 'FEED_GAP_GRACE', 0)
+    def test_feed_streams_only_changes_after_cursor(self):
+        old_order = Order.objects.create(
+            firstname='Иван', lastname='Петров', phonenumber='+79291000000',
+            address='Москва, Тверская, 1', payment_method='cash',
+        )
+        cursor = self.client.get('/manager/orders/').context['feed_cursor']
+
+        new_order = Order.objects.create(
+            firstname='Анна', lastname='Сидорова', phonenumber='+79291000001',
+            address='Москва, Тверская, 2', payment_method='cash',
+        )
+        old_order.status = 'completed'
+        old_order.save()
+
+        stream = self.read_feed(cursor)
+
+        self.assertIn(f'data-order-id=\\"{new_order.id}\\"', stream)
+        self.assertIn(f'"id": {old_order.id}, "removed": true', stream)
+        self.assertTrue(stream.rstrip().endswith(f'data: {cursor + 2}'))
+        self.assertNotIn('event: order', self.read_feed(cursor + 2))
+
+    def test_change_committed_after_a_later_one_is_not_skipped(self):
+        first_order, second_order = self.create_order(1), self.create_order(2)
+        first_change, second_change = OrderChange.objects.order_by('id')
+        # первая транзакция ещё не закоммичена: в журнале видно только вторую
+        first_change.delete()
+
+        stream = views.stream_order_changes(0, '/manager/orders/')
+        next(stream)
+        self.assertIn(f'"id": {second_order.id}', next(stream))
+
+        OrderChange.objects.create(id=first_change.id, order=first_order)
+        batch = next(stream)
+        self.assertIn(f'"id": {first_order.id}', batch)
+        self.assertNotIn(f'"id": {second_order.id}', batch)
+        # изменения моложе FEED_GAP_GRACE курсор не сдвигают
+        self.assertTrue(batch.rstrip().endswith('data: 0'))
+        stream.close()
+
+    def test_feed_is_refused_when_all_streams_are_busy(self):
+        with patch.object(views, '_feed_slots', threading.BoundedSemaphore(1)) as slots:
+            slots.acquire()
+            response = self.client.get('/manager/orders/feed/', {'after': 0})
+
+        self.assertEqual(response.status_code, 204)
+
+    def test_old_changes_are_pruned(self):
+        self.create_order(1)
+        OrderChange.objects.update(created_at=timezone.now() - timedelta(days=8))
+        self.create_order(2)
+
+        call_command('prune_order_changes', stdout=io.StringIO())
+
+        self.assertEqual(OrderChange.objects.count(), 1)
+
+
+class OrdersExportTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.manager = User.objects.create_user('manager', is_staff=True)
+        category = ProductCategory.objects.create(name='Бургеры')
+        cls.product = Product.objects.create(name='Чизбургер', category=category, price=100, image='cheese.jpg')
+        Location.objects.create(address='Москва, Тверская, 1', latitude=55.76, longitude=37.6)
+        cls.orders = []
+        for number, status in enumerate(['new', 'completed', 'completed']):
+            order = Order.objects.create(
+                firstname='Иван',
+                lastname='Петров',
+                phonenumber='+79291000000',
+                address=f'Москва, Тверская, {number + 1}',
+                payment_method='cash',
+                status=status,
+            )
+            OrderItem.objects.create(order=order, product=cls.product, quantity=number + 1, price=100)
+            cls.orders.append(order)
+        Order.objects.filter(pk=cls.orders[2].pk).update(created_at=timezone.now() - timedelta(days=10))
+
+    def setUp(self):
+        self.client.force_login(self.manager)
+
+    def export(self, query):
+        response = self.client.get(f'/manager/orders/export/?{query}')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content)
+
+    def test_csv(self):
+        rows = list(csv.DictReader(io.StringIO(self.export('format=csv&status=completed').decode())))
+
+        self.assertEqual([int(row['id']) for row in rows], [order.pk for order in self.orders[1:]])
+        self.assertEqual(rows[0]['latitude'], '')
+        self.assertEqual(rows[0]['total_cost'], '200.00')
+        self.assertEqual(rows[0]['items'], 'Чизбургер x2 по 100.00')
+
+    def test_default_export_includes_closed_orders(self):
+        rows = list(csv.DictReader(io.StringIO(self.export('format=csv').decode())))
+
+        self.assertEqual([int(row['id']) for row in rows], [order.pk for order in self.orders])
+
+    def test_several_statuses(self):
+        rows = list(csv.DictReader(io.StringIO(self.export('status=new&status=completed&status=canceled').decode())))
+
+        self.assertEqual(len(rows), 3)
+
+    def test_coordinates_come_from_linked_location(self):
+        Order.objects.filter(pk=self.orders[0].pk).update(address='Москва, Арбат, 5')
+
+        rows = list(csv.DictReader(io.StringIO(self.export('format=csv&status=new').decode())))
+
+        self.assertEqual(rows[0]['latitude'], '55.76')
+
+    def test_csv_cells_are_not_formulas(self):
+        Order.objects.filter(pk=self.orders[0].pk).update(firstname='=HYPERLINK("http://evil")', lastname='@SUM(A1)')
+
+        rows = list(csv.DictReader(io.StringIO(self.export('format=csv&status=new').decode())))
+
+        self.assertEqual(rows[0]['firstname'], '\'=HYPERLINK("http://evil")')
+        self.assertEqual(rows[0]['lastname'], "'@SUM(A1)")
+        self.assertEqual(rows[0]['phonenumber'], '+79291000000')
+
+    def test_jsonl_with_filters_and_gzip(self):
+        since = (timezone.localdate() - timedelta(days=1)).isoformat()
+        content = gzip.decompress(self.export(f'format=jsonl&status=completed&created_from={since}&gzip=on'))
+
+        records = [json.loads(line) for line in content.decode().splitlines()]
+        self.assertEqual([record['id'] for record in records], [self.orders[1].pk])
+        self.assertEqual(records[0]['items'], [
+            {'product_id': self.product.pk, 'product': 'Чизбургер', 'quantity': 2, 'price': '100.00'},
+        ])
+
+    def test_export_reads_orders_in_chunks(self):
+        chunks = export_orders(Order.objects.all(), 'jsonl', chunk_size=2)
+
+        # заказы с координатами и позиции на каждый чанк из двух заказов
+        with self.assertNumQueries(3):
+            self.assertEqual(len(b''.join(chunks).splitlines()), 3)
+
+    def test_invalid_filter(self):
+        response = self.client.get('/manager/orders/export/?created_from=вчера')
+
+        self.assertEqual(response.status_code, 400)
+
+
+class ProductsPageTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.manager = User.objects.create_user('manager', is_staff=True)
+        cls.restaurants = [
+            Restaurant.objects.create(name=f'Star Burger {number}') for number in range(3)
+        ]
+        cls.products = [
+            Product.objects.create(name=f'Бургер {number}', price=100, image='burger.jpg') for number in range(3)
+        ]
+        # в каждом ресторане нет в продаже товара с тем же номером
+        RestaurantMenuItem.objects.bulk_create(
+            RestaurantMenuItem(restaurant=restaurant, product=product, availability=number != product_number)
+            for number, restaurant in enumerate(cls.restaurants)
+            for product_number, product in enumerate(cls.products)
+        )
+        refresh_products_availability()
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.manager)
+
+    def get_matrix(self, query=''):
+        response = self.client.get(f'/manager/products/?{query}')
+        self.assertEqual(response.status_code, 200)
+        return response.context['restaurants'], [
+            (product['name'], availability)
+            for product, availability in response.context['products_with_restaurant_availability']
+        ]
+
+    def test_matrix(self):
+        restaurants, rows = self.get_matrix()
+
+        self.assertEqual(restaurants, ['Star Burger 0', 'Star Burger 1', 'Star Burger 2'])
+        self.assertEqual(rows, [
+            ('Бургер 0', [False, True, True]),
+            ('Бургер 1', [True, False, True]),
+            ('Бургер 2', [True, True, False]),
+        ])
+
+    def test_matrix_is_cached_until_menu_changes(self):
+        self.get_matrix()
+        # сессия и пользователь; сама таблица берётся из кэша
+        with self.assertNumQueries(2):
+            self.get_matrix()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            menu_item = RestaurantMenuItem.objects.get(restaurant=self.restaurants[0], product=self.products[0])
+            menu_item.availability = True
+            menu_item.save()
+
+        _, rows = self.get_matrix()
+        self.assertEqual(rows[0], ('Бургер 0', [True, True, True]))
+
+    def test_windowing(self):
+        with patch.object(views, 'PRODUCTS_PAGE_SIZE', 2), patch.object(views, 'RESTAURANTS_PAGE_SIZE', 2):
+            restaurants, rows = self.get_matrix('page=2&restaurants_page=2')
 
-# Create your tests here.
+        self.assertEqual(restaurants, ['Star Burger 2'])
+        self.assertEqual(rows, [('Бургер 2', [False])])
@@ -14,6 +14,8 @@ urlpatterns = [
 
     # TODO заглушка для нереализованного функционала
     path('orders/', views.view_orders, name="view_orders"),
+    path('orders/feed/', views.order_changes_feed, name="order_changes_feed"),
+    path('orders/export/', views.export_orders_view, name="export_orders"),
 
     path('login/', views.LoginView.as_view(), name="login"),
     path('logout/', views.LogoutView.as_view(), name="logout"),
@@ -1,19 +1,50 @@
+import json
+import threading
+import time
+from datetime import datetime, timedelta
+
 from django import forms
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseBadRequest, QueryDict, StreamingHttpResponse
 from django.shortcuts import redirect, render
+from django.template.loader import render_to_string
 from django.views import View
-from django.urls import reverse_lazy
+from django.urls import reverse, reverse_lazy
 from django.contrib.auth.decorators import user_passes_test
+from django.core.paginator import Paginator
 
-from django.db.models import Prefetch
+from django.db.models import Max, Prefetch, Q
+from django.utils import timezone
 from django.contrib.auth import authenticate, login
 from django.contrib.auth import views as auth_views
-from foodcartapp.models import Order, OrderItem, Product, Restaurant, \
-    RestaurantMenuItem
-from locations.utils import get_or_create_location, batch_update_locations
-from collections import defaultdict
-from geopy.distance import distance
-from locations.models import Location
-from locations.utils import get_or_create_location
+from foodcartapp.availability import get_availability_masks, get_availability_matrix, get_capable_restaurant_ids
+from foodcartapp.export import EXPORT_FORMATS, export_orders, filter_orders_for_export
+from foodcartapp.models import Order, OrderChange, OrderItem, Restaurant
+from foodcartapp.restaurant_index import get_restaurant_index, list_candidate_restaurants
+from locations.cache import get_cached_locations, get_coordinates, is_pending
+from locations.utils import enqueue_addresses
+from star_burger.metrics import query_budget
+
+
+ORDERS_PAGE_SIZE = 50
+PRODUCTS_PAGE_SIZE = 100
+RESTAURANTS_PAGE_SIZE = 20
+NEAREST_RESTAURANTS_COUNT = 5
+CLOSED_ORDER_STATUSES = ['completed', 'canceled']
+
+# соединение ленты живёт недолго, потом браузер переподключается сам
+FEED_STREAM_DURATION = 25
+FEED_POLL_INTERVAL = 1
+FEED_HEARTBEAT_INTERVAL = 10
+FEED_RETRY_MS = 1000
+FEED_BATCH_SIZE = 100
+# id в журнале изменений выделяются до коммита: изменение с меньшим id может
+# стать видно позже большего. Курсор ленты сдвигается только за изменения
+# старше этого числа секунд — транзакции, пишущие журнал, короче
+FEED_GAP_GRACE = 10
+
+# каждое соединение ленты занимает поток воркера на FEED_STREAM_DURATION
+_feed_slots = threading.BoundedSemaphore(max(settings.ORDER_FEED_MAX_STREAMS, 1))
 
 
 class Login(forms.Form):
@@ -33,6 +64,87 @@ class Login(forms.Form):
     )
 
 
+class OrdersFilter(forms.Form):
+    status = forms.ChoiceField(
+        label='Статус', required=False,
+        choices=[('', 'Необработанные'), *Order.STATUS_CHOICES],
+        widget=forms.Select(attrs={'class': 'form-control'})
+    )
+    payment_method = forms.ChoiceField(
+        label='Способ оплаты', required=False,
+        choices=[('', 'Любой'), *Order.PAYMENT_METHOD_CHOICES],
+        widget=forms.Select(attrs={'class': 'form-control'})
+    )
+    restaurant = forms.ModelChoiceField(
+        label='Ресторан', required=False,
+        queryset=Restaurant.objects.order_by('name'),
+        empty_label='Любой',
+        widget=forms.Select(attrs={'class': 'form-control'})
+    )
+    created_from = forms.DateField(
+        label='Создан с', required=False,
+        widget=forms.DateInput(attrs={'class': 'form-control', 'type': 'date'})
+    )
+    created_to = forms.DateField(
+        label='по', required=False,
+        widget=forms.DateInput(attrs={'class': 'form-control', 'type': 'date'})
+    )
+    after = forms.CharField(required=False, widget=forms.HiddenInput)
+
+    @staticmethod
+    def make_cursor(order):
+        return f'{order.created_at.isoformat()}_{order.id}'
+
+    def clean_after(self):
+        cursor = self.cleaned_data['after']
+        if not cursor:
+            return None
+        try:
+            created_at, order_id = cursor.rsplit('_', 1)
+            return datetime.fromisoformat(created_at), int(order_id)
+        except ValueError:
+            raise forms.ValidationError('Некорректная ссылка на страницу')
+
+    def filter_orders(self, orders):
+        """Фильтрует заказы и отрезает уже показанные по ключу (created_at, id)"""
+        filters = self.cleaned_data
+
+        if filters['status']:
+            orders = orders.filter(status=filters['status'])
+        else:
+            orders = orders.exclude(status__in=CLOSED_ORDER_STATUSES)
+        if filters['payment_method']:
+            orders = orders.filter(payment_method=filters['payment_method'])
+        if filters['restaurant']:
+            orders = orders.filter(cooking_restaurant=filters['restaurant'])
+        orders = orders.created_between(filters['created_from'], filters['created_to'])
+        if filters['after']:
+            created_at, order_id = filters['after']
+            orders = orders.filter(
+                Q(created_at__lt=created_at) |
+                Q(created_at=created_at, id__lt=order_id)
+            )
+
+        return orders.order_by('-created_at', '-id')
+
+
+class OrdersExportForm(forms.Form):
+    """Выгрузка для аналитики: как у команды export_orders, по умолчанию все статусы"""
+    status = forms.MultipleChoiceField(choices=Order.STATUS_CHOICES, required=False)
+    created_from = forms.DateField(required=False)
+    created_to = forms.DateField(required=False)
+    format = forms.ChoiceField(choices=[(name, name) for name in EXPORT_FORMATS], initial='csv', required=False)
+    gzip = forms.BooleanField(required=False)
+
+    def filter_orders(self, orders):
+        return filter_orders_for_export(
+            orders,
+            created_from=self.cleaned_data['created_from'],
+            created_to=self.cleaned_data['created_to'],
+            statuses=self.cleaned_data['status'],
+        )
+
+
 class LoginView(View):
     def get(self, request, *args, **kwargs):
         form = Login()
@@ -68,23 +180,25 @@ def is_manager(user):
     return user.is_staff  
 
 
+@query_budget(7)
 @user_passes_test(is_manager, login_url='restaurateur:login')
 def view_products(request):
-    restaurants = list(Restaurant.objects.order_by('name'))
-    products = list(Product.objects.prefetch_related('menu_items'))
-
-    products_with_restaurant_availability = []
-    for product in products:
-        availability = {item.restaurant_id: item.availability for item in product.menu_items.all()}
-        ordered_availability = [availability.get(restaurant.id, False) for restaurant in restaurants]
+    matrix = get_availability_matrix()
+    products_page = Paginator(matrix['products'], PRODUCTS_PAGE_SIZE).get_page(request.GET.get('page'))
+    restaurants_page = Paginator(matrix['restaurants'], RESTAURANTS_PAGE_SIZE) \
+        .get_page(request.GET.get('restaurants_page'))
+    restaurant_ids = [restaurant_id for restaurant_id, _ in restaurants_page]
 
-        products_with_restaurant_availability.append(
-            (product, ordered_availability)
-        )
+    products_with_restaurant_availability = [
+        (product, [bool(product['mask'] >> restaurant_id & 1) for restaurant_id in restaurant_ids])
+        for product in products_page
+    ]
 
     return render(request, template_name="products_list.html", context={
         'products_with_restaurant_availability': products_with_restaurant_availability,
-        'restaurants': restaurants,
+        'restaurants': [name for _, name in restaurants_page],
+        'products_page': products_page,
+        'restaurants_page': restaurants_page,
     })
 
 
@@ -95,84 +209,73 @@ def view_restaurants(request):
     })
 
 def get_addresses_coordinates(addresses):
+    """Координаты известных адресов; неизвестные ставятся в очередь геокодирования
+
+    Возвращает словарь адрес -> (широта, долгота) или None и множество
+    адресов, которые ещё ждут геокодирования.
+    """
+    coordinates_dict = dict.fromkeys(addresses)
+
+    locations_by_address = get_cached_locations(addresses)
+    pending_addresses = {
+        address
+        for address, location in locations_by_address.items()
+        if location is None or is_pending(location)
+    }
+    for address, location in locations_by_address.items():
+        if location:
+            coordinates_dict[address] = get_coordinates(location)
+
+    enqueue_addresses(
+        address for address, location in locations_by_address.items() if location is None
+    )
 
-    coordinates_dict = {}
-
-    existing_locations = Location.objects.filter(address__in=addresses)
-    for location in existing_locations:
-        if location.latitude and location.longitude:
-            coordinates_dict[location.address] = (location.latitude, location.longitude)
-
-    for address in addresses:
-        if address not in coordinates_dict:
-            location = get_or_create_location(address)
-            if location and location.latitude and location.longitude:
-                coordinates_dict[address] = (location.latitude, location.longitude)
-            else:
-                coordinates_dict[address] = None
-
-    return coordinates_dict
-
-
-def calculate_distance(coord1, coord2):
-    if not coord1 or not coord2:
-        return None
+    return coordinates_dict, pending_addresses
 
-    try:
-        return distance(coord1, coord2).km
-    except Exception:
-        return None
-
-@user_passes_test(is_manager, login_url='restaurateur:login')
-def view_orders(request):
-    orders = Order.objects.exclude(
-        status__in=['completed', 'canceled']
-    ).select_related('cooking_restaurant').prefetch_related(
-        Prefetch('items', queryset=OrderItem.objects.select_related('product'))
-    ).with_total_cost().order_by('-created_at')
 
-    order_addresses = set(orders.values_list('address', flat=True))
-    restaurant_addresses = set(Restaurant.objects.values_list('address', flat=True))
-    all_addresses = order_addresses.union(restaurant_addresses)
-    coordinates_dict = get_addresses_coordinates(all_addresses)
+def serialize_orders(orders):
+    """Готовит строки таблицы заказов: состав, сумму и ближайшие рестораны-кандидаты"""
+    restaurants_dict = {restaurant.id: restaurant for restaurant in Restaurant.objects.all()}
 
-    all_restaurants = Restaurant.objects.prefetch_related(
-        Prefetch('menu_items',
-                 queryset=RestaurantMenuItem.objects.filter(availability=True)
-                 .select_related('product'))
+    # координаты приходят JOIN'ом; по адресу ищутся только заказы,
+    # ещё не связанные с местоположением
+    coordinates_dict, pending_addresses = get_addresses_coordinates(
+        {order.address for order in orders if order.location is None}
     )
-
-    restaurant_products = defaultdict(set)
-    for restaurant in all_restaurants:
-        for menu_item in restaurant.menu_items.all():
-            restaurant_products[restaurant.id].add(menu_item.product.id)
-
-    restaurants_dict = {restaurant.id: restaurant for restaurant in all_restaurants}
+    for order in orders:
+        if order.location is not None:
+            coordinates_dict[order.address] = get_coordinates(order.location)
+            if is_pending(order.location):
+                pending_addresses.add(order.address)
+
+    ordered_product_ids = {
+        item.product_id
+        for order in orders
+        for item in order.items.all()
+    }
+    availability_masks = get_availability_masks(ordered_product_ids)
+    restaurant_index = get_restaurant_index()
 
     orders_data = []
     for order in orders:
 
-        order_product_ids = {item.product.id for item in order.items.all()}
-
-        available_restaurants = []
-        if not order.cooking_restaurant and order_product_ids:
-            for restaurant_id, available_products in restaurant_products.items():
-                if order_product_ids.issubset(available_products):
-                    restaurant = restaurants_dict[restaurant_id]
-                    available_restaurants.append(restaurant)
+        order_product_ids = {item.product_id for item in order.items.all()}
+        order_coordinates = coordinates_dict.get(order.address)
 
         available_restaurants_with_distances = []
-        for restaurant in available_restaurants:
-            distance = calculate_distance(
-                coordinates_dict.get(order.address),
-                coordinates_dict.get(restaurant.address)
+        if not order.cooking_restaurant and order_product_ids:
+            candidate_restaurants = list_candidate_restaurants(
+                order_coordinates,
+                get_capable_restaurant_ids(order_product_ids, availability_masks),
+                k=NEAREST_RESTAURANTS_COUNT,
+                method=settings.ORDER_DISTANCE_METHOD,
+                index=restaurant_index,
             )
-            available_restaurants_with_distances.append({
-                'restaurant': restaurant,
-                'distance': distance
-            })
-
-        available_restaurants_with_distances.sort(key=lambda x: (x['distance'] is None, x['distance']))
+            available_restaurants_with_distances = [
+                {'restaurant': restaurants_dict[restaurant_id], 'distance': distance}
+                for restaurant_id, distance in candidate_restaurants
+                if restaurant_id in restaurants_dict
+            ]
 
         order_info = {
             'id': order.id,
@@ -188,10 +291,11 @@ def view_orders(request):
             'called_at': order.called_at,
             'delivered_at': order.delivered_at,
             'products': [],
-            'total_amount': order.total_cost or  0,
+            'total_amount': order.total_cost,
             'cooking_restaurant': order.cooking_restaurant,
             'available_restaurants': available_restaurants_with_distances,
-            'is_address_found': coordinates_dict.get(order.address) is not None
+            'is_address_found': order_coordinates is not None,
+            'is_address_pending': order.address in pending_addresses,
         }
 
 
@@ -200,7 +304,201 @@ def view_orders(request):
             order_info['products'].append(product_info)
 
         orders_data.append(order_info)
-        
+
+    return orders_data
+
+
+def get_orders_with_items():
+    return Order.objects.select_related('cooking_restaurant', 'location').prefetch_related(
+        Prefetch('items', queryset=OrderItem.objects.select_related('product'))
+    )
+
+
+@query_budget(14)
+@user_passes_test(is_manager, login_url='restaurateur:login')
+def view_orders(request):
+    filter_form = OrdersFilter(request.GET)
+    orders_data = []
+    next_page_url = None
+    # курсор ленты берём до выборки заказов, чтобы не пропустить изменения между ними;
+    # недавние изменения лента пришлёт повторно, их строки просто перерисуются
+    feed_cursor = get_settled_feed_cursor()
+
+    if filter_form.is_valid():
+        orders = filter_form.filter_orders(get_orders_with_items())
+        orders = list(orders[:ORDERS_PAGE_SIZE + 1])
+
+        if len(orders) > ORDERS_PAGE_SIZE:
+            orders = orders[:ORDERS_PAGE_SIZE]
+            next_page_query = request.GET.copy()
+            next_page_query['after'] = OrdersFilter.make_cursor(orders[-1])
+            next_page_url = f'?{next_page_query.urlencode()}'
+
+        orders_data = serialize_orders(orders)
+
+    first_page_query = request.GET.copy()
+    first_page_query.pop('after', None)
+
+    # выгружается история за выбранные даты; статус — только если выбран явно,
+    # иначе все, включая закрытые заказы
+    export_query = QueryDict(mutable=True)
+    for field in ['status', 'created_from', 'created_to']:
+        if request.GET.get(field):
+            export_query[field] = request.GET[field]
+
     return render(request, template_name='order_items.html', context={
-        'orders': orders_data
+        'orders': orders_data,
+        'filter_form': filter_form,
+        'next_page_url': next_page_url,
+        'first_page_url': f'?{first_page_query.urlencode()}',
+        'is_first_page': not request.GET.get('after'),
+        'is_live': not any(request.GET.values()) and settings.ORDER_FEED_MAX_STREAMS > 0,
+        'feed_cursor': feed_cursor,
+        'orders_page_url': request.get_full_path(),
+        'export_url': f"{reverse('restaurateur:export_orders')}?{export_query.urlencode()}",
     })
+
+
+def get_settled_feed_cursor():
+    """Последний id журнала, за которым уже не появятся изменения с меньшим id"""
+    settled_before = timezone.now() - timedelta(seconds=FEED_GAP_GRACE)
+    return OrderChange.objects.filter(created_at__lte=settled_before).aggregate(last_id=Max('id'))['last_id'] or 0
+
+
+def render_order_events(changes, orders_page_url, cursor):
+    """SSE-сообщения с новой HTML-строкой для каждого изменившегося заказа"""
+    order_ids = {change.order_id for change in changes}
+    orders = list(
+        get_orders_with_items()
+        .filter(pk__in=order_ids)
+        .exclude(status__in=CLOSED_ORDER_STATUSES)
+        .order_by('-created_at', '-id')
+    )
+
+    events = [
+        {
+            'id': order_info['id'],
+            'created_at': order_info['created_at'].isoformat(),
+            'html': render_to_string('order_row.html', {
+                'order': order_info,
+                'orders_page_url': orders_page_url,
+            }),
+        }
+        for order_info in serialize_orders(orders)
+    ]
+    # закрытые и удалённые заказы убираются со страницы
+    events.extend(
+        {'id': order_id, 'removed': True}
+        for order_id in order_ids - {order.id for order in orders}
+    )
+
+    messages = [f'event: order\ndata: {json.dumps(event)}\n' for event in events]
+    # курсор только у последнего сообщения пачки: при обрыве
+    # соединения браузер перезапросит пачку целиком
+    messages.append(f'id: {cursor}\nevent: cursor\ndata: {cursor}\n')
+    return '\n'.join(messages) + '\n'
+
+
+def advance_feed_cursor(cursor, sent):
+    """Сдвигает курсор за отправленные изменения старше FEED_GAP_GRACE.
+
+    sent — {id: время изменения} для отправленных изменений после курсора;
+    пропуски ниже нового курсора считаются откатившимися транзакциями.
+    """
+    settled_before = timezone.now() - timedelta(seconds=FEED_GAP_GRACE)
+    settled_ids = [change_id for change_id, created_at in sent.items() if created_at <= settled_before]
+    if settled_ids:
+        cursor = max(cursor, *settled_ids)
+        for change_id in [change_id for change_id in sent if change_id <= cursor]:
+            del sent[change_id]
+    return cursor
+
+
+def stream_order_changes(cursor, orders_page_url):
+    """Изменения после курсора; недавние перечитываются, чтобы не пропустить
+    изменение, чья транзакция закоммитилась позже следующей"""
+    yield f'retry: {FEED_RETRY_MS}\n\n'
+
+    sent = {}
+    started_at = last_message_at = time.monotonic()
+    while True:
+        changes = list(
+            OrderChange.objects.filter(id__gt=cursor).exclude(id__in=list(sent))
+            .order_by('id')[:FEED_BATCH_SIZE]
+        )
+        sent.update((change.id, change.created_at) for change in changes)
+        cursor = advance_feed_cursor(cursor, sent)
+        now = time.monotonic()
+        if changes:
+            last_message_at = now
+            yield render_order_events(changes, orders_page_url, cursor)
+            continue
+
+        if now - started_at >= FEED_STREAM_DURATION:
+            return
+        if now - last_message_at >= FEED_HEARTBEAT_INTERVAL:
+            last_message_at = now
+            yield ': ping\n\n'
+        time.sleep(FEED_POLL_INTERVAL)
+
+
+class FeedStream:
+    """Лента, которая возвращает место в пуле соединений, когда ответ закрыт"""
+
+    def __init__(self, events):
+        self.events = events
+        self.released = False
+
+    def __iter__(self):
+        return iter(self.events)
+
+    def close(self):
+        self.events.close()
+        if not self.released:
+            self.released = True
+            _feed_slots.release()
+
+
+@user_passes_test(is_manager, login_url='restaurateur:login')
+def order_changes_feed(request):
+    """Лента изменений необработанных заказов в формате server-sent events"""
+    cursor = request.headers.get('Last-Event-ID') or request.GET.get('after')
+    try:
+        cursor = int(cursor)
+    except (TypeError, ValueError):
+        return HttpResponseBadRequest('Укажите курсор ленты в параметре after')
+
+    if settings.ORDER_FEED_MAX_STREAMS <= 0 or not _feed_slots.acquire(blocking=False):
+        # 204 останавливает переподключения: страница работает без живых обновлений
+        return HttpResponse(status=204)
+
+    response = StreamingHttpResponse(
+        FeedStream(stream_order_changes(cursor, reverse('restaurateur:view_orders'))),
+        content_type='text/event-stream',
+    )
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+@user_passes_test(is_manager, login_url='restaurateur:login')
+def export_orders_view(request):
+    """Выгрузка заказов потоком, без загрузки всей выборки в память"""
+    form = OrdersExportForm(request.GET)
+    if not form.is_valid():
+        return HttpResponseBadRequest(form.errors.as_text())
+
+    export_format = form.cleaned_data['format'] or 'csv'
+    orders = form.filter_orders(Order.objects.all())
+    filename = f'orders.{export_format}'
+    content_type = EXPORT_FORMATS[export_format]
+    if form.cleaned_data['gzip']:
+        filename += '.gz'
+        content_type = 'application/gzip'
+
+    response = StreamingHttpResponse(
+        export_orders(orders, export_format, compress=form.cleaned_data['gzip']),
+        content_type=content_type,
+    )
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
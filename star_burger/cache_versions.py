@@ -0,0 +1,44 @@
+"""Версии записей в общем кэше.
+
+Ключ записи содержит номер версии; чтобы сбросить все записи разом,
+достаточно увеличить номер — старые просто перестают читаться.
+
+Если кэш живёт в памяти процесса (locmem без CACHE_URL), увеличение версии
+видит только сам процесс. Тогда версия хранится недолго: истёкшую процесс
+заменяет новой и сам перечитывает данные, так что чужие изменения доходят
+до него не позже чем через LOCAL_CACHE_VERSION_TIMEOUT секунд. В продакшене
+нужен общий кэш — об этом предупреждает manage.py check --deploy.
+"""
+import time
+
+from django.core.cache import cache, caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+
+
+LOCAL_CACHE_VERSION_TIMEOUT = 30
+
+
+def is_process_local_cache():
+    return isinstance(caches['default'], (LocMemCache, DummyCache))
+
+
+def get_version_timeout():
+    return LOCAL_CACHE_VERSION_TIMEOUT if is_process_local_cache() else None
+
+
+def get_cache_version(key):
+    version = cache.get(key)
+    if version is None:
+        # начинаем не с единицы, чтобы после очистки кэша
+        # не прочитать запись, оставшуюся от прошлой версии
+        cache.add(key, time.time_ns(), timeout=get_version_timeout())
+        version = cache.get(key)
+    return version
+
+
+def bump_cache_version(key):
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, time.time_ns(), timeout=get_version_timeout())
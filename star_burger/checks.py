@@ -0,0 +1,18 @@
+from django.core import checks
+
+from .cache_versions import LOCAL_CACHE_VERSION_TIMEOUT, is_process_local_cache
+
+
+@checks.register(checks.Tags.caches, deploy=True)
+def check_shared_cache(app_configs, **kwargs):
+    if not is_process_local_cache():
+        return []
+    return [
+        checks.Warning(
+            'Кэш по умолчанию живёт в памяти процесса: сброс каталога, индекса '
+            'ресторанов и координат не доходит до других процессов и воркеров, '
+            f'они отдают старые данные до {LOCAL_CACHE_VERSION_TIMEOUT} секунд.',
+            hint='Укажите общий кэш в CACHE_URL, например redis://127.0.0.1:6379/0.',
+            id='star_burger.W001',
+        )
+    ]
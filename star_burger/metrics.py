@@ -0,0 +1,218 @@
+"""Лёгкие метрики запросов: время, SQL, повторяющиеся запросы, геокодер, автоназначение
+и кэш координат.
+
+Счётчики живут в памяти процесса, поэтому при нескольких воркерах gunicorn
+каждый отдаёт свои значения — Prometheus суммирует их сам.
+"""
+import contextvars
+import hmac
+import threading
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.http import Http404, HttpResponse, HttpResponseForbidden
+
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# одинаковый SQL столько раз за запрос — почти наверняка N+1
+DUPLICATE_QUERY_THRESHOLD = 5
+
+current_request_stats = contextvars.ContextVar('current_request_stats', default=None)
+
+
+class QueryBudgetExceeded(Exception):
+    """Представление сделало больше SQL-запросов, чем объявлено в query_budget"""
+
+
+class RequestStats:
+    """Статистика одного запроса; заполняется обёрткой execute_wrapper и геокодером"""
+
+    def __init__(self):
+        self.started_at = time.perf_counter()
+        self.db_time = 0
+        self.queries = Counter()
+        self.geocoder_calls = 0
+        self.geocoder_time = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        started_at = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_time += time.perf_counter() - started_at
+            self.queries[sql] += 1
+
+    @property
+    def query_count(self):
+        return sum(self.queries.values())
+
+    @property
+    def duplicate_query_count(self):
+        return sum(count - 1 for count in self.queries.values())
+
+    def get_repeated_queries(self, threshold=DUPLICATE_QUERY_THRESHOLD):
+        return [(sql, count) for sql, count in self.queries.most_common() if count >= threshold]
+
+
+class MetricsRegistry:
+    """Потокобезопасные счётчики по представлениям в формате Prometheus"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.requests = Counter()
+        self.duration_sum = Counter()
+        self.duration_buckets = defaultdict(Counter)
+        self.db_time_sum = Counter()
+        self.queries_sum = Counter()
+        self.duplicate_queries_sum = Counter()
+        self.budget_violations = Counter()
+        self.geocoder_calls = 0
+        self.geocoder_errors = 0
+        self.geocoder_time_sum = 0
+        self.assignment_runs = 0
+        self.assignment_duration_sum = 0
+        self.assignment_checked = 0
+        self.assignment_assigned = 0
+        self.location_cache = Counter()
+
+    def observe_request(self, view, method, status, duration, stats, budget_exceeded=False):
+        with self.lock:
+            self.requests[(view, method, status)] += 1
+            self.duration_sum[view] += duration
+            for bucket in DURATION_BUCKETS:
+                if duration <= bucket:
+                    self.duration_buckets[view][bucket] += 1
+            self.duration_buckets[view]['+Inf'] += 1
+            self.db_time_sum[view] += stats.db_time
+            self.queries_sum[view] += stats.query_count
+            self.duplicate_queries_sum[view] += stats.duplicate_query_count
+            if budget_exceeded:
+                self.budget_violations[view] += 1
+
+    def observe_geocoder_call(self, duration, failed=False):
+        with self.lock:
+            self.geocoder_calls += 1
+            self.geocoder_time_sum += duration
+            if failed:
+                self.geocoder_errors += 1
+
+    def observe_assignment(self, duration, checked, assigned):
+        with self.lock:
+            self.assignment_runs += 1
+            self.assignment_duration_sum += duration
+            self.assignment_checked += checked
+            self.assignment_assigned += assigned
+
+    def observe_location_cache(self, local_hits, shared_hits, misses):
+        with self.lock:
+            self.location_cache['local'] += local_hits
+            self.location_cache['shared'] += shared_hits
+            self.location_cache['miss'] += misses
+
+    def render(self):
+        with self.lock:
+            lines = [
+                '# TYPE starburger_requests_total counter',
+                *(
+                    f'starburger_requests_total{{view="{view}",method="{method}",status="{status}"}} {count}'
+                    for (view, method, status), count in sorted(self.requests.items())
+                ),
+                '# TYPE starburger_request_duration_seconds histogram',
+            ]
+            for view, buckets in sorted(self.duration_buckets.items()):
+                for bucket in (*DURATION_BUCKETS, '+Inf'):
+                    lines.append(
+                        f'starburger_request_duration_seconds_bucket{{view="{view}",le="{bucket}"}} {buckets[bucket]}'
+                    )
+                lines.append(f'starburger_request_duration_seconds_sum{{view="{view}"}} {self.duration_sum[view]:.6f}')
+                lines.append(f'starburger_request_duration_seconds_count{{view="{view}"}} {buckets["+Inf"]}')
+
+            for name, kind, values in [
+                ('starburger_db_time_seconds_total', 'counter', self.db_time_sum),
+                ('starburger_db_queries_total', 'counter', self.queries_sum),
+                ('starburger_db_duplicate_queries_total', 'counter', self.duplicate_queries_sum),
+                ('starburger_query_budget_violations_total', 'counter', self.budget_violations),
+            ]:
+                lines.append(f'# TYPE {name} {kind}')
+                lines.extend(f'{name}{{view="{view}"}} {value}' for view, value in sorted(values.items()))
+
+            lines.extend([
+                '# TYPE starburger_geocoder_requests_total counter',
+                f'starburger_geocoder_requests_total {self.geocoder_calls}',
+                '# TYPE starburger_geocoder_errors_total counter',
+                f'starburger_geocoder_errors_total {self.geocoder_errors}',
+                '# TYPE starburger_geocoder_time_seconds_total counter',
+                f'starburger_geocoder_time_seconds_total {self.geocoder_time_sum:.6f}',
+                '# TYPE starburger_assignment_runs_total counter',
+                f'starburger_assignment_runs_total {self.assignment_runs}',
+                '# TYPE starburger_assignment_duration_seconds_total counter',
+                f'starburger_assignment_duration_seconds_total {self.assignment_duration_sum:.6f}',
+                '# TYPE starburger_assignment_orders_total counter',
+                f'starburger_assignment_orders_total{{result="checked"}} {self.assignment_checked}',
+                f'starburger_assignment_orders_total{{result="assigned"}} {self.assignment_assigned}',
+                '# TYPE starburger_location_cache_lookups_total counter',
+                *(
+                    f'starburger_location_cache_lookups_total{{result="{result}"}} {self.location_cache[result]}'
+                    for result in ('local', 'shared', 'miss')
+                ),
+            ])
+        return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry()
+
+
+@contextmanager
+def track_geocoder_call():
+    """Учитывает обращение к геокодеру в метриках процесса и текущего запроса"""
+    started_at = time.perf_counter()
+    failed = False
+    try:
+        yield
+    except Exception:
+        failed = True
+        raise
+    finally:
+        duration = time.perf_counter() - started_at
+        registry.observe_geocoder_call(duration, failed=failed)
+        stats = current_request_stats.get()
+        if stats is not None:
+            stats.geocoder_calls += 1
+            stats.geocoder_time += duration
+
+
+def query_budget(max_queries):
+    """Объявляет, сколько SQL-запросов может сделать представление.
+
+    Проверяет InstrumentationMiddleware: под тестовым раннером превышение
+    поднимает QueryBudgetExceeded, при обычной работе пишется в лог.
+    Бюджет берётся с запасом над числом запросов из тестов.
+    Декоратор ставится самым внешним, над api_view и user_passes_test.
+    max_queries может быть функцией без аргументов, если объём работы
+    представления зависит от настроек.
+    """
+    def decorator(view):
+        view.query_budget = max_queries
+        return view
+    return decorator
+
+
+def metrics_view(request):
+    """Счётчики в текстовом формате Prometheus.
+
+    Если задан METRICS_TOKEN, нужен заголовок Authorization: Bearer <токен>;
+    без токена страница открыта только в режиме отладки.
+    """
+    if settings.METRICS_TOKEN:
+        authorization = request.headers.get('Authorization', '')
+        if not hmac.compare_digest(authorization, f'Bearer {settings.METRICS_TOKEN}'):
+            return HttpResponseForbidden()
+    elif not settings.DEBUG:
+        raise Http404
+    return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
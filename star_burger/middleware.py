@@ -0,0 +1,80 @@
+import json
+import logging
+import time
+
+from django.conf import settings
+from django.db import connection
+
+from .metrics import QueryBudgetExceeded, RequestStats, current_request_stats, registry
+
+
+logger = logging.getLogger('star_burger.metrics')
+
+
+class InstrumentationMiddleware:
+    """Замеряет каждый запрос: время, SQL, повторы запросов и обращения к геокодеру.
+
+    Итог пишется одной JSON-строкой в лог star_burger.metrics и копится
+    в счётчиках для /metrics. Для потоковых ответов учитывается только
+    подготовка ответа, не сама лента.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        stats = RequestStats()
+        token = current_request_stats.set(stats)
+        try:
+            with connection.execute_wrapper(stats):
+                response = self.get_response(request)
+        finally:
+            current_request_stats.reset(token)
+
+        duration = time.perf_counter() - stats.started_at
+        view_name = getattr(request, 'instrumented_view', None) or 'unresolved'
+        budget = getattr(request, 'query_budget', None)
+        budget_exceeded = budget is not None and stats.query_count > budget
+
+        registry.observe_request(
+            view_name, request.method, response.status_code, duration, stats,
+            budget_exceeded=budget_exceeded,
+        )
+        self.log_request(request, response, view_name, duration, stats, budget)
+
+        if budget_exceeded and settings.QUERY_BUDGET_STRICT:
+            raise QueryBudgetExceeded(
+                f'{view_name}: {stats.query_count} SQL-запросов при бюджете {budget}\n'
+                + '\n'.join(f'{count}× {sql}' for sql, count in stats.queries.most_common(5))
+            )
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request.instrumented_view = request.resolver_match.view_name or request.resolver_match.route
+        budget = getattr(view_func, 'query_budget', None)
+        request.query_budget = budget() if callable(budget) else budget
+
+    def log_request(self, request, response, view_name, duration, stats, budget):
+        record = {
+            'view': view_name,
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'duration_ms': round(duration * 1000, 2),
+            'db_time_ms': round(stats.db_time * 1000, 2),
+            'queries': stats.query_count,
+            'duplicate_queries': stats.duplicate_query_count,
+            'geocoder_calls': stats.geocoder_calls,
+            'geocoder_time_ms': round(stats.geocoder_time * 1000, 2),
+        }
+        if budget is not None:
+            record['query_budget'] = budget
+
+        repeated_queries = stats.get_repeated_queries()
+        if repeated_queries or (budget is not None and stats.query_count > budget):
+            record['repeated_queries'] = [
+                {'sql': sql, 'count': count} for sql, count in repeated_queries
+            ]
+            logger.warning(json.dumps(record, ensure_ascii=False))
+        else:
+            logger.info(json.dumps(record, ensure_ascii=False))
@@ -1,6 +1,7 @@
 import os
 
 import dj_database_url
+import django_cache_url
 
 from environs import Env
 
@@ -30,10 +31,12 @@ INSTALLED_APPS = [
     'debug_toolbar',
     'phonenumber_field',
     'rest_framework',
+    'rest_framework.authtoken',
 ]
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'star_burger.middleware.InstrumentationMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -45,6 +48,30 @@ MIDDLEWARE = [
 
 ROOT_URLCONF = 'star_burger.urls'
 
+TEST_RUNNER = 'star_burger.test_runner.StrictQueryBudgetRunner'
+
+# превышение бюджета SQL-запросов у представления пишется в лог; исключение
+# поднимается только под StrictQueryBudgetRunner, когда ответ уже не важен
+QUERY_BUDGET_STRICT = False
+METRICS_TOKEN = env('METRICS_TOKEN', '')
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        'star_burger.metrics': {
+            'handlers': ['console'],
+            'level': env('METRICS_LOG_LEVEL', 'INFO'),
+            'propagate': False,
+        },
+    },
+}
+
 DEBUG_TOOLBAR_PANELS = [
     'debug_toolbar.panels.versions.VersionsPanel',
     'debug_toolbar.panels.timer.TimerPanel',
@@ -83,6 +110,14 @@ WSGI_APPLICATION = 'star_burger.wsgi.application'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 MEDIA_URL = '/media/'
 
+# redis://, memcached:// и т.д.; без CACHE_URL — память процесса
+CACHES = {
+    'default': django_cache_url.config(default='locmem://'),
+}
+
+# сколько адресов держать в памяти процесса поверх общего кэша
+LOCATION_CACHE_SIZE = env.int('LOCATION_CACHE_SIZE', 10000)
+
 DATABASES = {
     'default': dj_database_url.config(
         default='sqlite:////{0}'.format(os.path.join(BASE_DIR, 'db.sqlite3'))
@@ -126,4 +161,35 @@ STATICFILES_DIRS = [
     os.path.join(BASE_DIR, "bundles"),
 ]
 
-YANDEX_GEOCODER_APIKEY = env('YANDEX_GEOCODER_APIKEY')
\ No newline at end of file
+YANDEX_GEOCODER_APIKEY = env('YANDEX_GEOCODER_APIKEY')
+YANDEX_GEOCODER_URL = env('YANDEX_GEOCODER_URL', 'https://geocode-maps.yandex.ru/1.x')
+
+# haversine — быстрый векторный расчёт, geodesic — точный, но попарный
+ORDER_DISTANCE_METHOD = env('ORDER_DISTANCE_METHOD', 'haversine')
+
+# сколько секунд повтор запроса с тем же Idempotency-Key получает сохранённый ответ
+IDEMPOTENCY_KEY_TTL = env.int('IDEMPOTENCY_KEY_TTL', 60 * 60 * 24)
+
+# сколько соединений ленты заказов менеджера держит один процесс: каждое
+# занимает поток воркера до 25 секунд; 0 — лента выключена
+ORDER_FEED_MAX_STREAMS = env.int('ORDER_FEED_MAX_STREAMS', 4)
+# сколько дней хранить журнал изменений заказов для ленты
+ORDER_CHANGES_RETENTION_DAYS = env.int('ORDER_CHANGES_RETENTION_DAYS', 7)
+
+# сколько заказов принимает /api/orders/batch/ за один запрос
+ORDER_BATCH_MAX_SIZE = env.int('ORDER_BATCH_MAX_SIZE', 500)
+
+REST_FRAMEWORK = {
+    'DEFAULT_THROTTLE_RATES': {
+        # пачек в минуту от одного партнёра или колл-центра
+        'order_batch': env('ORDER_BATCH_THROTTLE_RATE', '30/min'),
+    },
+}
+
+# автоназначение ресторана: сразу после заказа и после геокодирования адреса;
+# с False заказы разбирает только команда assign_orders
+ORDER_AUTO_ASSIGNMENT = env.bool('ORDER_AUTO_ASSIGNMENT', True)
+# во сколько километров обходится каждый открытый заказ ресторана
+ASSIGNMENT_LOAD_PENALTY_KM = env.float('ASSIGNMENT_LOAD_PENALTY_KM', 0.5)
+# ресторан с таким числом открытых заказов новых не получает; 0 — без ограничения
+ASSIGNMENT_MAX_OPEN_ORDERS = env.int('ASSIGNMENT_MAX_OPEN_ORDERS', 20)
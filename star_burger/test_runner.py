@@ -0,0 +1,13 @@
+import logging
+
+from django.conf import settings
+from django.test.runner import DiscoverRunner
+
+
+class StrictQueryBudgetRunner(DiscoverRunner):
+    """В тестах превышение query_budget роняет запрос, а не только пишется в лог"""
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        settings.QUERY_BUDGET_STRICT = True
+        logging.getLogger('star_burger.metrics').setLevel(logging.WARNING)
@@ -0,0 +1,93 @@
+import tempfile
+import time
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core import checks
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.test import TestCase, override_settings
+from django.urls import path
+
+from .cache_versions import LOCAL_CACHE_VERSION_TIMEOUT, bump_cache_version, get_cache_version
+from .metrics import QueryBudgetExceeded, metrics_view, query_budget, registry, track_geocoder_call
+
+
+@query_budget(2)
+def repeated_queries_view(request):
+    for _ in range(int(request.GET.get('queries', 1))):
+        User.objects.filter(username='nobody').exists()
+    with track_geocoder_call():
+        pass
+    return HttpResponse('ok')
+
+
+urlpatterns = [
+    path('repeated/', repeated_queries_view, name='repeated'),
+    path('metrics', metrics_view, name='metrics'),
+]
+
+
+@override_settings(ROOT_URLCONF='star_burger.tests', METRICS_TOKEN='secret')
+class InstrumentationMiddlewareTest(TestCase):
+    def setUp(self):
+        registry.reset()
+
+    def test_metrics_are_collected_per_view(self):
+        self.client.get('/repeated/?queries=2')
+
+        response = self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer secret')
+
+        self.assertEqual(response.status_code, 200)
+        metrics = response.content.decode()
+        self.assertIn('starburger_requests_total{view="repeated",method="GET",status="200"} 1', metrics)
+        self.assertIn('starburger_db_queries_total{view="repeated"} 2', metrics)
+        self.assertIn('starburger_db_duplicate_queries_total{view="repeated"} 1', metrics)
+        self.assertIn('starburger_geocoder_requests_total 1', metrics)
+
+    def test_metrics_require_token(self):
+        response = self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer wrong')
+
+        self.assertEqual(response.status_code, 403)
+
+    def test_query_budget_is_enforced_in_strict_mode(self):
+        with self.assertLogs('star_burger.metrics', level='WARNING'):
+            with self.assertRaisesMessage(QueryBudgetExceeded, 'repeated: 3 SQL-запросов при бюджете 2'):
+                self.client.get('/repeated/?queries=3')
+
+    @override_settings(QUERY_BUDGET_STRICT=False)
+    def test_query_budget_is_logged_outside_strict_mode(self):
+        with self.assertLogs('star_burger.metrics', level='WARNING') as logs:
+            response = self.client.get('/repeated/?queries=5')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('"query_budget": 2', logs.output[0])
+        self.assertIn('"repeated_queries"', logs.output[0])
+        self.assertIn('starburger_query_budget_violations_total{view="repeated"} 1', registry.render())
+
+
+class CacheVersionTest(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_process_local_version_expires(self):
+        version = get_cache_version('test:version')
+        bump_cache_version('test:version')
+        self.assertEqual(get_cache_version('test:version'), version + 1)
+
+        # другой процесс не видит сброса, но через таймаут берёт новую версию
+        expired_at = time.time() + LOCAL_CACHE_VERSION_TIMEOUT + 1
+        with mock.patch('time.time', return_value=expired_at):
+            self.assertNotIn(get_cache_version('test:version'), (version, version + 1))
+
+    def test_deploy_check_requires_shared_cache(self):
+        def deploy_warnings():
+            return [
+                message.id for message in checks.run_checks(include_deployment_checks=True, tags=[checks.Tags.caches])
+            ]
+
+        self.assertIn('star_burger.W001', deploy_warnings())
+        with tempfile.TemporaryDirectory() as cache_dir, override_settings(CACHES={
+            'default': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': cache_dir},
+        }):
+            self.assertNotIn('star_burger.W001', deploy_warnings())